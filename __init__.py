@@ -1,7 +1,20 @@
-import controllers, structures, util
+import importlib
 
 __all__ = [
     "controllers",
     "structures",
     "util"
 ]
+
+
+def __getattr__(name):
+    # Subpackages are imported on first use, so importing the package costs nothing
+    if name in __all__:
+        module = importlib.import_module(name)
+        globals()[name] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
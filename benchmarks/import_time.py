@@ -0,0 +1,83 @@
+"""
+Import time of the core modules, each imported in a fresh interpreter as an ensemble worker would
+
+Fails (exit status 1) when importing one of them loads a heavy optional dependency, plotting, scipy and numba must
+only be loaded by the code paths using them. Run from the repository root:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --output imports.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CORE_MODULES = ('structures.ParticleStore', 'structures.Box', 'controllers.PhysicsController',
+                'controllers.SimulationController', 'controllers.TimestepController', 'util.Diagnostics',
+                'util.Trajectory', 'util.Checkpoint', 'util.Profiling')
+# None of these may be imported by the core modules
+FORBIDDEN = ('matplotlib', 'scipy', 'numba', 'PIL')
+
+# Prints the seconds the import took and the forbidden modules it loaded
+_PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(seconds, *sorted({{name.split('.')[0] for name in sys.modules}} & {forbidden!r}))
+"""
+
+
+def time_import(module: str, repeat: int) -> dict:
+    """
+    Best time of repeat imports of module, each in a new interpreter, and the forbidden modules it loaded
+    """
+    code = _PROBE.format(module=module, forbidden=set(FORBIDDEN))
+    seconds = []
+    loaded = set()
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True, capture_output=True,
+                                text=True).stdout.split()
+        seconds.append(float(output[0]))
+        loaded.update(output[1:])
+
+    return {'module': module, 'seconds': min(seconds), 'forbidden': sorted(loaded)}
+
+
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(description='Import time of the core modules of the physics simulator')
+    parser.add_argument('--modules', nargs='+', default=list(CORE_MODULES), help='modules to import')
+    parser.add_argument('--repeat', type=int, default=5, help='best of this many imports is kept')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to')
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    args = parse_arguments(arguments)
+
+    # Baseline, the interpreter alone
+    results = [time_import('sys', args.repeat)]
+    for module in args.modules:
+        results.append(time_import(module, args.repeat))
+
+    failed = False
+    for result in results:
+        line = f"{result['module']:<36} {result['seconds'] * 1e3:8.1f} ms"
+        if result['forbidden']:
+            failed = True
+            line += f"  imports {', '.join(result['forbidden'])}"
+        print(line)
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump({'python': sys.version, 'results': results}, file, indent=2)
+
+    if failed:
+        print(f"Core modules must not import {', '.join(FORBIDDEN)}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
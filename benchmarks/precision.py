@@ -0,0 +1,122 @@
+"""
+Accuracy and speed of float32 particle state against float64
+
+The same world is stepped three times:
+    float64: the reference
+    float32: particles stored and stepped in float32
+    float64 from a float32 start: the reference started from the initial state rounded to float32
+Collisions make trajectories chaotic, any difference grows with time whatever its cause. The third run shows how much
+of the float32 difference the initial rounding alone explains, the rest comes from float32 arithmetic. Run from the
+repository root:
+    python benchmarks/precision.py --particles 10000 --steps 500
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from controllers.SimulationController import SimulationController
+from util.Diagnostics import EnergyDiagnostics
+from run_benchmarks import build_world
+
+
+class PositionSampler:
+    """
+    Observer keeping a float64 copy of the positions every interval steps
+    """
+
+    def __init__(self, interval: int):
+        self.interval = interval
+        self.steps = []
+        self.positions = []
+        self._calls = 0
+
+    def __call__(self, simulation) -> None:
+        self._calls += 1
+        if self._calls % self.interval == 0:
+            self.steps.append(simulation.step_count)
+            self.positions.append(simulation.particle_store.positions.astype(np.float64))
+
+
+def run(world, dtype, args) -> dict:
+    simulation = SimulationController('VectorizedMechanics', collision_handler='DiscreteDetection',
+                                      collision_detection='UniformGrid', dtype=dtype)
+    simulation.generate_world(world)
+    simulation.particles = world.particles
+    simulation.physics.g = (0., -args.gravity)
+
+    diagnostics = EnergyDiagnostics(args.interval)
+    diagnostics.sample(simulation)
+    sampler = PositionSampler(args.interval)
+
+    start = time.perf_counter()
+    simulation.run(args.steps, args.dt, observers=[diagnostics, sampler])
+    seconds = time.perf_counter() - start
+
+    return {'dtype': np.dtype(dtype).name, 'seconds_per_step': seconds / args.steps,
+            'store_bytes': simulation.particle_store.nbytes, 'energy_drift': diagnostics.energy_drift()[1:],
+            'steps': sampler.steps, 'positions': sampler.positions}
+
+
+def rms_distance(first: list, second: list) -> np.ndarray:
+    return np.array([np.sqrt(((a - b) ** 2).sum(axis=1).mean()) for a, b in zip(first, second)])
+
+
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(description='Accuracy of float32 particle state against float64')
+    parser.add_argument('--particles', type=int, default=10000, help='number of particles')
+    parser.add_argument('--density', type=float, default=0.3, help='fraction of the box covered by particles')
+    parser.add_argument('--steps', type=int, default=500, help='number of steps')
+    parser.add_argument('--dt', type=float, default=0.001, help='time increment of a step (seconds)')
+    parser.add_argument('--gravity', type=float, default=1., help='downward gravitational acceleration (m/s^2)')
+    parser.add_argument('--interval', type=int, default=50, help='compare the runs every this many steps')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the initial state')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to')
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    args = parse_arguments(arguments)
+
+    def world(dtype):
+        built = build_world(args.particles, args.density, 'Monodisperse', seed=args.seed)
+        # Random initial velocities, build_world leaves particles at rest
+        store = built.particle_store
+        store.velocities[:] = np.random.default_rng(args.seed).normal(0., 0.1, (store.count, 2))
+        built.set_dtype(dtype)
+        return built
+
+    reference = run(world(np.float64), np.float64, args)
+    single = run(world(np.float32), np.float32, args)
+    rounded_world = world(np.float32)
+    rounded_world.set_dtype(np.float64)
+    rounded = run(rounded_world, np.float64, args)
+
+    float32_error = rms_distance(single['positions'], reference['positions'])
+    start_error = rms_distance(rounded['positions'], reference['positions'])
+
+    print(f"{args.particles} particles, {args.steps} steps of {args.dt}s")
+    for result in (reference, single):
+        print(f"  {result['dtype']:<8} {result['seconds_per_step'] * 1e3:8.2f} ms/step, "
+              f"state {result['store_bytes'] / 2 ** 20:7.2f} MiB, final energy drift {result['energy_drift'][-1]:.3e}")
+    print(f"  {'step':>6} {'float32 rms error':>18} {'float32 start only':>19} "
+          f"{'float64 drift':>14} {'float32 drift':>14}")
+    for row in zip(reference['steps'], float32_error, start_error, reference['energy_drift'], single['energy_drift']):
+        print(f"  {row[0]:>6} {row[1]:>18.3e} {row[2]:>19.3e} {row[3]:>14.3e} {row[4]:>14.3e}")
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump({'settings': vars(args), 'steps': reference['steps'],
+                       'float32_rms_error': float32_error.tolist(), 'start_rms_error': start_error.tolist(),
+                       'runs': [{key: result[key] for key in ('dtype', 'seconds_per_step', 'store_bytes')} |
+                                {'energy_drift': result['energy_drift'].tolist()}
+                                for result in (reference, single)]}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
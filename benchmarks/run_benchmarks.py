@@ -0,0 +1,298 @@
+"""
+Benchmarks of particle generation, collision detection, integration and full headless steps
+
+Run from the repository root, results are written as JSON so runs on different revisions can be compared:
+    python benchmarks/run_benchmarks.py --output before.json
+    python benchmarks/run_benchmarks.py --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from controllers.PhysicsController import PhysicsController
+from controllers.SimulationController import SimulationController
+from structures.Box import Box
+from util.ParticleGeneration import generate_particles_in_box
+
+DETECTION_MODES = ('PairWise', 'UniformGrid', 'SweepAndPrune', 'KDTree')
+GENERATION_METHODS = ('Rejection', 'Batched', 'Lattice')
+RADIUS_DISTRIBUTIONS = ('Monodisperse', 'Uniform', 'Bimodal')
+
+# Pure Python code paths scale badly, they are only run up to these sizes. The event driven engine predicts within
+# neighbouring cells (about linear in N) but handles its events one by one in Python, 3 s a step at 100k particles
+SIZE_LIMITS = {'PairWise': 2000, 'Rejection': 2000, 'iterate_position': 20000, 'ContinuousDetection': 50000}
+
+
+def radii_for(number_particles: int, density: float, distribution: str, rng) -> np.ndarray:
+    """
+    Radii of number_particles particles covering a fraction density of the unit box
+    """
+    if distribution == 'Monodisperse':
+        shape = np.ones(number_particles)
+    elif distribution == 'Uniform':
+        shape = rng.uniform(0.5, 1.5, number_particles)
+    elif distribution == 'Bimodal':
+        shape = np.where(rng.random(number_particles) < 0.8, 1., 3.)
+    else:
+        raise ValueError(f"Unknown radius distribution '{distribution}'")
+
+    # Scale so that the particles cover the requested area
+    return shape * np.sqrt(density / (np.pi * (shape * shape).sum()))
+
+
+def build_world(number_particles: int, density: float, distribution: str, seed: int = 0) -> Box:
+    world = Box((0.5, 0.5), (0., 0.), (0.5, 0.5))
+    radii = radii_for(number_particles, density, distribution, np.random.default_rng(seed))
+    generate_particles_in_box(number_particles, world, radii, method='Batched', seed=seed)
+
+    return world
+
+
+def measure(function, repeat: int, setup=None) -> dict:
+    """
+    Best wall time of repeat calls, and the peak memory allocated during one call
+    :param setup: called before each call, not measured
+    """
+    seconds = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+
+    # Separate run for memory, tracing slows allocations down
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'seconds': min(seconds), 'peak_bytes': peak}
+
+
+def bench_generation(number_particles, density, distribution, repeat):
+    for method in GENERATION_METHODS:
+        if number_particles > SIZE_LIMITS.get(method, np.inf):
+            continue
+
+        radii = radii_for(number_particles, density, distribution, np.random.default_rng(0))
+
+        def generate():
+            world = Box((0.5, 0.5), (0., 0.), (0.5, 0.5))
+            generate_particles_in_box(number_particles, world, radii, method=method, seed=0)
+
+        try:
+            result = measure(generate, repeat)
+        except (ValueError, RuntimeError) as error:
+            # Lattice can't hold dense polydisperse setups, rejection may never finish placing them
+            print(f"  generation {method}: skipped, {error}")
+            continue
+
+        yield {'benchmark': 'generate_particles_in_box', 'mode': method,
+               'rate': number_particles / result['seconds'], 'unit': 'particles/s', **result}
+
+
+def bench_detection(world, repeat):
+    number_particles = len(world.particles)
+    store = world.particle_store
+    saved = (store.positions.copy(), store.velocities.copy(), store.previous_positions.copy())
+
+    def restore():
+        store.positions[:], store.velocities[:], store.previous_positions[:] = saved
+
+    # Particles move a step between calls like in a run, broad phases keeping state across steps (SweepAndPrune's
+    # sort) would otherwise look better than they are
+    mover = PhysicsController('VectorizedMechanics', collision_handler='DiscreteDetection')
+    mover.g = np.zeros(2)
+
+    def advance():
+        mover.iterate_positions(world, 0.001)
+
+    for mode in DETECTION_MODES:
+        if number_particles > SIZE_LIMITS.get(mode, np.inf):
+            continue
+
+        physics = PhysicsController('VectorizedMechanics', collision_detection=mode,
+                                    collision_handler='DiscreteDetection')
+
+        def detect():
+            physics.detect_collisions(world.particles)
+
+        # Every mode goes through the same states
+        restore()
+        result = measure(detect, repeat, setup=advance)
+        yield {'benchmark': 'detect_collisions', 'mode': mode,
+               'rate': 1. / result['seconds'], 'unit': 'calls/s', **result}
+
+    restore()
+
+
+def bench_integration(world, repeat):
+    number_particles = len(world.particles)
+    store = world.particle_store
+    saved = (store.positions.copy(), store.velocities.copy(), store.previous_positions.copy())
+
+    def restore():
+        store.positions[:], store.velocities[:], store.previous_positions[:] = saved
+
+    physics = PhysicsController('SimpleMechanics', collision_handler='DiscreteDetection')
+    if number_particles <= SIZE_LIMITS['iterate_position']:
+        def iterate_each():
+            for particle in world.particles:
+                physics.iterate_position(particle, 0.01)
+            restore()
+
+        result = measure(iterate_each, repeat)
+        yield {'benchmark': 'iterate_position', 'mode': 'SimpleMechanics',
+               'rate': 1. / result['seconds'], 'unit': 'calls/s', **result}
+
+    physics = PhysicsController('VectorizedMechanics', collision_handler='DiscreteDetection')
+
+    def iterate_all():
+        physics.iterate_positions(world, 0.01)
+        restore()
+
+    result = measure(iterate_all, repeat)
+    yield {'benchmark': 'iterate_positions', 'mode': 'VectorizedMechanics',
+           'rate': 1. / result['seconds'], 'unit': 'calls/s', **result}
+
+
+def bench_steps(number_particles, density, distribution, steps, repeat):
+    setups = [('VectorizedMechanics', mode, 'DiscreteDetection') for mode in DETECTION_MODES] + \
+             [('VectorizedMechanics', 'UniformGrid', 'ContinuousDetection')]
+
+    for physics_type, mode, handler in setups:
+        if number_particles > min(SIZE_LIMITS.get(mode, np.inf), SIZE_LIMITS.get(handler, np.inf)):
+            continue
+
+        def run(trace_memory=False):
+            simulation = SimulationController(physics_type, collision_handler=handler, collision_detection=mode)
+            world = build_world(number_particles, density, distribution)
+            simulation.generate_world(world)
+            simulation.particles = world.particles
+            simulation.physics.g = np.zeros(2)
+
+            # Only the stepping is measured, not building the world
+            if trace_memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            simulation.run(steps, 0.001)
+            seconds = time.perf_counter() - start
+            if trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                return peak
+            return seconds
+
+        seconds = min(run() for _ in range(repeat))
+        peak = run(trace_memory=True)
+
+        yield {'benchmark': 'steps', 'mode': f"{mode}/{handler}", 'seconds': seconds / steps,
+               'rate': steps / seconds, 'unit': 'steps/s', 'peak_bytes': peak}
+
+
+def revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results: list, baseline_path: str) -> None:
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+
+    def key(result):
+        return (result['benchmark'], result['mode'], result['number_particles'], result['density'],
+                result['distribution'])
+
+    before = {key(result): result for result in baseline['results']}
+    print(f"\nCompared to {baseline_path} ({baseline['metadata']['revision'][:10]}), rate ratio new/old:")
+    for result in results:
+        if key(result) in before:
+            ratio = result['rate'] / before[key(result)]['rate']
+            print(f"  {result['benchmark']:<26}{result['mode']:<32}N={result['number_particles']:<8}"
+                  f"density={result['density']:<6}{result['distribution']:<14}{ratio:6.2f}x")
+
+
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the physics simulator')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000],
+                        help='particle counts to benchmark')
+    parser.add_argument('--densities', type=float, nargs='+', default=[0.05, 0.3],
+                        help='fractions of the box area covered by particles')
+    parser.add_argument('--distributions', nargs='+', default=['Monodisperse', 'Bimodal'],
+                        choices=RADIUS_DISTRIBUTIONS)
+    parser.add_argument('--benchmarks', nargs='+', default=['generation', 'detection', 'integration', 'steps'],
+                        choices=['generation', 'detection', 'integration', 'steps'])
+    parser.add_argument('--steps', type=int, default=20, help='steps per full step benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='best of this many runs is kept')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file to write the results to')
+    parser.add_argument('--compare', default=None, help='results file of an earlier run to compare against')
+
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    args = parse_arguments(arguments)
+
+    results = []
+    for number_particles in args.sizes:
+        for density in args.densities:
+            for distribution in args.distributions:
+                print(f"N={number_particles} density={density} {distribution}")
+                setup = {'number_particles': number_particles, 'density': density, 'distribution': distribution}
+
+                found = []
+                if 'generation' in args.benchmarks:
+                    found += bench_generation(number_particles, density, distribution, args.repeat)
+                if 'detection' in args.benchmarks or 'integration' in args.benchmarks:
+                    world = build_world(number_particles, density, distribution)
+                    if 'detection' in args.benchmarks:
+                        found += bench_detection(world, args.repeat)
+                    if 'integration' in args.benchmarks:
+                        found += bench_integration(world, args.repeat)
+                if 'steps' in args.benchmarks:
+                    found += bench_steps(number_particles, density, distribution, args.steps, args.repeat)
+
+                for result in found:
+                    print(f"  {result['benchmark']:<26}{result['mode']:<32}{result['rate']:>14.2f} {result['unit']:<12}"
+                          f"peak {result['peak_bytes'] / 2 ** 20:8.2f} MiB")
+                    results.append({**setup, **result})
+
+    output = {
+        'metadata': {
+            'revision': revision(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'arguments': vars(args),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(output, file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+    return output
+
+
+if __name__ == '__main__':
+    main()
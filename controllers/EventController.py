@@ -0,0 +1,469 @@
+import heapq
+import numpy as np
+
+from util.BroadPhase import _expand_ranges, minimum_image
+
+# Event partners below 0 are walls, -1 - (2 * axis + side) with side 0 for the lower wall and 1 for the upper one,
+# then sides of the particle's cell from CROSSING down, CROSSING - (2 * axis + side)
+CROSSING = -5
+NO_EVENT = np.iinfo(np.intp).min
+
+# Axis and direction of the walls then cell sides, in partner order
+_SIDE_AXES = np.array([0, 0, 1, 1, 0, 0, 1, 1])
+_SIDE_TOWARD = np.array([-1., 1., -1., 1., -1., 1., -1., 1.])
+
+
+def pair_collision_times(separation, relative_velocity, contact, period=None):
+    """
+    Time until each pair of particles touches, inf if it never does
+    Gravity accelerates everything the same way so relative motion is a straight line
+    :param separation: (K, 2) position of the first particle of each pair relative to the second
+    :param relative_velocity: (K, 2) velocity of the first particle relative to the second
+    :param contact: (K,) distance at which each pair touches, the sum of their radii
+    :param period: (2,) sides of a periodic box, the nearest image and the ones around it are considered
+    :return: (K,) times
+    """
+    if period is None:
+        return _straight_line_contact_times(separation, relative_velocity, contact)
+
+    # The image nearest now isn't always the one hit first, particles travelling far meet another one before
+    separation = minimum_image(separation, period)
+    times = np.full(len(separation), np.inf)
+    for shift_x in (-1., 0., 1.):
+        for shift_y in (-1., 0., 1.):
+            shifted = separation + np.array((shift_x, shift_y)) * period
+            times = np.minimum(times, _straight_line_contact_times(shifted, relative_velocity, contact))
+    return times
+
+
+def _straight_line_contact_times(separation, relative_velocity, contact):
+    # Solve |separation + relative_velocity * t| = contact for its first root
+    b = (separation * relative_velocity).sum(axis=-1)
+    a = (relative_velocity * relative_velocity).sum(axis=-1)
+    c = (separation * separation).sum(axis=-1) - contact ** 2
+    discriminant = b ** 2 - a * c
+
+    times = np.full(b.shape, np.inf)
+    # Only particles getting closer can collide, which also rules out a particle with itself
+    approaching = (b < 0.) & (discriminant >= 0.) & (a > 0.)
+    times[approaching] = (-b[approaching] - np.sqrt(discriminant[approaching])) / a[approaching]
+
+    # Overlapping pairs still getting closer are resolved right away
+    return np.maximum(times, 0.)
+
+
+def wall_collision_times(position, velocity, acceleration, wall, toward):
+    """
+    Time until a coordinate following position + velocity * t + acceleration * t^2 / 2 reaches wall
+    while moving toward it, inf if it never does
+    :param position: (N,) coordinates
+    :param velocity: (N,) velocities along the same axis
+    :param acceleration: (N,) accelerations along that axis
+    :param wall: (N,) coordinates at which the contact happens
+    :param toward: (N,) -1 where the wall is below the coordinate, 1 where it is above
+    :return: (N,) times
+    """
+    gap = position - wall
+    times = np.full(len(gap), np.inf)
+
+    # No acceleration along the axis, straight line
+    linear = acceleration == 0.
+    moving = linear & (toward * velocity > 0.)
+    times[moving] = np.maximum(-gap[moving] / velocity[moving], 0.)
+
+    discriminant = velocity ** 2 - 2. * acceleration * gap
+    real = ~linear & (discriminant >= 0.)
+    root = np.sqrt(np.where(real, discriminant, 0.))
+    safe_acceleration = np.where(linear, 1., acceleration)
+
+    # Keep the earliest non negative root at which the coordinate moves toward the wall
+    for sign in (-1., 1.):
+        candidate = (-velocity + sign * root) / safe_acceleration
+        valid = real & (candidate >= 0.) & (toward * (velocity + acceleration * candidate) > 0.)
+        times = np.where(valid, np.minimum(times, candidate), times)
+
+    return times
+
+
+class EventController:
+    """
+    Event driven (time of impact) collision engine for the particles of a construct
+
+    Particle-particle and particle-wall collision times are computed analytically and kept in a priority queue,
+    the simulation then jumps from one collision to the next instead of moving by fixed steps. Each particle only
+    has its next event queued, events made stale by an earlier collision are dropped when popped.
+
+    The cost of an event doesn't grow with the number of particles. The box is cut in cells at least a particle
+    diameter wide, so a particle is only predicted against the ones in the cells around its own, leaving a cell being
+    an event too. Particles are only moved when they collide, each one keeps the time its position and velocity are
+    at, and they are all brought to the same time at the end of advance.
+    """
+
+    def __init__(self, construct, physics):
+        """
+        Init for EventController
+        :param construct: construct whose particles and walls are simulated
+        :param physics: PhysicsController providing gravity and energies
+        """
+        self.construct = construct
+        self.physics = physics
+
+        self.time = 0.
+        self.number_events = 0
+
+        self._queue = []
+        self._sequence = 0
+        self._partners = None
+        self._collision_counts = None
+        self._state = None
+
+        # Time each particle's position and velocity are at
+        self._times = None
+        # Particles whose next event is with a given particle, to predict again when that one collides
+        self._waiting = {}
+
+        # Cell grid, cells of each particle (unwrapped in a periodic box) and particles of each cell
+        self._cell_size = None
+        self._cell_counts = None
+        self._cells = None
+        self._members = {}
+        self._around = {}
+
+        self._acceleration = None
+        self._period = None
+        self._lower = None
+        self._upper = None
+
+    @property
+    def store(self):
+        return self.construct.particle_store
+
+    @property
+    def period(self):
+        # Sides of a periodic construct, None if it has walls
+        return self.construct.period
+
+    @property
+    def acceleration(self) -> np.ndarray:
+        return np.broadcast_to(np.asarray(self.physics.g, dtype=float), (2,))
+
+    @property
+    def lower(self) -> np.ndarray:
+        return self.construct.position - self.construct.half_lengths
+
+    @property
+    def upper(self) -> np.ndarray:
+        return self.construct.position + self.construct.half_lengths
+
+    def reset(self) -> None:
+        """
+        Forget every predicted event, they are predicted again from the current state on the next advance
+        """
+        self._state = None
+
+    def _is_stale(self) -> bool:
+        # Anything touching the particles from outside invalidates the predictions
+        if self._state is None:
+            return True
+
+        positions, velocities, acceleration = self._state
+        return len(positions) != self.store.count or not np.array_equal(positions, self.store.positions) \
+            or not np.array_equal(velocities, self.store.velocities) \
+            or not np.array_equal(acceleration, self.acceleration)
+
+    def _save_state(self) -> None:
+        self._state = (self.store.positions.copy(), self.store.velocities.copy(), self.acceleration.copy())
+
+    def _cell_key(self, cells: np.ndarray) -> np.ndarray:
+        # Flat number of (N, 2) cells, wrapped around a periodic box
+        cells = np.mod(cells, self._cell_counts)
+        return cells[..., 0] * self._cell_counts[1] + cells[..., 1]
+
+    def _build_cells(self) -> None:
+        store = self.store
+        size = self._upper - self._lower
+
+        # Touching particles are at most the largest diameter apart so they are always in neighbouring cells, a little
+        # margin keeps it true through rounding. Many more cells than particles would only cost crossings.
+        diameter = 2. * store.radii.max() * (1. + 1e-9)
+        most = 2 * int(np.sqrt(store.count)) + 1
+        counts = np.full(2, most) if diameter <= 0. else np.clip(np.floor(size / diameter).astype(int), 1, most)
+        self._cell_counts = counts
+        self._cell_size = size / counts
+
+        cells = np.floor((store.positions - self._lower) / self._cell_size).astype(np.intp)
+        if self._period is None:
+            # Outer cells reach out past the walls
+            cells = np.clip(cells, 0, counts - 1)
+        else:
+            cells = np.mod(cells, counts)
+        self._cells = cells
+
+        self._members = {}
+        self._around = {}
+        for index, key in enumerate(self._cell_key(cells).tolist()):
+            self._members.setdefault(key, set()).add(index)
+
+    def _neighbour_cells(self, cell) -> set:
+        # Keys of the cells around cell (its own included), a set so a small periodic grid doesn't repeat any
+        x, y = int(cell[0]) % self._cell_counts[0], int(cell[1]) % self._cell_counts[1]
+        keys = self._around.get((x, y))
+        if keys is None:
+            keys = set()
+            for shift_x in (-1, 0, 1):
+                for shift_y in (-1, 0, 1):
+                    neighbour_x, neighbour_y = x + shift_x, y + shift_y
+                    if self._period is None and not (0 <= neighbour_x < self._cell_counts[0]
+                                                     and 0 <= neighbour_y < self._cell_counts[1]):
+                        continue
+                    keys.add(int(neighbour_x % self._cell_counts[0]) * int(self._cell_counts[1])
+                             + int(neighbour_y % self._cell_counts[1]))
+            self._around[(x, y)] = keys
+        return keys
+
+    def _neighbour_pairs(self, indices: np.ndarray) -> tuple:
+        """
+        Particles in the cells around each particle of indices
+        :return: (rows, others), row in indices and other particle of each pair
+        """
+        rows = []
+        others = []
+        for row, index in enumerate(indices.tolist()):
+            for key in self._neighbour_cells(self._cells[index]):
+                members = self._members.get(key)
+                if members:
+                    others.extend(members)
+                    rows.extend([row] * len(members))
+
+        rows = np.array(rows, dtype=np.intp)
+        others = np.array(others, dtype=np.intp)
+        keep = others != indices[rows]
+        return rows[keep], others[keep]
+
+    def _all_neighbour_pairs(self) -> tuple:
+        # Same as _neighbour_pairs for every particle, with a sort instead of a loop
+        count = self.store.count
+        keys = self._cell_key(self._cells)
+        order = np.argsort(keys, kind='stable')
+        cell_keys, starts, sizes = np.unique(keys[order], return_index=True, return_counts=True)
+        particles = np.arange(count)
+
+        all_rows = []
+        all_others = []
+        for shift in {(x, y) for x in (-1, 0, 1) for y in (-1, 0, 1)}:
+            neighbours = self._cells + shift
+            if self._period is None:
+                inside = np.all((neighbours >= 0) & (neighbours < self._cell_counts), axis=1)
+            else:
+                inside = np.ones(count, dtype=bool)
+            targets = self._cell_key(neighbours)
+            found = np.minimum(np.searchsorted(cell_keys, targets), len(cell_keys) - 1)
+            inside &= cell_keys[found] == targets
+            rows, others = _expand_ranges(particles[inside], starts[found[inside]], sizes[found[inside]])
+            all_rows.append(rows)
+            all_others.append(order[others])
+
+        rows = np.concatenate(all_rows)
+        others = np.concatenate(all_others)
+        if self._period is not None and np.any(self._cell_counts < 3):
+            # A small periodic grid reaches the same cell through several shifts
+            pairs = np.unique(np.stack([rows, others], axis=1), axis=0)
+            rows, others = pairs[:, 0], pairs[:, 1]
+        keep = others != rows
+        return rows[keep], others[keep]
+
+    def _current(self, indices: np.ndarray) -> tuple:
+        # Positions and velocities of particles at the current time, whatever time each one is at
+        store = self.store
+        dt = (self.time - self._times[indices])[:, None]
+        acceleration = self._acceleration
+        return (store.positions[indices] + store.velocities[indices] * dt + 0.5 * acceleration * dt ** 2,
+                store.velocities[indices] + acceleration * dt)
+
+    def _drift(self, indices, time: float) -> None:
+        # Free flight of particles up to time, exact under constant gravity
+        store = self.store
+        dt = (time - self._times[indices])[:, None]
+        store.positions[indices] += store.velocities[indices] * dt + 0.5 * self._acceleration * dt ** 2
+        store.velocities[indices] += self._acceleration * dt
+        self._times[indices] = time
+
+    def _predict_all(self) -> None:
+        count = self.store.count
+
+        self._queue = []
+        self._partners = np.full(count, NO_EVENT, dtype=np.intp)
+        self._collision_counts = np.zeros(count, dtype=np.int64)
+        self._times = np.full(count, self.time)
+        self._waiting = {}
+
+        self._build_cells()
+        self._predict(np.arange(count), self._all_neighbour_pairs())
+
+    def _predict(self, indices: np.ndarray, pairs: tuple = None) -> None:
+        """
+        Queue the next event of each particle in indices, at most one per particle
+        :param indices: particles to predict for
+        :param pairs: (rows, others) pairs to consider, see _neighbour_pairs which finds them if None
+        """
+        store = self.store
+        positions, velocities = self._current(indices)
+        radii = store.radii[indices]
+        acceleration = self._acceleration
+        lower = self._lower
+        upper = self._upper
+        number = len(indices)
+
+        # Walls then cell sides, column 2 * axis + side (plus 4 for cell sides) so that the partner is -1 - column,
+        # all of them solved at once
+        cells = self._cells[indices]
+        cell_lower = lower + cells * self._cell_size
+        sides = np.empty((number, 8))
+        sides[:, 0:4:2] = lower + radii[:, None]
+        sides[:, 1:4:2] = upper - radii[:, None]
+        sides[:, 4::2] = cell_lower
+        sides[:, 5::2] = cell_lower + self._cell_size
+        # Rounding can leave a particle a hair outside its cell, it is leaving it right away then
+        coordinates = positions[:, _SIDE_AXES]
+        coordinates[:, 4:] = np.clip(coordinates[:, 4:], np.repeat(sides[:, 4::2], 2, axis=1),
+                                     np.repeat(sides[:, 5::2], 2, axis=1))
+        side_times = wall_collision_times(coordinates.ravel(), velocities[:, _SIDE_AXES].ravel(),
+                                          np.tile(acceleration[_SIDE_AXES], number), sides.ravel(),
+                                          np.tile(_SIDE_TOWARD, number)).reshape(number, 8)
+        if self._period is None:
+            # Outer cells of a box with walls have no side to cross on the outside
+            side_times[:, 4::2][cells == 0] = np.inf
+            side_times[:, 5::2][cells == self._cell_counts - 1] = np.inf
+        else:
+            # Periodic sides have no walls, particles are brought back in at the end of advance
+            side_times[:, :4] = np.inf
+
+        soonest_wall = np.argmin(side_times[:, :4], axis=1)
+        best_times = side_times[np.arange(number), soonest_wall]
+        best_partners = -1 - soonest_wall
+
+        # Other particles
+        rows, others = self._neighbour_pairs(indices) if pairs is None else pairs
+        if len(rows):
+            other_positions, other_velocities = self._current(others)
+            pair_times = pair_collision_times(positions[rows] - other_positions, velocities[rows] - other_velocities,
+                                              radii[rows] + store.radii[others], self._period)
+            # Soonest partner of each row, the lowest one on a tie
+            order = np.lexsort((others, pair_times, rows))
+            first = order[np.concatenate(([True], rows[order][1:] != rows[order][:-1]))]
+            particle_times = np.full(number, np.inf)
+            soonest_particle = np.zeros(number, dtype=np.intp)
+            particle_times[rows[first]] = pair_times[first]
+            soonest_particle[rows[first]] = others[first]
+            sooner = particle_times < best_times
+            best_times = np.where(sooner, particle_times, best_times)
+            best_partners = np.where(sooner, soonest_particle, best_partners)
+
+        # Leaving the cell only matters if nothing happens before
+        soonest_crossing = 4 + np.argmin(side_times[:, 4:], axis=1)
+        crossing_times = side_times[np.arange(number), soonest_crossing]
+        sooner = crossing_times < best_times
+        best_times = np.where(sooner, crossing_times, best_times)
+        best_partners = np.where(sooner, -1 - soonest_crossing, best_partners)
+        best_partners[np.isinf(best_times)] = NO_EVENT
+
+        for index, time, partner in zip(indices.tolist(), best_times.tolist(), best_partners.tolist()):
+            previous = int(self._partners[index])
+            if previous >= 0 and previous in self._waiting:
+                self._waiting[previous].discard(index)
+            self._partners[index] = partner
+            if partner == NO_EVENT:
+                continue
+
+            if partner >= 0:
+                self._waiting.setdefault(partner, set()).add(index)
+            partner_count = self._collision_counts[partner] if partner >= 0 else 0
+            heapq.heappush(self._queue, (self.time + time, self._sequence, index, partner,
+                                         self._collision_counts[index], partner_count))
+            self._sequence += 1
+
+    def _cross(self, index: int, partner: int) -> None:
+        # Move a particle to the cell past the side it reached
+        column = CROSSING - partner
+        axis, side = divmod(column, 2)
+        key = int(self._cell_key(self._cells[index]))
+        self._members[key].discard(index)
+        self._cells[index, axis] += 1 if side else -1
+        self._members.setdefault(int(self._cell_key(self._cells[index])), set()).add(index)
+
+    def _collide(self, index: int, partner: int) -> list:
+        """
+        Resolve an event
+        :return: list of the particles whose velocity changed
+        """
+        store = self.store
+
+        if partner < 0:
+            axis = (-1 - partner) // 2
+            store.velocities[index, axis] = -1. * store.velocities[index, axis]
+            return [index]
+
+        first = np.array([index])
+        second = np.array([partner])
+        self.physics.perform_deflections(store, first, second, self._period)
+        return [index, partner]
+
+    def advance(self, dt: float) -> None:
+        """
+        Move the particles forward by dt, handling every collision on the way at its exact time
+        :param dt: time increment (seconds)
+        """
+        store = self.store
+        if store is None or store.count == 0:
+            return
+
+        # Looked up once per advance, every event uses them
+        self._acceleration = self.acceleration
+        self._period = self.period
+        self._lower = self.lower
+        self._upper = self.upper
+
+        if self._is_stale():
+            self._predict_all()
+
+        store.previous_positions[:] = store.positions
+        end_time = self.time + dt
+
+        while self._queue and self._queue[0][0] <= end_time:
+            time, _, index, partner, index_count, partner_count = heapq.heappop(self._queue)
+
+            # Lazy invalidation, skip events planned before one of the particles collided
+            if index_count != self._collision_counts[index]:
+                continue
+            if partner >= 0 and partner_count != self._collision_counts[partner]:
+                continue
+
+            self.time = max(self.time, time)
+            if NO_EVENT < partner <= CROSSING:
+                # Nothing changes but the particles it can meet
+                self._cross(index, partner)
+                self._predict(np.array([index]))
+                continue
+
+            changed = [index] if partner < 0 else [index, partner]
+            self._drift(changed, self.time)
+            self._collide(index, partner)
+            self.number_events += 1
+
+            self._collision_counts[changed] += 1
+            # Particles that were heading for one of these have to look again
+            waiting = set(changed)
+            for particle in changed:
+                waiting |= self._waiting.pop(particle, set())
+            self._predict(np.array(sorted(waiting)))
+
+        self.time = end_time
+        self._drift(np.arange(store.count), end_time)
+        if self._period is not None:
+            # Wrapping only changes which image is used, the predicted events stay valid, cells follow the particles
+            unwrapped = store.positions.copy()
+            self.physics.wrap_positions(store, self._lower, self._upper)
+            self._cells -= np.rint((unwrapped - store.positions) / self._period).astype(np.intp) * self._cell_counts
+        store.energies[:] = self.physics.compute_energies(store)
+
+        self._save_state()
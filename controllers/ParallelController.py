@@ -0,0 +1,278 @@
+import atexit
+import multiprocessing
+import numpy as np
+from multiprocessing import shared_memory
+
+from structures.ParticleStore import ParticleStore
+from util.BroadPhase import _sorted_pairs, minimum_image
+
+# Worker side caches, a worker keeps its shared memory attachments and physics between steps
+_worker_memory = {}
+_worker_physics = {}
+
+
+def _worker_store(name: str, capacity: int, count: int, dtype: str) -> ParticleStore:
+    if name not in _worker_memory:
+        # Only one shared block is in use at a time, drop the ones of previous layouts
+        for memory in _worker_memory.values():
+            memory.close()
+        _worker_memory.clear()
+        _worker_memory[name] = shared_memory.SharedMemory(name=name)
+
+    return ParticleStore(capacity, dtype, buffer=_worker_memory[name].buf, count=count)
+
+
+def _worker_physics_controller(settings: tuple):
+    # Imported here, PhysicsController is what creates this module's controllers
+    from controllers.PhysicsController import PhysicsController
+
+    if settings not in _worker_physics:
+        physics_type, collision_detection, collision_handler, grid_cell_size, backend, dtype, g, sleep_energy, \
+            sleep_steps = settings
+        physics = PhysicsController(physics_type, collision_detection=collision_detection,
+                                    collision_handler=collision_handler, grid_cell_size=grid_cell_size,
+                                    backend=backend, dtype=dtype)
+        physics.g = np.array(g)
+        physics.sleep_energy = sleep_energy
+        physics.sleep_steps = sleep_steps
+        _worker_physics[settings] = physics
+
+    return _worker_physics[settings]
+
+
+def _integrate_range(task: tuple) -> None:
+    """
+    Worker task, move particles start to stop and bounce them off the walls, sleepers stay put
+    """
+    layout, settings, start, stop, lower, upper, dt, boundary = task
+    store = _worker_store(*layout)
+    physics = _worker_physics_controller(settings)
+
+    physics.integrate_awake(store.subset(start, stop), np.array(lower), np.array(upper), dt, boundary)
+
+
+def _near(x: np.ndarray, x_low: float, x_high: float, halo: float, lower: tuple, period) -> np.ndarray:
+    """
+    Which of the x coordinates lie in the strip x_low to x_high or its halo, in a periodic box the halo of the outer
+    strips wraps around to the opposite side
+    """
+    if period is None:
+        return (x >= x_low - halo) & (x < x_high + halo)
+
+    # Distance past the start of the halo, around the box (outer strips are open ended, clip them to the box)
+    start = max(x_low, lower[0]) - halo
+    width = min(x_high, lower[0] + period[0]) - start + halo
+    return np.mod(x - start, period[0]) < width
+
+
+def _find_collisions_in_subdomain(task: tuple) -> tuple:
+    """
+    Worker task, find the colliding pairs whose lower index particle lies in the subdomain and resolve the ones no
+    other subdomain can reach
+    Particles within reach of the subdomain (its halo) are included so pairs across borders are found. A contact is
+    resolved here if no particle chained to it by other contacts lies in the halo of another subdomain, the others
+    are handed back for the parent to resolve
+    :return: pairs left to resolve, number of candidate pairs tested, number of pairs resolved here
+    """
+    layout, settings, subdomain, edges, halo, lower, period = task
+    store = _worker_store(*layout)
+    physics = _worker_physics_controller(settings)
+
+    x = store.positions[:, 0]
+    x_low, x_high = edges[subdomain], edges[subdomain + 1]
+    owned = (x >= x_low) & (x < x_high)
+    local = np.nonzero(owned | _near(x, x_low, x_high, halo, lower, period))[0]
+    if len(local) < 2:
+        return np.empty((0, 2), dtype=np.intp), 0, 0
+
+    if period is None:
+        pairs = local[physics.find_candidate_pairs(store.positions[local], store.radii[local], key=subdomain)]
+    else:
+        pairs = local[physics.find_periodic_pairs(store.positions[local], store.radii[local], np.array(lower),
+                                                  np.array(period), key=subdomain)]
+    pairs = _sorted_pairs(pairs[:, 0], pairs[:, 1])
+
+    # Each pair is kept by exactly one subdomain, the one owning its first particle
+    pairs = pairs[owned[pairs[:, 0]]]
+    if physics.sleep_energy is not None:
+        # Sleepers don't test each other, like in a single process run
+        asleep = physics.sleeping(store)
+        pairs = pairs[~(asleep[pairs[:, 0]] & asleep[pairs[:, 1]])]
+    candidates = len(pairs)
+
+    separation = minimum_image(store.positions[pairs[:, 0]] - store.positions[pairs[:, 1]], period)
+    colliding = np.hypot(separation[:, 0], separation[:, 1]) < store.radii[pairs[:, 0]] + store.radii[pairs[:, 1]]
+    pairs = pairs[colliding]
+
+    # Owned particles no other subdomain sees only touch particles of this one, so their contacts are all found here
+    inside = np.flatnonzero(owned)
+    seen = np.zeros(len(inside), dtype=bool)
+    for other in range(len(edges) - 1):
+        if other != subdomain:
+            seen |= _near(x[inside], edges[other], edges[other + 1], halo, lower, period)
+    shared = np.ones(len(x), dtype=bool)
+    shared[inside[~seen]] = False
+
+    # A particle is deflected by its contacts in pair order, contacts chained to a shared particle go to the parent
+    # so that order holds. Settles in as many passes as the longest chain, like _contact_batches
+    first, second = pairs[:, 0], pairs[:, 1]
+    handed = np.zeros(len(pairs), dtype=bool)
+    while True:
+        reached = shared[first] | shared[second]
+        if np.array_equal(reached, handed):
+            break
+        handed = reached
+        shared[first[handed]] = True
+        shared[second[handed]] = True
+
+    # Nobody else reads or writes these particles during the step, deflect them in place
+    resolved = physics.resolve_collisions(store, pairs[~handed], period)
+    if physics.sleep_energy is not None:
+        # Contact wakes sleepers up
+        store.rest_steps[resolved.ravel()] = 0
+
+    return pairs[handed], candidates, len(resolved)
+
+
+class ParallelController:
+    """
+    Steps the particles of a construct in worker processes over shared memory
+
+    The construct's particle store is moved to shared memory so workers read and write it in place. Each step the
+    workers first move their share of the particles, then the box is cut in vertical strips (subdomains), each worker
+    looking for collisions in its strip plus a halo of particles from the neighbouring strips. Workers resolve the
+    collisions that stay away from the other strips, the ones chained to a particle another strip sees are gathered
+    and resolved by the parent. Each particle is deflected by its contacts in pair order either way, so results are
+    identical to a single process run.
+    """
+
+    def __init__(self, physics, processes: int = None, subdomains: int = None):
+        """
+        Init for ParallelController
+        :param physics: PhysicsController whose settings the workers use
+        :param processes: number of worker processes, all cores if None
+        :param subdomains: number of strips the box is cut in, defaults to the number of processes
+        """
+        self.physics = physics
+        self.processes = processes or multiprocessing.cpu_count()
+        self.subdomains = subdomains or self.processes
+
+        self._pool = None
+        self._memory = None
+        self._store = None
+        self._bound_positions = None
+
+    def _settings(self) -> tuple:
+        physics = self.physics
+        return (physics.physics_type, physics.collision_detection, physics.collision_handler, physics.grid_cell_size,
+                physics.backend, physics.dtype.str,
+                tuple(np.broadcast_to(np.asarray(physics.g, dtype=float), (2,)).tolist()), physics.sleep_energy,
+                physics.sleep_steps)
+
+    def _share(self, store: ParticleStore) -> tuple:
+        """
+        Make sure the store lives in shared memory
+        :return: layout of the store, which workers need to attach to it
+        """
+        # The store re-allocates privately when it grows, share it again then
+        if store is not self._store or store._positions is not self._bound_positions:
+            self._release_memory()
+
+            self._memory = shared_memory.SharedMemory(create=True, size=ParticleStore.buffer_size(store.capacity,
+                                                                                                  store.dtype))
+            store.use_buffer(self._memory.buf)
+            self._store = store
+            self._bound_positions = store._positions
+
+        if self._pool is None:
+            self._pool = multiprocessing.get_context().Pool(self.processes)
+            # Runs that never call close still give the shared block back when the interpreter exits
+            atexit.register(self.close)
+
+        return self._memory.name, store.capacity, store.count, store.dtype.str
+
+    def increment_particles(self, construct, dt: float) -> None:
+        """
+        Move the particles of construct forward by dt and resolve their collisions
+        :param construct: construct holding the particles
+        :param dt: time increment (seconds)
+        """
+        store = construct.particle_store
+        if store is None or store.count == 0:
+            return
+
+        try:
+            self._increment_particles(construct, store, dt)
+        except BaseException:
+            # Don't leave workers or the shared block behind, the particles go back to private memory
+            if self._pool is not None:
+                self._pool.terminate()
+            self.close()
+            raise
+
+    def _increment_particles(self, construct, store: ParticleStore, dt: float) -> None:
+        layout = self._share(store)
+        settings = self._settings()
+        lower = construct.position - construct.half_lengths
+        upper = construct.position + construct.half_lengths
+
+        # Moving particles is independent from one particle to the next, split in contiguous ranges
+        bounds = np.linspace(0, store.count, self.processes + 1).astype(int)
+        with self.physics.profiler.phase('integration'):
+            self._pool.map(_integrate_range, [(layout, settings, start, stop, tuple(lower), tuple(upper), dt,
+                                               construct.boundary) for start, stop in zip(bounds[:-1], bounds[1:])])
+
+        # Any overlapping pair is closer than the largest diameter along x
+        halo = 2. * store.radii.max()
+        period = construct.period
+        if period is not None:
+            period = tuple(period)
+        edges = np.linspace(lower[0], upper[0], self.subdomains + 1)
+        # Outer strips reach out to infinity, so particles pushed past the walls are still owned by someone
+        edges[0] = -np.inf
+        edges[-1] = np.inf
+
+        # Workers run the narrow phase too, resolving what stays inside their strip, only pairs across strips come back
+        with self.physics.profiler.phase('broad_phase'):
+            found = self._pool.map(_find_collisions_in_subdomain,
+                                   [(layout, settings, subdomain, tuple(edges), halo, tuple(lower), period)
+                                    for subdomain in range(self.subdomains)])
+
+        pairs = np.concatenate([handed for handed, _, _ in found])
+        with self.physics.profiler.phase('narrow_phase'):
+            collided = self.physics.resolve_collisions(store, _sorted_pairs(pairs[:, 0], pairs[:, 1]), period)
+            if self.physics.sleep_energy is not None:
+                # Contact wakes sleepers up
+                store.rest_steps[collided.ravel()] = 0
+        self.physics.profiler.count('candidate_pairs', sum(candidates for _, candidates, _ in found))
+        self.physics.profiler.count('collisions', len(pairs) + sum(resolved for _, _, resolved in found))
+
+    def _release_memory(self) -> None:
+        if self._memory is None:
+            return
+
+        # Bring the particles back to private memory before the shared block goes away
+        if self._store is not None and self._store._positions is self._bound_positions:
+            self._store.use_buffer(None)
+        self._store = None
+        self._bound_positions = None
+
+        try:
+            self._memory.close()
+        except BufferError:
+            # Arrays on the block are still referenced (e.g. from a traceback), it is unmapped once they go
+            pass
+        self._memory.unlink()
+        self._memory = None
+
+    def close(self) -> None:
+        """
+        Stop the workers and free the shared memory
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            atexit.unregister(self.close)
+
+        self._release_memory()
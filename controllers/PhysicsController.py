@@ -1,9 +1,76 @@
+import warnings
 import numpy as np
 from itertools import combinations
-from scipy import constants
 
 from util.Overlaps import is_radial_overlap
-from util.Maths import magnitude
+from util.Maths import magnitude, dot_rows
+from util.BroadPhase import uniform_grid_pairs, SweepAndPrune, _sorted_pairs, periodic_images, image_pairs, \
+    minimum_image
+from util.SpatialIndex import SpatialIndex
+from controllers.EventController import EventController
+from controllers.ParallelController import ParallelController
+from util.Profiling import NULL_PROFILER
+
+# Standard acceleration of gravity (scipy.constants.g), m/s^2
+STANDARD_GRAVITY = 9.80665
+
+
+def _shared_store(particles):
+    """
+    Find the ParticleStore shared by all particles, if any
+    :param particles: list of particles
+    :return: (store, indices of the particles in the store), (None, None) if the particles don't share a store
+    """
+    store = particles[0].store
+    parent = particles[0].parent
+
+    # Usual case, the whole particle list of a construct, which is its store in order
+    if parent is not None and parent.particles is particles and parent.particle_store is store \
+            and store.count == len(particles):
+        return store, np.arange(len(particles))
+
+    indices = np.fromiter((p.index for p in particles), dtype=np.intp, count=len(particles))
+    if all(p.store is store for p in particles):
+        return store, indices
+
+    return None, None
+
+
+def _contact_batches(pairs: np.ndarray) -> list:
+    """
+    Split pairs in batches where no particle appears twice, keeping the order of the pairs of each particle
+    Deflecting batch after batch then gives the same result as deflecting pair after pair
+    :param pairs: (K, 2) colliding pairs, in the order they should be handled
+    :return: list of index arrays into pairs
+    """
+    if len(pairs) == 0:
+        return []
+
+    # Pair holding the previous contact of each particle of each pair, found with one sort of the particles
+    # (ties broken by position in pairs, quicker than a stable sort)
+    slots = pairs.ravel()
+    order = np.argsort(slots * slots.size + np.arange(slots.size))
+    repeated = slots[order[1:]] == slots[order[:-1]]
+    previous = np.full(slots.size, -1, dtype=np.intp)
+    previous[order[1:][repeated]] = order[:-1][repeated] // 2
+    chained = np.flatnonzero((previous.reshape(-1, 2) >= 0).any(axis=1))
+    previous_first = previous[2 * chained]
+    previous_second = previous[2 * chained + 1]
+
+    # A pair goes right after the last batch holding either of its particles. Batch numbers settle from the first
+    # pairs on, taking as many passes as the longest chain of pairs sharing particles instead of one per pair
+    # (the extra last entry is the batch before the first, for particles with no previous contact)
+    batches = np.zeros(len(pairs) + 1, dtype=np.intp)
+    batches[-1] = -1
+    while True:
+        updated = np.maximum(batches[previous_first], batches[previous_second]) + 1
+        if np.array_equal(updated, batches[chained]):
+            break
+        batches[chained] = updated
+    batches = batches[:-1]
+
+    order = np.argsort(batches, kind='stable')
+    return np.split(order, np.cumsum(np.bincount(batches))[:-1])
 
 
 class PhysicsController:
@@ -11,14 +78,51 @@ class PhysicsController:
     Controller class to deal with physics interactions
     """
     def __init__(self, physics_type: str, collision_detection: str = 'PairWise',
-                 collision_handler: str = 'DiscreteDetection'):
+                 collision_handler: str = 'DiscreteDetection', grid_cell_size: float = None, processes: int = 1,
+                 backend: str = 'numpy', dtype=np.float64):
         self.physics_type = physics_type
         self.collision_detection = collision_detection
         self.collision_handler = collision_handler
-        self._gravity_acceleration = np.array((0, -0.1 * constants.g))  # m/s^2
+        # Side of the 'UniformGrid' cells, None to size them from the largest particle every step
+        self.grid_cell_size = grid_cell_size
+        # 'SweepAndPrune' keeps its sort order between steps, one per list of particles
+        self._sweep_and_prune = {}
+        # 'ContinuousDetection' event engines, one per construct, their event queues carry over between steps
+        self._event_controllers = {}
+        # 'VectorizedMechanics' can spread steps over several processes
+        if processes > 1:
+            if physics_type != 'VectorizedMechanics' or collision_handler != 'DiscreteDetection':
+                warnings.warn(f"processes={processes} is ignored, only 'VectorizedMechanics' with "
+                              f"'DiscreteDetection' is stepped in worker processes")
+            elif collision_detection == 'PairWise':
+                # Workers each run the broad phase on their subdomain, PairWise has none to split
+                raise ValueError("'PairWise' collision detection can't run in worker processes, use 'UniformGrid', "
+                                 "'SweepAndPrune' or 'KDTree' with processes > 1")
+        self.processes = processes
+        self._parallel_controller = None
+        # 'VectorizedMechanics' particles whose kinetic energy stays below sleep_energy for sleep_steps steps are put
+        # to sleep, they stop moving and cost nothing until something hits them. None never puts particles to sleep
+        self._sleep_energy = None
+        self.sleep_steps = 20
+        # Sleeping particles don't move, so their spatial index is kept until one wakes up or falls asleep
+        self._sleeping_indexes = {}
+        # Phase timings and counts go here, see util.Profiling
+        self.profiler = NULL_PROFILER
+        # 'numba' runs the integrator, walls and narrow phase as compiled loops (util.Kernels), 'numpy' as array
+        # operations (PairWise keeps its per pair loop either way). Both give the same results for float64 particles
+        if backend not in ('numpy', 'numba'):
+            raise ValueError(f"Unknown backend '{backend}'")
+        if backend == 'numba' and not self._kernels().NUMBA_AVAILABLE:
+            warnings.warn("numba is not installed, falling back to the 'numpy' backend")
+            backend = 'numpy'
+        self.backend = backend
+        # Floating point type of the particle state, constants used in the arithmetic follow it so that float32
+        # particles are stepped in float32
+        self.dtype = np.dtype(dtype)
+        self.g = (0, -0.1 * STANDARD_GRAVITY)  # m/s^2
 
         # Set epsilon for ensuring non-zero values in some cases
-        self.epsilon = np.finfo(float).eps
+        self.epsilon = np.finfo(self.dtype).eps
 
     @property
     def g(self):
@@ -26,11 +130,18 @@ class PhysicsController:
 
     @g.setter
     def g(self, value) -> None:
-        self._gravity_acceleration = value
+        self._gravity_acceleration = np.asarray(value, dtype=self.dtype)
 
-    def increment_construct(self, construct, dt):
+    @staticmethod
+    def _kernels():
+        # util.Kernels imports numba, only loaded once the 'numba' backend is asked for
+        from util import Kernels
+        return Kernels
 
-        # TODO: Check if static, if not move & check collisions
+    def increment_construct(self, construct, dt):
+        # Nothing moves in static constructs, nor in ones where everything sleeps
+        if construct.static or self.is_asleep(construct):
+            return
 
         if len(construct.children) > 0:
             for child_construct in construct.children:
@@ -39,12 +150,97 @@ class PhysicsController:
         if len(construct.particles) > 0:
             self.increment_particles(construct, dt)
 
+    @property
+    def sleep_energy(self):
+        return self._sleep_energy
+
+    @sleep_energy.setter
+    def sleep_energy(self, value) -> None:
+        if value is not None and (self.physics_type != 'VectorizedMechanics'
+                                  or self.collision_handler != 'DiscreteDetection'):
+            warnings.warn(f"sleep_energy is ignored, only 'VectorizedMechanics' with 'DiscreteDetection' puts "
+                          f"particles to sleep")
+        self._sleep_energy = value
+
+    def sleeping(self, store) -> np.ndarray:
+        """
+        Mask of the sleeping particles of a store
+        """
+        if self.sleep_energy is None:
+            return np.zeros(store.count, dtype=bool)
+        return store.rest_steps >= self.sleep_steps
+
+    def is_asleep(self, construct) -> bool:
+        """
+        Whether every particle of construct and of its children is sleeping
+        """
+        if self.sleep_energy is None:
+            return False
+
+        store = construct.particle_store
+        if store is not None and store.count > 0 and not self.sleeping(store).all():
+            return False
+        return all(self.is_asleep(child) for child in construct.children)
+
+    def wake(self, construct, indices: np.ndarray = None) -> None:
+        """
+        Wake particles up, needed after changing the velocity of a sleeping particle by hand
+        :param construct: construct holding the particles
+        :param indices: store indices of the particles to wake, all of them if None
+        """
+        if construct.particle_store is not None:
+            construct.particle_store.rest_steps[slice(None) if indices is None else indices] = 0
+        if indices is None:
+            for child in construct.children:
+                self.wake(child)
+
+    def close(self) -> None:
+        """
+        Release worker processes and shared memory, if any were used
+        """
+        if self._parallel_controller is not None:
+            self._parallel_controller.close()
+            self._parallel_controller = None
+
+    def event_controller(self, construct) -> EventController:
+        """
+        Event driven engine handling construct's particles with 'ContinuousDetection'
+        """
+        if id(construct) not in self._event_controllers:
+            self._event_controllers[id(construct)] = EventController(construct, self)
+        return self._event_controllers[id(construct)]
+
     def increment_particles(self, construct, dt):
-        for i, p in enumerate(construct.particles):
-            #if i == 0:
-            #    print(f"Particle {i}:\nPosition: {p.position}\nVelocity: {p.velocity}")
+        if self.collision_handler == 'ContinuousDetection' and construct.particle_store is not None:
+            # Event driven, particles go from one collision to the next at their exact times
+            event_controller = self.event_controller(construct)
+            number_events = event_controller.number_events
+            with self.profiler.phase('events'):
+                event_controller.advance(dt)
+            self.profiler.count('events', event_controller.number_events - number_events)
+            return construct
+
+        if self.physics_type == 'VectorizedMechanics' and self.processes > 1:
+            # Subdomains stepped in worker processes
+            if self._parallel_controller is None:
+                self._parallel_controller = ParallelController(self, self.processes)
+            self._parallel_controller.increment_particles(construct, dt)
+            return construct
+
+        if self.physics_type == 'VectorizedMechanics':
+            # Move every particle of the construct at once through its particle store
+            self.iterate_positions(construct, dt)
+        elif self.backend == 'numba':
+            # Same steps as iterate_position, in one compiled pass over the construct's store
+            self.integrate(construct.particle_store, construct.position - construct.half_lengths,
+                           construct.position + construct.half_lengths, dt, construct.boundary)
+        else:
+            with self.profiler.phase('integration'):
+                for i, p in enumerate(construct.particles):
+                    #if i == 0:
+                    #    print(f"Particle {i}:\nPosition: {p.position}\nVelocity: {p.velocity}")
 
-            self.iterate_position(p, dt)
+                    self.iterate_position(p, dt)
 
         # After each child has been "moved forward in time" check to see if we got a collision
         # This detect also calls collision handler, function name unclear I guess
@@ -52,50 +248,276 @@ class PhysicsController:
 
         return construct
 
-    def handle_particle_collisions(self, particle1, particle2):
+    def handle_particle_collisions(self, particle1, particle2, period=None):
+        if self.sleep_energy is not None:
+            # Contact wakes sleepers up, like in the vectorized narrow phase
+            particle1.store.rest_steps[particle1.index] = 0
+            particle2.store.rest_steps[particle2.index] = 0
+
         if self.collision_handler == 'DiscreteDetection':
-            self.perform_deflection(particle1, particle2)
+            self.perform_deflection(particle1, particle2, period)
 
         if self.collision_handler == 'ContinuousDetection':
-            print('Not yet implementing, no collision handled.')
-            self.perform_deflection(particle1, particle2)
-            # Use binary search to trace back until we get within a given precision of two particles
-            # just entering in contact.
-            # Is finding time required to be equidistant to COM valid?
+            # Constructs are handled by the event driven engine (see increment_particles), particles stepped
+            # one by one outside of a construct only get the discrete deflection
+            self.perform_deflection(particle1, particle2, period)
 
     def detect_collisions(self, particles: list):
-        # Sweep and prune
-        # Uniform grid partition
-        # K-D Tree space partition
+        # Sweep and prune (SweepAndPrune)
+        # Uniform grid partition (UniformGrid)
+        # K-D Tree space partition (KDTree)
         # Object Partition
         #   Bounding Volume Hierarchies
 
+        if len(particles) < 2:
+            return
+
+        # Particles of a periodic box also collide across its sides, through their nearest images
+        box = particles[0].parent
+        period = getattr(box, 'period', None)
+
         if self.collision_detection == 'PairWise':
             # Very slow and inefficient way of finding particle overlaps
+            # Handles of a construct's particles are built on access, build them once rather than for every pair
+            particles = list(particles)
             particle_pairs = combinations(range(len(particles)), 2)
 
-            for i, j in particle_pairs:
-                if is_radial_overlap(particles[i], particles[j]):
-                    self.handle_particle_collisions(particles[i], particles[j])
-
-    def perform_deflection(self, particle1, particle2):
+            with self.profiler.phase('narrow_phase'):
+                collisions = 0
+                for i, j in particle_pairs:
+                    if is_radial_overlap(particles[i], particles[j], period):
+                        self.handle_particle_collisions(particles[i], particles[j], period)
+                        collisions += 1
+            self.profiler.count('candidate_pairs', len(particles) * (len(particles) - 1) // 2)
+            self.profiler.count('collisions', collisions)
+            return
+
+        store, indices = _shared_store(particles)
+        if store is not None:
+            positions = store.positions[indices]
+            radii = store.radii[indices]
+        else:
+            positions = np.array([p.position for p in particles])
+            radii = np.array([p.radius for p in particles])
+
+        with self.profiler.phase('broad_phase'):
+            asleep = None
+            if store is not None and self.sleep_energy is not None:
+                asleep = self.sleeping(store)[indices]
+
+            if period is not None:
+                particle_pairs = self.find_periodic_pairs(positions, radii, box.lower, period, asleep=asleep,
+                                                          key=id(particles))
+            elif asleep is not None:
+                particle_pairs = self.find_pairs_with_sleepers(positions, radii, asleep, key=id(particles))
+            else:
+                particle_pairs = self.find_candidate_pairs(positions, radii, key=id(particles))
+        self.profiler.count('candidate_pairs', len(particle_pairs))
+
+        with self.profiler.phase('narrow_phase'):
+            if store is not None:
+                # Narrow phase on the arrays, all pairs at once
+                collided = self.resolve_collisions(store, indices[particle_pairs], period)
+                if self.sleep_energy is not None:
+                    # Contact wakes sleepers up
+                    store.rest_steps[collided.ravel()] = 0
+                collisions = len(collided)
+            else:
+                collisions = 0
+                for i, j in particle_pairs:
+                    if is_radial_overlap(particles[i], particles[j], period):
+                        self.handle_particle_collisions(particles[i], particles[j], period)
+                        collisions += 1
+        self.profiler.count('collisions', collisions)
+
+    def find_candidate_pairs(self, positions: np.ndarray, radii: np.ndarray, key=None, tracked: int = None,
+                             active: np.ndarray = None) -> np.ndarray:
+        """
+        Broad phase, find the pairs of particles that may overlap
+        Pairs come out sorted, the same order as PairWise, so the narrow phase gives the same results
+        :param positions: (N, 2) particle positions
+        :param radii: (N,) particle radii
+        :param key: identifies the particle set between calls, for broad phases keeping state across steps
+        :param tracked: number of leading rows that are the particles of the set, the others are copies made for
+                        this call (see util.BroadPhase.SweepAndPrune.find_pairs), all of them if None
+        :param active: (N,) mask of the rows to pair, all of them if None
+        :return: (M, 2) array of indices in positions
+        """
+        if active is not None and self.collision_detection != 'SweepAndPrune':
+            rows = np.flatnonzero(active)
+            return rows[self.find_candidate_pairs(positions[rows], radii[rows])]
+
+        if self.collision_detection == 'UniformGrid':
+            # Grid is rebuilt from scratch every step, binning is cheap next to the pairs
+            return uniform_grid_pairs(positions, radii, self.grid_cell_size)
+
+        if self.collision_detection == 'SweepAndPrune':
+            if key not in self._sweep_and_prune:
+                self._sweep_and_prune[key] = SweepAndPrune()
+            # The sweep keeps its order over the whole set, so it gets every row rather than the active ones
+            return self._sweep_and_prune[key].find_pairs(positions, radii, tracked, active)
+
+        if self.collision_detection == 'KDTree':
+            # No empty cells to pay for, whatever the clustering
+            return SpatialIndex(positions).candidate_pairs(radii)
+
+        raise ValueError(f"Unknown collision detection '{self.collision_detection}'")
+
+    def find_periodic_pairs(self, positions: np.ndarray, radii: np.ndarray, lower: np.ndarray, period: np.ndarray,
+                            asleep: np.ndarray = None, key=None) -> np.ndarray:
+        """
+        Broad phase of a periodic box, pairs across its sides included
+        Particles near the sides are copied past the opposite side (see util.BroadPhase.periodic_images) and the
+        usual broad phase runs on everything, so every collision detection mode works unchanged
+        :param positions: (N, 2) particle positions, inside the box
+        :param radii: (N,) particle radii
+        :param lower: lower corner of the box
+        :param period: (2,) side lengths of the box
+        :param asleep: (N,) mask of the sleeping particles, if particles can sleep
+        :param key: identifies the particle set between calls
+        :return: (M, 2) sorted array of indices in positions, pairs are to be tested through their nearest image
+        """
+        if len(positions) < 2:
+            return np.empty((0, 2), dtype=np.intp)
+
+        images, origins, shifts = periodic_images(positions, lower, period, 2. * radii.max())
+        image_radii = radii[origins]
+        if asleep is None:
+            pairs = self.find_candidate_pairs(images, image_radii, key=(key, 'periodic'), tracked=len(positions))
+        else:
+            # Copies are told apart by particle and shift, so the index of sleepers stays valid between steps
+            pairs = self.find_pairs_with_sleepers(images, image_radii, asleep[origins], key=(key, 'periodic'),
+                                                  labels=origins * 9 + shifts, tracked=len(positions))
+
+        return image_pairs(pairs, origins, len(positions))
+
+    def find_pairs_with_sleepers(self, positions: np.ndarray, radii: np.ndarray, asleep: np.ndarray,
+                                 key=None, labels: np.ndarray = None, tracked: int = None) -> np.ndarray:
+        """
+        Broad phase skipping pairs of sleeping particles
+        Awake particles go through find_candidate_pairs, sleeping ones are looked up around them in an index that is
+        only rebuilt when the set of sleepers changes
+        :param positions: (N, 2) particle positions
+        :param radii: (N,) particle radii
+        :param asleep: (N,) mask of the sleeping particles
+        :param key: identifies the particle set between calls
+        :param labels: (N,) identity of each position when the set of positions changes between calls, the rows
+                       are used if None
+        :param tracked: number of leading rows that are the particles of the set (see find_candidate_pairs)
+        :return: (M, 2) sorted array of indices in positions
+        """
+        if not asleep.any():
+            self._sleeping_indexes.pop(key, None)
+            return self.find_candidate_pairs(positions, radii, key=key, tracked=tracked)
+
+        awake = np.flatnonzero(~asleep)
+        sleeping = np.flatnonzero(asleep)
+
+        sleepers = sleeping if labels is None else labels[sleeping]
+        cached = self._sleeping_indexes.get(key)
+        if cached is None or not np.array_equal(cached[0], sleepers):
+            cached = (sleepers, SpatialIndex(positions[sleeping]), radii[sleeping].max())
+            self._sleeping_indexes[key] = cached
+        _, sleeping_index, largest_sleeper = cached
+
+        if len(awake) == 0:
+            return np.empty((0, 2), dtype=np.intp)
+
+        between_awake = self.find_candidate_pairs(positions, radii, key=key, tracked=tracked, active=~asleep)
+        with_sleepers = sleeping_index.pairs_with(positions[awake], radii[awake] + largest_sleeper)
+
+        return _sorted_pairs(np.concatenate([between_awake[:, 0], awake[with_sleepers[:, 0]]]),
+                             np.concatenate([between_awake[:, 1], sleeping[with_sleepers[:, 1]]]))
+
+    def resolve_collisions(self, store, pairs: np.ndarray, period=None) -> np.ndarray:
+        """
+        Vectorized narrow phase, finds which candidate pairs overlap and deflects them
+        A particle touching several others is deflected by each contact in pair order, exactly like PairWise
+        :param store: ParticleStore holding the particles
+        :param pairs: (M, 2) sorted candidate pairs of store indices
+        :param period: (2,) sides of a periodic box, pairs are then tested through their nearest images
+        :return: (K, 2) pairs that actually collided
+        """
+        positions = store.positions
+        radii = store.radii
+
+        if self.backend == 'numba' and self.physics_type in ('SimpleMechanics', 'VectorizedMechanics'):
+            kernels = self._kernels()
+            colliding = kernels.resolve_collisions(positions, store.velocities, radii, store.masses,
+                                                   np.ascontiguousarray(pairs), 2., kernels.DOT_IS_FUSED,
+                                                   np.zeros(2, dtype=store.dtype) if period is None else
+                                                   np.asarray(period, dtype=store.dtype))
+            return pairs[colliding]
+
+        separation = minimum_image(positions[pairs[:, 0]] - positions[pairs[:, 1]], period)
+        colliding = np.hypot(separation[:, 0], separation[:, 1]) < radii[pairs[:, 0]] + radii[pairs[:, 1]]
+        pairs = pairs[colliding]
+
+        for batch in _contact_batches(pairs):
+            self.perform_deflections(store, pairs[batch, 0], pairs[batch, 1], period)
+
+        return pairs
+
+    def perform_deflections(self, store, first: np.ndarray, second: np.ndarray, period=None) -> None:
+        """
+        Vectorized version of perform_deflection, a particle must appear at most once in first and second
+        :param store: ParticleStore holding the particles
+        :param first: (K,) store indices of the first particle of each pair
+        :param second: (K,) store indices of the second particle of each pair
+        :param period: (2,) sides of a periodic box, second particles are then taken at their image nearest the first
+        """
+        x1 = store.positions[first]
+        x2 = store.positions[second]
+        if period is not None:
+            x2 = x1 - minimum_image(x1 - x2, period)
+        v1 = store.velocities[first]
+        v2 = store.velocities[second]
+        m1 = store.masses[first][:, None]
+        m2 = store.masses[second][:, None]
+
+        if self.physics_type in ('SimpleMechanics', 'VectorizedMechanics'):
+            # Same equations as perform_deflection, one row per pair
+            squared = ((x1 - x2) * (x1 - x2)).sum(axis=1)
+            if store.dtype == np.float64:
+                # Written the same way too, so both give bit for bit the same velocities
+                # (float_power squares through pow like the scalar ** does, array ** 2 rounds differently)
+                distance_squared = np.float_power(np.sqrt(squared), 2)[:, None]
+            else:
+                # float_power always works in float64, stay in the store's type (agrees with the scalar path
+                # to rounding only, like the rest of float32)
+                distance_squared = squared[:, None]
+
+            store.velocities[first] = v1 - ((2 * m2) / (m1 + m2)) * (
+                        dot_rows((v1 - v2), (x1 - x2))[:, None] / distance_squared) * (x1 - x2)
+            store.velocities[second] = v2 - ((2 * m1) / (m2 + m1)) * (
+                        dot_rows((v2 - v1), (x2 - x1))[:, None] / distance_squared) * (x2 - x1)
+
+    def perform_deflection(self, particle1, particle2, period=None):
         # for shorter equation writing
         x1 = particle1.position
         x2 = particle2.position
+        if period is not None:
+            # Second particle at its image nearest the first one, in a periodic box
+            x2 = x1 - minimum_image(x1 - x2, period)
         v1 = particle1.velocity
         v2 = particle2.velocity
         m1 = particle1.mass
         m2 = particle2.mass
 
-        if self.physics_type == 'SimpleMechanics':
+        if self.physics_type in ('SimpleMechanics', 'VectorizedMechanics'):
             # See https://en.wikipedia.org/wiki/Elastic_collision#Two-dimensional_collision_with_two_moving_objects
             # For details on how these equations came about
 
-            particle1.velocity = v1 - ((2 * m2) / (m1 + m2)) * (
+            # Positions and velocities are views on the particle store, so both new velocities are computed
+            # before either is written back
+            new_v1 = v1 - ((2 * m2) / (m1 + m2)) * (
                         np.dot((v1 - v2), (x1 - x2)) / (magnitude(x1 - x2) ** 2)) * (x1 - x2)
-            particle2.velocity = v2 - ((2 * m1) / (m2 + m1)) * (
+            new_v2 = v2 - ((2 * m1) / (m2 + m1)) * (
                         np.dot((v2 - v1), (x2 - x1)) / (magnitude(x2 - x1) ** 2)) * (x2 - x1)
 
+            particle1.velocity = new_v1
+            particle2.velocity = new_v2
+
             return particle1, particle2
 
     def parent_collision_regression(self, entity, pos_index, dt, wall_position):
@@ -133,36 +555,44 @@ class PhysicsController:
         parent_xlim = np.array([parent.x - parent.hlx, parent.x + parent.hlx])
         parent_ylim = np.array([parent.y - parent.hly, parent.y + parent.hly])
 
+        if parent.boundary == 'Periodic':
+            # No walls, particles leaving through a side come back in through the opposite one
+            for axis, limits in enumerate((parent_xlim, parent_ylim)):
+                if entity.position[axis] < limits[0] or entity.position[axis] >= limits[1]:
+                    entity.position[axis] = limits[0] + np.mod(entity.position[axis] - limits[0],
+                                                               limits[1] - limits[0])
+            return entity
+
         if self.collision_handler == 'ContinuousDetection':
             # For now let's deal with wall physics here
             if entity.x - entity.radius <= parent_xlim[0]:
-                # If we passed the x = 0 wall, bounce back
-                self.parent_collision_regression(entity, 0, dt, 0)
+                # If we passed the left wall, bounce back
+                self.parent_collision_regression(entity, 0, dt, parent_xlim[0])
             if entity.x + entity.radius >= parent_xlim[1]:
-                # If we passed the x = 1 wall...
-                self.parent_collision_regression(entity, 0, dt, 1)
+                # If we passed the right wall...
+                self.parent_collision_regression(entity, 0, dt, parent_xlim[1])
 
             if entity.y - entity.radius <= parent_ylim[0]:
-                self.parent_collision_regression(entity, 1, dt, 0)
+                self.parent_collision_regression(entity, 1, dt, parent_ylim[0])
             if entity.y + entity.radius >= parent_ylim[1]:
-                self.parent_collision_regression(entity, 1, dt, 1)
+                self.parent_collision_regression(entity, 1, dt, parent_ylim[1])
 
         if self.collision_handler == 'DiscreteDetection':
             # For now let's deal with wall physics here
             if entity.x - entity.radius <= parent_xlim[0]:
-                # If we passed the x = 0 wall, bounce back
-                entity.x = entity.radius
+                # If we passed the left wall, bounce back
+                entity.x = parent_xlim[0] + entity.radius
                 entity.vx = -1. * entity.vx
             if entity.x + entity.radius >= parent_xlim[1]:
-                # If we passed the x = 1 wall...
-                entity.x = 1. - entity.radius
+                # If we passed the right wall...
+                entity.x = parent_xlim[1] - entity.radius
                 entity.vx = -1. * entity.vx
 
             if entity.y - entity.radius <= parent_ylim[0]:
-                entity.y = entity.radius
+                entity.y = parent_ylim[0] + entity.radius
                 entity.vy = -1. * entity.vy
             if entity.y + entity.radius >= parent_ylim[1]:
-                entity.y = 1. - entity.radius
+                entity.y = parent_ylim[1] - entity.radius
                 entity.vy = -1. * entity.vy
         return entity
 
@@ -187,11 +617,178 @@ class PhysicsController:
 
         return entity
 
+    def handle_parent_collisions(self, construct, dt):
+        """
+        Vectorized version of handle_parent_collision, bounces every particle of construct off its walls (or wraps
+        them around its sides if it is periodic)
+        :param construct: construct holding the particles, its limits are the walls
+        :param dt: time increment (seconds)
+        """
+        lower = construct.position - construct.half_lengths
+        upper = construct.position + construct.half_lengths
+
+        if construct.boundary == 'Periodic':
+            self.wrap_positions(construct.particle_store, lower, upper)
+        else:
+            self.bounce_off_walls(construct.particle_store, lower, upper)
+
+        return construct
+
+    def wrap_positions(self, store, lower, upper) -> None:
+        """
+        Bring every particle of a store that left a periodic box back in through the opposite side
+        :param store: ParticleStore holding the particles
+        :param lower: lower corner of the box
+        :param upper: upper corner of the box
+        """
+        lower = np.asarray(lower, dtype=store.dtype)
+        upper = np.asarray(upper, dtype=store.dtype)
+        positions = store.positions
+
+        for axis in range(2):
+            outside = np.flatnonzero((positions[:, axis] < lower[axis]) | (positions[:, axis] >= upper[axis]))
+            positions[outside, axis] = lower[axis] + np.mod(positions[outside, axis] - lower[axis],
+                                                            upper[axis] - lower[axis])
+
+    def bounce_off_walls(self, store, lower, upper) -> None:
+        """
+        Bounce every particle of a store off the walls of a box
+        :param store: ParticleStore holding the particles
+        :param lower: lower corner of the box
+        :param upper: upper corner of the box
+        """
+        # Walls in the particles' type, float64 ones would turn float32 arithmetic into float64
+        lower = np.asarray(lower, dtype=store.dtype)
+        upper = np.asarray(upper, dtype=store.dtype)
+
+        if self.backend == 'numba':
+            self._kernels().bounce_off_walls(store.positions, store.velocities, store.radii, lower, upper,
+                                             self.collision_handler == 'ContinuousDetection')
+            return
+
+        positions = store.positions
+        velocities = store.velocities
+        radii = store.radii
+
+        # Walls are handled one after the other, like in the per particle version
+        for axis in range(2):
+            below = positions[:, axis] - radii <= lower[axis]
+            if self.collision_handler == 'ContinuousDetection':
+                # Motion over the step is linear, so bouncing at impact time and finishing the run
+                # is the same as mirroring the final position across the contact line
+                positions[below, axis] = 2. * (lower[axis] + radii[below]) - positions[below, axis]
+            else:
+                positions[below, axis] = lower[axis] + radii[below]
+            velocities[below, axis] = -1. * velocities[below, axis]
+
+            above = positions[:, axis] + radii >= upper[axis]
+            if self.collision_handler == 'ContinuousDetection':
+                positions[above, axis] = 2. * (upper[axis] - radii[above]) - positions[above, axis]
+            else:
+                positions[above, axis] = upper[axis] - radii[above]
+            velocities[above, axis] = -1. * velocities[above, axis]
+
+    def iterate_positions(self, construct, dt):
+        """
+        Vectorized version of iterate_position, advances every particle of construct with a few array operations
+        :param construct: construct holding the particles
+        :param dt: time increment (seconds)
+        """
+        store = construct.particle_store
+        if store is None or store.count == 0:
+            return construct
+
+        self.integrate_awake(store, construct.position - construct.half_lengths,
+                             construct.position + construct.half_lengths, dt, construct.boundary)
+        return construct
+
+    def integrate_awake(self, store, lower, upper, dt, boundary: str = 'Reflective') -> None:
+        """
+        Same as integrate, except sleeping particles stay where they are and the others count their steps at rest
+        (see sleep_energy), plain integrate if particles never sleep
+        """
+        if self.sleep_energy is None:
+            self.integrate(store, lower, upper, dt, boundary)
+            return
+
+        # Only awake particles move
+        awake = np.flatnonzero(~self.sleeping(store))
+        if len(awake) == store.count:
+            self.integrate(store, lower, upper, dt, boundary)
+            self.update_rest(store)
+        elif len(awake) > 0:
+            moving = store.take(awake)
+            self.integrate(moving, lower, upper, dt, boundary)
+            self.update_rest(moving)
+            store.put(awake, moving)
+
+    def update_rest(self, store) -> None:
+        """
+        Count the steps each particle spent below sleep_energy, particles reaching sleep_steps fall asleep
+        :param store: ParticleStore of awake particles
+        """
+        kinetic = 0.5 * store.masses * (store.velocities * store.velocities).sum(axis=1)
+        store.rest_steps[:] = np.where(kinetic < self.sleep_energy, store.rest_steps + 1, 0)
+
+        # Sleepers are at rest, not crawling
+        store.velocities[store.rest_steps >= self.sleep_steps] = 0.
+
+    def integrate(self, store, lower, upper, dt, boundary: str = 'Reflective') -> None:
+        """
+        Advance every particle of a store inside a box, without particle collisions
+        :param store: ParticleStore holding the particles
+        :param lower: lower corner of the box
+        :param upper: upper corner of the box
+        :param dt: time increment (seconds)
+        :param boundary: 'Reflective' bounces particles off the walls, 'Periodic' wraps them around the sides
+        """
+        # A plain float scalar takes the type of the arrays it multiplies, a numpy float64 one would not
+        dt = float(dt)
+
+        if self.backend == 'numba':
+            # Walls are handled in the same pass, timed as integration
+            with self.profiler.phase('integration'):
+                self._kernels().integrate(store.positions, store.velocities, store.previous_positions,
+                                          store.radii, store.masses, store.energies,
+                                          np.asarray(lower, dtype=store.dtype), np.asarray(upper, dtype=store.dtype),
+                                          np.broadcast_to(np.asarray(self.g, dtype=store.dtype), (2,)), dt,
+                                          self.collision_handler == 'ContinuousDetection', boundary == 'Periodic',
+                                          2. if self.physics_type == 'SimpleMechanics' else 0.)
+            return
+
+        with self.profiler.phase('integration'):
+            store.previous_positions[:] = store.positions
+            store.positions[:] += store.velocities * dt
+
+        with self.profiler.phase('walls'):
+            if boundary == 'Periodic':
+                self.wrap_positions(store, lower, upper)
+            else:
+                self.bounce_off_walls(store, lower, upper)
+
+        with self.profiler.phase('integration'):
+            # Same as the per particle version, velocity is updated after the walls
+            store.velocities[:] += self.g * dt
+
+            store.energies[:] = self.compute_energies(store)
+
+    def compute_energies(self, store):
+        """
+        Vectorized version of compute_energy
+        :param store: ParticleStore to compute energies for
+        :return: (N,) array of energies
+        """
+        kinetic = 0.5 * store.masses * (store.velocities * store.velocities).sum(axis=1)
+        potential = -store.masses * (self.g * store.positions).sum(axis=1)
+
+        return kinetic + potential
+
     def compute_energy(self, entity):
         # E_k = 1/2 * m * v^2
         # E_p = m * g * h
 
+        # Potential is taken against g itself (-m * g . r) so that it stays a scalar whatever the shape of g
         kinetic = 0.5 * entity.mass * (magnitude(entity.velocity) ** 2)
-        potential = entity.mass * self.g * entity.y
+        potential = -entity.mass * np.sum(self.g * entity.position)
 
         return kinetic + potential
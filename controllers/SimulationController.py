@@ -1,20 +1,73 @@
-import sys
 import numpy as np
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-from matplotlib import animation
-from typing import Union, Sequence
-from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from typing import Sequence, Callable, Iterator
 
-from structures.BaseParticle import BaseParticle
+from structures.Box import Box
 from controllers.PhysicsController import PhysicsController
+from util.Diagnostics import EnergyDiagnostics
+
+# Settings of an ensemble member that are not given in its configuration
+ENSEMBLE_DEFAULTS = {
+    'physics_type': 'VectorizedMechanics',
+    'collision_detection': 'UniformGrid',
+    'collision_handler': 'DiscreteDetection',
+    'backend': 'numpy',
+    # Floating point type of the particle state
+    'dtype': 'float64',
+    'number_particles': 100,
+    # A single radius, one per particle, or a function (rng, number_particles) -> radii
+    'radius': 0.01,
+    # Gravitational acceleration vector, PhysicsController's default if None
+    'g': None,
+    'seed': None,
+    'placement': 'Batched',
+    'half_lengths': (0.5, 0.5),
+    # 'Reflective' walls or 'Periodic' sides, see structures.Box
+    'boundary': 'Reflective',
+    'steps': 100,
+    'dt': 0.01,
+    # Record the total energy every this many steps
+    'energy_interval': 1,
+}
+
+
+def _run_ensemble_member(configuration: dict) -> dict:
+    """
+    Worker task of SimulationController.run_ensemble, only plain arrays travel back to the parent process
+    """
+    simulation = SimulationController.from_configuration(configuration)
+    settings = simulation.configuration
+    store = simulation.particle_store
+
+    diagnostics = EnergyDiagnostics(settings['energy_interval'])
+    diagnostics.sample(simulation)
+    simulation.run(settings['steps'], settings['dt'], observers=[diagnostics])
+    simulation.physics.close()
+
+    return {
+        'configuration': configuration,
+        'positions': store.positions.copy(),
+        'velocities': store.velocities.copy(),
+        'radii': store.radii.copy(),
+        'masses': store.masses.copy(),
+        'times': diagnostics.times,
+        'energies': diagnostics.total,
+        'momentum': diagnostics.momentum,
+    }
 
 
 class SimulationController:
-    def __init__(self, physics_type: str, collision_handler: str) -> None:
+    def __init__(self, physics_type: str, collision_handler: str, collision_detection: str = 'PairWise',
+                 processes: int = 1, backend: str = 'numpy', dtype=np.float64) -> None:
         """
         Initialize the controller a square world of sides=world_size
         :param physics_type: String describing the physics to work with
+        :param collision_handler: String describing how collisions are handled
+        :param collision_detection: String describing how colliding particles are found
+        :param processes: number of processes stepping 'VectorizedMechanics' particles with 'DiscreteDetection'
+        :param backend: 'numpy' or 'numba', how the physics kernels run
+        :param dtype: floating point type particles are stored and stepped as, np.float32 halves the memory traffic
+                      at the cost of accuracy
         """
 
         self.world = None
@@ -22,15 +75,103 @@ class SimulationController:
         self.particles = []
         self.circles = []
 
+        # Simulated time and number of steps taken so far
+        self.time = 0.
+        self.step_count = 0
+        # Time increment of an animation frame
+        self.frame_dt = 0.1
+        # TimestepController splitting frames in sub-steps, None steps a whole frame at once
+        self.timestep = None
+
         self.MAX_ITERATIONS = 20
+        self.dtype = np.dtype(dtype)
         # Set an epsilon to ensure non-zero but almost 0 in some cases
-        self.epsilon = sys.float_info.epsilon
+        self.epsilon = np.finfo(self.dtype).eps
 
-        self.physics = PhysicsController(physics_type, collision_handler=collision_handler)
+        self.physics = PhysicsController(physics_type, collision_detection=collision_detection,
+                                         collision_handler=collision_handler, processes=processes,
+                                         backend=backend, dtype=self.dtype)
 
     def generate_world(self, world):
+        # Particles of the world, and the ones added to it later, are stored with the simulation's type
+        world.set_dtype(self.dtype)
         self.world = world
 
+    @classmethod
+    def from_configuration(cls, configuration: dict):
+        """
+        Simulation of particles in a box, set up from a configuration dictionary
+        :param configuration: settings overriding ENSEMBLE_DEFAULTS
+        :return: SimulationController ready to run, with the merged settings as its configuration attribute
+        """
+        unknown = set(configuration) - set(ENSEMBLE_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown configuration keys {sorted(unknown)}")
+        settings = {**ENSEMBLE_DEFAULTS, **configuration}
+
+        simulation = cls(settings['physics_type'], collision_handler=settings['collision_handler'],
+                         collision_detection=settings['collision_detection'], backend=settings['backend'],
+                         dtype=settings['dtype'])
+        simulation.configuration = settings
+        if settings['g'] is not None:
+            simulation.physics.g = np.array(settings['g'], dtype=float)
+
+        world = Box(settings['half_lengths'], (0., 0.), settings['half_lengths'], border_material='wood', fill='vacuum',
+                    boundary=settings['boundary'])
+        simulation.generate_world(world)
+
+        number_particles = settings['number_particles']
+        radius = settings['radius']
+        if callable(radius):
+            # Placement draws from the seed itself, radii from a stream spawned from it, so the two are independent
+            # (the same seed for both would tie each radius to the position drawn in the same turn)
+            seed = settings['seed']
+            radius_seed = None if seed is None else np.random.SeedSequence(seed).spawn(1)[0]
+            radius = radius(np.random.default_rng(radius_seed), number_particles)
+
+        world.generate_box_particles(number_particles, world, radius, method=settings['placement'],
+                                     seed=settings['seed'])
+        simulation.particles = world.particles
+
+        return simulation
+
+    @staticmethod
+    def run_ensemble(configurations: Sequence[dict], processes: int = None) -> list:
+        """
+        Run many independent headless simulations, spread over a pool of processes
+        Each run is built from its configuration in a worker, see ENSEMBLE_DEFAULTS for the settings. Functions given
+        as radius must be picklable (defined at module level).
+        :param configurations: one dictionary of settings per run
+        :param processes: number of worker processes, all cores if None, 1 runs everything in this process
+        :return: one dictionary per configuration, in order, holding the configuration, final 'positions',
+                 'velocities', 'radii' and 'masses', and the total 'energies' and 'momentum' recorded at 'times'
+        """
+        if processes == 1:
+            return [_run_ensemble_member(configuration) for configuration in configurations]
+
+        with ProcessPoolExecutor(processes) as executor:
+            return list(executor.map(_run_ensemble_member, configurations))
+
+    @property
+    def profiler(self):
+        """
+        Profiler timing the phases of each step, a StepProfiler from util.Profiling or the default no-op one
+        """
+        return self.physics.profiler
+
+    @profiler.setter
+    def profiler(self, value) -> None:
+        self.physics.profiler = value
+
+    @property
+    def particle_store(self):
+        """
+        Contiguous state of the world's particles, None until particles are added
+        """
+        if self.world is None:
+            return None
+        return self.world.particle_store
+
     #def step_forward(self, dt: float) -> None:
     #    """
     #    Method to describe the moving forward by increment of time
@@ -44,45 +185,185 @@ class SimulationController:
     #
     #    self.physics.handle_possible_collisions(self.particles)
 
+    def step(self, dt: float) -> None:
+        """
+        Move the simulation forward by dt
+        :param dt: time increment (seconds)
+        :return: None
+        """
+        self.profiler.begin_step()
+
+        if self.world is not None and self.particles is self.world.particles:
+            # Particles belong to the world, let physics walk the construct tree (batched if it can)
+            self.physics.increment_construct(self.world, dt)
+        else:
+            for i, p in enumerate(self.particles):
+                #if i == 0:
+                #    print(f"Particle {i}:\nPosition: {p.position}\nVelocity: {p.velocity}")
+
+                self.physics.iterate_position(p, dt)
+
+            self.physics.detect_collisions(self.particles)
+
+        self.time += dt
+        self.step_count += 1
+        # Every step gets its record, even when advance takes several of them for one frame
+        self.profiler.end_step(self)
+
+    def advance(self, duration: float) -> int:
+        """
+        Move the simulation forward by duration, in sub-steps picked by self.timestep if there is one
+        :param duration: time to simulate (seconds)
+        :return: number of steps taken
+        """
+        if self.timestep is None:
+            self.step(duration)
+            return 1
+
+        end = self.time + duration
+        steps = 0
+        # Left over rounding is not worth a step
+        while end - self.time > 1e-9 * duration:
+            store = self.particle_store
+            if store is not None and self.particles is self.world.particles:
+                velocities, radii = store.velocities, store.radii
+            else:
+                velocities = np.array([p.velocity for p in self.particles]).reshape(-1, 2)
+                radii = np.array([p.radius for p in self.particles])
+
+            self.step(self.timestep.choose(velocities, radii, self.physics.g, end - self.time))
+            steps += 1
+
+        return steps
+
+    def run_frames(self, frames: int, frame_dt: float = None, observers: Sequence[Callable] = ()):
+        """
+        Run the simulation headless frame by frame, each frame may take several steps (see advance)
+        :param frames: number of frames
+        :param frame_dt: simulated time between frames (seconds), self.frame_dt if None
+        :param observers: callables called with this controller after every frame
+        :return: self
+        """
+        frame_dt = self.frame_dt if frame_dt is None else frame_dt
+
+        profiler = self.profiler
+        for _ in range(frames):
+            self.advance(frame_dt)
+            # Output is timed per frame, outside of the step records
+            with profiler.phase('output'):
+                for observer in observers:
+                    observer(self)
+
+        return self
+
+    def iterate(self, steps: int, dt: float) -> Iterator[int]:
+        """
+        Step the simulation without any rendering, yielding after each step
+        :param steps: number of steps to take
+        :param dt: time increment of each step (seconds)
+        :return: iterator over the step count after each step
+        """
+        for _ in range(steps):
+            self.step(dt)
+            yield self.step_count
+
+    def run(self, steps: int, dt: float, observers: Sequence[Callable] = ()):
+        """
+        Run the simulation headless, matplotlib is never imported
+        :param steps: number of steps to take
+        :param dt: time increment of each step (seconds)
+        :param observers: callables called with this controller after every step
+        :return: self
+        """
+        profiler = self.profiler
+        for _ in self.iterate(steps, dt):
+            with profiler.phase('output'):
+                for observer in observers:
+                    observer(self)
+
+        return self
+
+    def _particle_arrays(self):
+        # Positions and radii of the simulated particles, straight from the store when possible
+        store = self.particle_store
+        if store is not None and self.particles is self.world.particles:
+            return store.positions, store.radii
+        return (np.array([p.position for p in self.particles]).reshape(-1, 2),
+                np.array([p.radius for p in self.particles]))
+
     def init(self):
         """Initialize the Matplotlib animation."""
+        # Imported here, matplotlib is only needed for animations
+        from matplotlib.collections import EllipseCollection
+
+        # One collection for every particle, a single artist to update and draw each frame
+        positions, radii = self._particle_arrays()
+        colors = [particle.styles['color'] for particle in self.particles]
+        self.circles = [EllipseCollection(2. * radii, 2. * radii, np.zeros(len(radii)), units='xy', offsets=positions,
+                                          offset_transform=self.ax.transData, facecolors=colors)]
+        self.ax.add_collection(self.circles[0])
 
-        self.circles = []
-        for particle in self.particles:
-            self.circles.append(particle.draw(self.ax))
         return self.circles
 
     def advance_animation(self, dt):
-        """Advance the animation by dt, returning the updated Circles list."""
+        """Advance the animation by dt, returning the updated artists list."""
 
-        #self.physics.increment_construct(self.world, dt)
-        ##Loop over everything and assign to old self.circles
-        #self.draw_world()
+        self.advance(dt)
 
-        for i, p in enumerate(self.particles):
-            #if i == 0:
-            #    print(f"Particle {i}:\nPosition: {p.position}\nVelocity: {p.velocity}")
+        positions, _ = self._particle_arrays()
+        self.circles[0].set_offsets(positions)
 
-            self.physics.iterate_position(p, dt)
-            self.circles[i].center = p.position
-
-        self.physics.detect_collisions(self.particles)
         return self.circles
 
     def animate(self, i):
         """The function passed to Matplotlib's FuncAnimation routine."""
 
-        self.advance_animation(0.1)
+        self.advance_animation(self.frame_dt)
         return self.circles
 
-    def do_animation(self, frames=800, save=False):
+    def record(self, frames: int, path: str, frame_dt: float = None, size: Sequence[int] = (800, 800), fps: int = 30,
+               observers: Sequence[Callable] = ()):
+        """
+        Run headless and stream a video of the run, particles are drawn straight into image arrays (no matplotlib)
+        :param frames: number of frames
+        :param path: video file or folder for PNG frames, see util.Rendering.FrameStreamer
+        :param frame_dt: simulated time between frames (seconds), self.frame_dt if None
+        :param size: (width, height) of the video in pixels
+        :param fps: frames per second of the video
+        :param observers: callables called with this controller after every frame
+        :return: self
+        """
+        # Imported here, rendering is only needed when recording
+        from util.Rendering import FrameStreamer, rasterize
+
+        lower = self.world.position - self.world.half_lengths
+        upper = self.world.position + self.world.half_lengths
+        image = np.empty((size[1], size[0], 3), dtype=np.uint8)
+
+        with FrameStreamer(path, size, fps) as streamer:
+            def draw(simulation):
+                positions, radii = simulation._particle_arrays()
+                streamer.write(rasterize(positions, radii, lower, upper, size, image=image))
+
+            self.run_frames(frames, frame_dt, observers=list(observers) + [draw])
+
+        return self
+
+    def do_animation(self, frames=800, save=False, dt=None):
+        # Only the animation needs matplotlib, keep it out of headless runs
+        import matplotlib.pyplot as plt
+        from matplotlib import animation
+
+        if dt is not None:
+            self.frame_dt = dt
+
         fig, self.ax = plt.subplots()
         for s in ['top', 'bottom', 'left', 'right']:
             self.ax.spines[s].set_linewidth(2)
         self.ax.set_aspect('equal', 'box')
 
-        self.ax.set_xlim(self.world.position[0] - self.world.hlx, self.world.position[1] + self.world.hlx)
-        self.ax.set_ylim(0, 1)
+        self.ax.set_xlim(self.world.position[0] - self.world.hlx, self.world.position[0] + self.world.hlx)
+        self.ax.set_ylim(self.world.position[1] - self.world.hly, self.world.position[1] + self.world.hly)
         self.ax.xaxis.set_ticks([])
         self.ax.yaxis.set_ticks([])
 
@@ -0,0 +1,51 @@
+import numpy as np
+
+
+class TimestepController:
+    """
+    Picks the time increment of each step from the state of the particles (CFL like condition)
+    No particle may travel more than a fraction (courant) of its own radius in a step, so fast particles get small
+    steps and a calm system gets large ones
+    """
+
+    def __init__(self, courant: float = 0.25, dt_min: float = 1e-6, dt_max: float = None):
+        """
+        Init for TimestepController
+        :param courant: largest fraction of its radius a particle may travel in a step
+        :param dt_min: never step less than this, even for particles about to tunnel (seconds)
+        :param dt_max: never step more than this (seconds), no limit if None
+        """
+        if courant <= 0.:
+            raise ValueError("courant must be positive")
+
+        self.courant = courant
+        self.dt_min = dt_min
+        self.dt_max = np.inf if dt_max is None else dt_max
+
+    def choose(self, velocities: np.ndarray, radii: np.ndarray, g=0., remaining: float = np.inf) -> float:
+        """
+        Largest time increment keeping every particle within courant * radius of where it starts
+        :param velocities: (N, 2) particle velocities
+        :param radii: (N,) particle radii
+        :param g: gravitational acceleration vector, particles speed up during the step
+        :param remaining: time left until the next output, the step never goes past it
+        :return: time increment (seconds)
+        """
+        dt = min(self.dt_max, remaining)
+        if len(radii) == 0:
+            return dt
+
+        speeds = np.sqrt((velocities * velocities).sum(axis=1))
+        acceleration = np.sqrt(np.sum(np.square(g)))
+        reach = self.courant * radii
+
+        # Distance covered is |v| t + |g| t^2 / 2, solved for t when it equals reach
+        # (written so that it holds for g = 0 and doesn't lose precision for small g)
+        denominator = speeds + np.sqrt(speeds * speeds + 2. * acceleration * reach)
+        moving = denominator > 0.
+        limits = 2. * reach[moving] / denominator[moving]
+        if len(limits) == 0:
+            return dt
+
+        # A Python float, a float32 store would otherwise make the simulation time float32 too
+        return float(max(min(dt, limits.min()), min(self.dt_min, remaining)))
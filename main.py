@@ -1,27 +1,156 @@
+import argparse
+import time
+
+import numpy as np
+
 from controllers.SimulationController import SimulationController
+from controllers.TimestepController import TimestepController
 from structures.Box import Box
-from structures.BaseParticle import BaseParticle
+from util.Trajectory import TrajectoryWriter
+from util.Diagnostics import EnergyDiagnostics
+from util.Analysis import VelocityHistogram, RadialDistribution, MeanSquaredDisplacement, save_analysis
+from util.Profiling import StepProfiler
+from util.Checkpoint import AutoCheckpoint, load_checkpoint
 
-import numpy as np
 
-# Press the green button in the gutter to run the script.
-if __name__ == '__main__':
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(description='Simple 2D particle physics simulator')
+    parser.add_argument('--particles', type=int, default=10, help='number of particles')
+    parser.add_argument('--max-radius', type=float, default=0.03,
+                        help='particle radii are drawn uniformly in [0, max-radius)')
+    parser.add_argument('--steps', type=int, default=100, help='number of steps (frames with --courant or animating)')
+    parser.add_argument('--dt', type=float, default=0.1, help='time increment of a step or frame (seconds)')
+    parser.add_argument('--courant', type=float, default=None,
+                        help='split each dt in adaptive sub-steps where no particle moves more than this fraction '
+                             'of its radius')
+    parser.add_argument('--gravity', type=float, default=0., help='downward gravitational acceleration (m/s^2)')
+    parser.add_argument('--physics-type', default='SimpleMechanics',
+                        choices=['SimpleMechanics', 'VectorizedMechanics'])
+    parser.add_argument('--collision-detection', default='PairWise',
+                        choices=['PairWise', 'UniformGrid', 'SweepAndPrune', 'KDTree'])
+    parser.add_argument('--collision-handler', default='ContinuousDetection',
+                        choices=['DiscreteDetection', 'ContinuousDetection'])
+    parser.add_argument('--backend', default='numpy', choices=['numpy', 'numba'],
+                        help='run the physics kernels as array operations or compiled loops (needs numba)')
+    parser.add_argument('--dtype', default='float64', choices=['float64', 'float32'],
+                        help='floating point type of the particle state, float32 halves memory traffic but is less '
+                             'accurate')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='worker processes for VectorizedMechanics with DiscreteDetection, spread over subdomains '
+                             'of the box (needs a broad phase, not PairWise)')
+    parser.add_argument('--boundary', default='Reflective', choices=['Reflective', 'Periodic'],
+                        help='particles bounce off the walls of the box, or leave through a side and come back '
+                             'through the opposite one')
+    parser.add_argument('--placement', default='Batched', choices=['Rejection', 'Batched', 'Lattice'],
+                        help='how particles are placed in the box')
+    parser.add_argument('--seed', type=int, default=None, help='random seed for reproducible runs')
+    parser.add_argument('--trajectory', default=None, help='headless runs only, stream states to this file')
+    parser.add_argument('--output-interval', type=int, default=1, help='write the trajectory every this many steps')
+    parser.add_argument('--diagnostics', type=int, default=None, metavar='INTERVAL',
+                        help='headless runs only, sample energy and momentum every INTERVAL steps and report the drift')
+    parser.add_argument('--analysis', default=None,
+                        help='headless runs only, accumulate speed distributions, g(r) and mean squared displacement '
+                             'while running and write them to this .npz file')
+    parser.add_argument('--analysis-interval', type=int, default=10, help='sample the analyses every this many steps')
+    parser.add_argument('--profile', action='store_true', help='headless runs only, report where the time goes')
+    parser.add_argument('--checkpoint', default=None, help='headless runs only, keep a checkpoint of the run in this file')
+    parser.add_argument('--checkpoint-interval', type=int, default=100, help='checkpoint every this many steps')
+    parser.add_argument('--resume', default=None,
+                        help='carry on from a checkpoint for --steps more steps, ignoring the setup options')
+    parser.add_argument('--render', default=None,
+                        help='headless runs only, stream a video of the run to this file (.gif, .mp4 with ffmpeg...) '
+                             'or folder of PNG frames')
+    parser.add_argument('--animate', action='store_true', help='show a matplotlib animation instead of running headless')
+    parser.add_argument('--save', action='store_true', help='with --animate, save to animations/collision.gif')
+
+    return parser.parse_args(arguments)
 
-    nparticles = 10
-    radii = np.random.random(nparticles) * 0.03
-    sim = SimulationController('SimpleMechanics', collision_handler='ContinuousDetection')
-    world = Box((0.5, 0.5), (0., 0.), (0.5, 0.5), border_material='wood', fill='vacuum')
-    #world.add_elements(particles)
-    sim.generate_world(world)
-    #sim.initialize_particles(nparticles, radii)
 
-    #p1 = BaseParticle((0.1, 0.4), (-0.05, 0), 0.05, 1)
-    #p1.parent = world
-    #p2 = BaseParticle((0.29, 0.1), (-0.01, 0), 0.05, 1)
-    #sim.particles = [p1]
+def build_simulation(args) -> SimulationController:
+    if args.seed is not None:
+        np.random.seed(args.seed)
 
-    world.generate_box_particles(nparticles, world, radii)
+    sim = SimulationController(args.physics_type, collision_handler=args.collision_handler,
+                               collision_detection=args.collision_detection, processes=args.processes,
+                               backend=args.backend, dtype=args.dtype)
+    world = Box((0.5, 0.5), (0., 0.), (0.5, 0.5), border_material='wood', fill='vacuum', boundary=args.boundary)
+    sim.generate_world(world)
+
+    radii = np.random.random(args.particles) * args.max_radius
+    world.generate_box_particles(args.particles, world, radii, method=args.placement, seed=args.seed)
     sim.particles = world.particles
-    sim.physics.g = 0.
+    sim.physics.g = np.array((0., -args.gravity))
+    if args.courant is not None:
+        sim.timestep = TimestepController(args.courant)
+
+    return sim
 
-    sim.do_animation(frames=100, save=True)
+
+def main(arguments=None):
+    args = parse_arguments(arguments)
+    sim = build_simulation(args) if args.resume is None else load_checkpoint(args.resume)
+
+    if args.animate:
+        sim.do_animation(frames=args.steps, save=args.save, dt=args.dt)
+        return sim
+
+    observers = []
+    if args.trajectory is not None:
+        world = sim.world
+        observers.append(TrajectoryWriter(args.trajectory, len(sim.particles), sim.particle_store.dtype,
+                                          interval=args.output_interval,
+                                          radii=sim.particle_store.radii,
+                                          bounds=(world.position - world.half_lengths,
+                                                  world.position + world.half_lengths)))
+    diagnostics = None
+    if args.diagnostics is not None:
+        diagnostics = EnergyDiagnostics(args.diagnostics)
+        diagnostics.sample(sim)
+        observers.append(diagnostics)
+    analyses = {}
+    if args.analysis is not None:
+        analyses = {'speeds': VelocityHistogram(args.analysis_interval),
+                    'rdf': RadialDistribution(0.5 * sim.world.half_lengths.min(), args.analysis_interval),
+                    'msd': MeanSquaredDisplacement(args.analysis_interval)}
+        observers.extend(analyses.values())
+    if args.checkpoint is not None:
+        observers.append(AutoCheckpoint(args.checkpoint, interval=args.checkpoint_interval))
+
+    if args.profile:
+        sim.profiler = StepProfiler()
+
+    start_steps = sim.step_count
+    start = time.perf_counter()
+    try:
+        if args.render is not None:
+            sim.record(args.steps, args.render, args.dt, observers=observers)
+        else:
+            sim.run_frames(args.steps, args.dt, observers=observers)
+        elapsed = time.perf_counter() - start
+    finally:
+        # Files, worker processes and shared memory are released even if the run fails
+        for observer in observers:
+            if hasattr(observer, 'close'):
+                observer.close()
+        sim.physics.close()
+
+    steps = sim.step_count - start_steps
+    print(f"{steps} steps of {len(sim.particles)} particles in {elapsed:.3f}s "
+          f"({steps / max(elapsed, 1e-12):.1f} steps/s), simulated time {sim.time:.3f}s")
+    if diagnostics is not None:
+        drift = diagnostics.energy_drift()
+        print(f"Energy drift {drift[-1]:.3e} (largest {np.abs(drift).max():.3e}), "
+              f"final momentum {diagnostics.momentum[-1]}")
+    if args.profile:
+        print(sim.profiler.summary())
+    if analyses:
+        save_analysis(args.analysis, **analyses)
+        print(f"Analyses of {analyses['speeds'].sample_count} samples written to {args.analysis}, "
+              f"kT {analyses['speeds'].temperature:.4g}")
+
+    return sim
+
+
+# Press the green button in the gutter to run the script.
+if __name__ == '__main__':
+    main()
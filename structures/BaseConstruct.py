@@ -2,6 +2,8 @@ import numpy as np
 from typing import Sequence, Union
 
 from util.Maths import cart2pol, pol2cart
+from .ParticleStore import ParticleStore
+from .ParticleList import ParticleList
 
 
 class BaseConstruct:
@@ -9,13 +11,20 @@ class BaseConstruct:
         Class representing the base of any construct/object
     """
 
-    def __init__(self, position, velocity, parent, styles=None):
+    # Static constructs and everything in them are frozen, physics skips them entirely
+    static = False
+    # What happens to particles reaching the sides, see Box, only periodic boxes have a period
+    boundary = 'Reflective'
+    period = None
+
+    def __init__(self, position, velocity, parent, styles=None, dtype=np.float64):
         """
         Init for base construct
         :param position: Sequence of floats definining position in meters
         :param velocity: Sequence of floats definining velocity in meters/seconds
         :param parent: Parent object
         :param styles: styles dictionary
+        :param dtype: floating point type the state of the particles added to this construct is stored as
         """
         # Set basic position, velocity
         self._position = np.array(position)
@@ -26,13 +35,62 @@ class BaseConstruct:
 
         self.parent = parent
         self.children = []
-        self.particles = []
+        # Handles on the rows of particle_store, built on access
+        self.particles = ParticleList(self)
+        # Contiguous state of self.particles, created with the first particle
+        self.particle_store = None
+        self.dtype = np.dtype(dtype)
 
         if styles is None:
             self.styles = {'color': np.random.rand(3,), 'edgecolor': None}
         else:
             self.styles = styles
 
+    def add_particle(self, particle):
+        """
+        Add a particle to this construct, moving its state into the construct's store
+        :param particle: BaseParticle to add
+        :return: the added particle
+        """
+        if self.particle_store is None:
+            self.particle_store = ParticleStore(dtype=self.dtype)
+
+        particle.attach_store(self.particle_store)
+        particle.parent = self
+        if particle._styles is not None:
+            self.particles.styles[particle.index] = particle._styles
+        self.particles.keep(particle)
+
+        return particle
+
+    def add_particles(self, positions, velocities, radii, masses) -> list:
+        """
+        Add many particles at once, writing their state to the store in bulk
+        :param positions: (N, 2) positions
+        :param velocities: (N, 2) velocities
+        :param radii: (N,) radii or a single radius for all
+        :param masses: (N,) masses or a single mass for all
+        :return: the new particles, see ParticleList
+        """
+        if self.particle_store is None:
+            self.particle_store = ParticleStore(capacity=len(positions), dtype=self.dtype)
+
+        indices = self.particle_store.extend(positions, velocities, radii, masses)
+
+        return self.particles[indices.start:indices.stop]
+
+    def set_dtype(self, dtype) -> None:
+        """
+        Store the particles of this construct and of all its children as another floating point type
+        :param dtype: new floating point type, e.g. np.float32
+        """
+        self.dtype = np.dtype(dtype)
+        if self.particle_store is not None:
+            self.particle_store.set_dtype(self.dtype)
+
+        for child in self.children:
+            child.set_dtype(dtype)
+
     # Define useful getter and setters
     @property
     def x(self) -> float:
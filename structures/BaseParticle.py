@@ -1,9 +1,9 @@
 import numpy as np
 from typing import Sequence, Union
-import matplotlib as mpl
 
 from .BaseConstruct import BaseConstruct
-from util.Maths import magnitude
+from .ParticleStore import ParticleStore
+from util.Maths import cart2pol
 
 POSITION_PRECISION = 1e-4
 
@@ -11,40 +11,160 @@ POSITION_PRECISION = 1e-4
 class BaseParticle(BaseConstruct):
     """
     Class representing the base of any particle
+
+    A particle does not own its state, it is a handle on one row of a ParticleStore. Particles created on their own
+    get a private store, adding them to a construct moves their state into the construct's store.
     """
 
-    def __init__(self, position, velocity, radius=0.01, mass=1, parent=None, styles=None):
+    # Particles never hold anything, share empty containers instead of allocating two lists per particle
+    children = ()
+    particles = ()
+
+    def __init__(self, position, velocity, radius=0.01, mass=1, parent=None, styles=None, store=None, index=None):
         """
         Init for BaseParticle
-        :param x: relative position in x (meters)
-        :param y: relative position in y (meters)
-        :param vx: velocity vector in x (m/s)
-        :param vy: velocity vector in y (m/s)
+        :param position: sequence of floats, relative position (meters)
+        :param velocity: sequence of floats, velocity vector (m/s)
         :param radius: radius of particle (m)
-        :parma mass :mass of particle (kg)
+        :param mass: mass of particle (kg)
+        :param parent: Parent object
+        :param styles: styles dictionary, a random color is picked on first use if None
+        :param store: ParticleStore holding the state, a private one is created if None
+        :param index: row of an already filled store to bind to, a new row is appended if None
+        """
+        # No call to BaseConstruct.__init__ on purpose, all state lives in the store
+        if store is None:
+            store = ParticleStore(capacity=1)
+        if index is None:
+            index = store.append(position, velocity, radius, mass)
+
+        self._store = store
+        self._index = index
+
+        self.parent = parent
+        self._styles = styles
+
+    @classmethod
+    def from_store(cls, store: ParticleStore, index: int, parent=None, styles=None):
+        """
+        Create a handle on a particle already in store
         """
+        return cls(None, None, store=store, index=index, parent=parent, styles=styles)
 
-        # Init position and styles
-        super().__init__(position, velocity, parent, styles)
+    def __eq__(self, other) -> bool:
+        # Handles on the same row of the same store are the same particle
+        if not isinstance(other, BaseParticle):
+            return NotImplemented
+        return self._store is other._store and self._index == other._index
 
-        # Set basic position, velocity, and radius values
-        self._radius = radius
+    def __hash__(self) -> int:
+        # Changes when the particle moves to another store (see attach_store), add it to a construct before hashing
+        return hash((id(self._store), self._index))
 
-        self.mass = mass
-        self.energy = 0.0
+    @property
+    def store(self) -> ParticleStore:
+        return self._store
+
+    @property
+    def index(self) -> int:
+        return self._index
+
+    def attach_store(self, store: ParticleStore) -> None:
+        """
+        Move this particle's state into another store
+        :param store: the ParticleStore to move into
+        """
+        if store is self._store:
+            return
+
+        previous_position = self.previous_position
+        index = store.append(self._position, self._velocity, self.radius, self.mass, self.energy)
+        store._previous_positions[index] = previous_position
+
+        self._store = store
+        self._index = index
+
+    # Redirect the state BaseConstruct expects to the store
+    @property
+    def _position(self) -> np.ndarray:
+        return self._store._positions[self._index]
+
+    @_position.setter
+    def _position(self, value: Union[Sequence[float], np.ndarray]) -> None:
+        self._store._positions[self._index] = value
+
+    @property
+    def _velocity(self) -> np.ndarray:
+        return self._store._velocities[self._index]
+
+    @_velocity.setter
+    def _velocity(self, value: Union[Sequence[float], np.ndarray]) -> None:
+        self._store._velocities[self._index] = value
+
+    @property
+    def _radial_velocity(self):
+        # Derived from velocity on demand rather than kept in sync
+        return cart2pol(self._velocity)
+
+    @_radial_velocity.setter
+    def _radial_velocity(self, value) -> None:
+        pass
+
+    @property
+    def previous_position(self) -> np.ndarray:
+        return self._store._previous_positions[self._index]
+
+    @previous_position.setter
+    def previous_position(self, value: Union[Sequence[float], np.ndarray]) -> None:
+        self._store._previous_positions[self._index] = value
 
     # Define useful getter and setters
     @property
     def radius(self) -> float:
-        return self._radius
+        return self._store._radii[self._index]
 
     @radius.setter
     def radius(self, value: float) -> None:
         assert value > 0.
-        self._radius = value
+        self._store._radii[self._index] = value
+
+    @property
+    def mass(self) -> float:
+        return self._store._masses[self._index]
+
+    @mass.setter
+    def mass(self, value: float) -> None:
+        self._store._masses[self._index] = value
+
+    @property
+    def energy(self) -> float:
+        return self._store._energies[self._index]
+
+    @energy.setter
+    def energy(self, value: float) -> None:
+        self._store._energies[self._index] = value
+
+    @property
+    def styles(self) -> dict:
+        # Only pick a color when something actually wants to draw the particle
+        if self._styles is None:
+            self.styles = {'color': np.random.rand(3,), 'edgecolor': None}
+        return self._styles
+
+    @styles.setter
+    def styles(self, value: dict) -> None:
+        self._styles = value
+        # Handles of a construct's particles are built on demand (see ParticleList), the construct keeps the styles
+        # for the next handle on this particle
+        parent = self.parent
+        if parent is not None and getattr(parent, 'particle_store', None) is self._store:
+            parent.particles.styles[self._index] = value
 
     def draw(self, ax):
-        circle = mpl.patches.Circle(xy=self.position, radius=self.radius, **self.styles)
+        # Imported here so that particles don't need matplotlib unless drawn
+        from matplotlib.patches import Circle
+
+        circle = Circle(xy=self.position, radius=self.radius, **self.styles)
         ax.add_patch(circle)
 
         #ax.text(self.x, self.y, str(self.vy))
@@ -3,9 +3,14 @@ from .BaseConstruct import BaseConstruct
 from util.ParticleGeneration import generate_particles_in_box
 
 
+# What happens to particles reaching the sides of a box, 'Reflective' walls bounce them back, 'Periodic' sides let
+# them through to reappear on the opposite side (and particles interact across sides, through their nearest image)
+BOUNDARIES = ('Reflective', 'Periodic')
+
+
 class Box(BaseConstruct):
     def __init__(self, position=(0., 0.), velocity=(0., 0.), half_lengths=(1., 1.), border_material='Inf',
-                 fill='vacuum', static=True, parent=None, styles=None):
+                 fill='vacuum', static=False, parent=None, styles=None, dtype=np.float64, boundary='Reflective'):
         """
         Class to allow the construction of a box
         :param position: sequence of floats describing center position of the box
@@ -13,16 +18,22 @@ class Box(BaseConstruct):
         :param half_lengths: sequence of half lengths (in meters)
         :param border_material: string representing the material name making the borders of this material
         :param fill: string representing what material fills the box
-        :param static: Boolean, if this object is immovable or not
+        :param static: Boolean, if this object is immovable or not, nothing inside a static box is ever stepped
         :param parent: Parent object if any
         :param styles: Visual styles dictionary
+        :param dtype: floating point type the particles inside are stored as
+        :param boundary: 'Reflective' or 'Periodic', see BOUNDARIES
         """
-        super().__init__(position, velocity, parent, styles)
+        super().__init__(position, velocity, parent, styles, dtype)
 
         self._half_lengths = np.array(half_lengths)
 
         self.fill = fill
         self.border_material = border_material
+        self.static = static
+        if boundary not in BOUNDARIES:
+            raise ValueError(f"Unknown boundary '{boundary}', expected one of {BOUNDARIES}")
+        self.boundary = boundary
 
         self.generate_box_particles = generate_particles_in_box
 
@@ -37,7 +48,7 @@ class Box(BaseConstruct):
 
     @property
     def hly(self) -> float:
-        return self._half_lengths[0]
+        return self._half_lengths[1]
 
     @hly.setter
     def hly(self, value: float) -> None:
@@ -47,3 +58,21 @@ class Box(BaseConstruct):
     @property
     def half_lengths(self):
         return self._half_lengths
+
+    @property
+    def lower(self) -> np.ndarray:
+        return self.position - self._half_lengths
+
+    @property
+    def upper(self) -> np.ndarray:
+        return self.position + self._half_lengths
+
+    @property
+    def period(self):
+        """
+        (2,) lengths particles wrap around in with a 'Periodic' boundary, None with reflecting walls
+        """
+        if self.boundary != 'Periodic':
+            return None
+        # Same rounding as the distance between the walls used everywhere else
+        return self.upper - self.lower
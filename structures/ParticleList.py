@@ -0,0 +1,108 @@
+from collections.abc import Sequence
+
+
+class ParticleList(Sequence):
+    """
+    Particles of a construct, as handles on the rows of its particle store built when they are accessed
+
+    A BaseParticle object per particle takes more memory than the particle's state in the store, so a handle is only
+    created the first time its row is accessed, then kept for the next accesses. Code working on the store never pays
+    for handles, code stepping particles one by one builds them once. Styles given to a particle are kept by the
+    construct's list, for a handle built again after the particle moved to another store.
+    """
+
+    def __init__(self, construct, rows: range = None):
+        """
+        Init for ParticleList
+        :param construct: construct owning the particles
+        :param rows: store rows in the list, every particle of the construct if None
+        """
+        self.construct = construct
+        self._rows = rows
+        # Styles of the particles that have some, by store row
+        self.styles = {}
+        # Handles already built, by store row (None where not built yet), only used in the construct's own list
+        self._handles = []
+
+    @property
+    def rows(self) -> range:
+        if self._rows is not None:
+            return self._rows
+        store = self.construct.particle_store
+        return range(0 if store is None else store.count)
+
+    def _handle(self, row: int):
+        # Imported here, BaseParticle builds on BaseConstruct which holds these lists
+        from .BaseParticle import BaseParticle
+
+        # Row never accessed, or its handle's particle was moved to another store and no longer points at it
+        construct = self.construct
+        store = construct.particle_store
+        handles = construct.particles._handles
+        if row >= len(handles):
+            handles.extend([None] * (row + 1 - len(handles)))
+
+        handle = BaseParticle.from_store(store, row, parent=construct, styles=construct.particles.styles.get(row))
+        handles[row] = handle
+        return handle
+
+    def keep(self, particle) -> None:
+        """
+        Use particle as the handle of its row, so the object added to the construct is the one found in the list
+        """
+        handles = self.construct.particles._handles
+        if particle.index >= len(handles):
+            handles.extend([None] * (particle.index + 1 - len(handles)))
+        handles[particle.index] = particle
+
+    def append(self, particle) -> None:
+        """
+        Add a particle to the construct, see BaseConstruct.add_particle
+        """
+        self.construct.add_particle(particle)
+
+    def extend(self, particles) -> None:
+        """
+        Add particles to the construct one by one, see BaseConstruct.add_particle
+        """
+        for particle in particles:
+            self.construct.add_particle(particle)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ParticleList(self.construct, self.rows[index])
+
+        row = self.rows[index]
+        handles = self.construct.particles._handles
+        # Handle already built, the usual case once particles have been stepped once
+        if row < len(handles):
+            handle = handles[row]
+            if handle is not None and handle._store is self.construct.particle_store:
+                return handle
+        return self._handle(row)
+
+    def __iter__(self):
+        store = self.construct.particle_store
+        handles = self.construct.particles._handles
+        for row in self.rows:
+            handle = handles[row] if row < len(handles) else None
+            if handle is None or handle._store is not store:
+                handle = self._handle(row)
+            yield handle
+
+    def __contains__(self, particle) -> bool:
+        return getattr(particle, 'store', None) is self.construct.particle_store and particle.index in self.rows
+
+    def index(self, particle, start: int = 0, stop: int = None) -> int:
+        if particle not in self:
+            raise ValueError("Particle is not in the list")
+        position = self.rows.index(particle.index)
+        if position < start or (stop is not None and position >= stop):
+            raise ValueError("Particle is not in the list")
+        return position
+
+    def __repr__(self) -> str:
+        return f"ParticleList({len(self)} particles of {type(self.construct).__name__})"
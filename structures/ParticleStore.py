@@ -0,0 +1,229 @@
+import numpy as np
+from typing import Sequence, Union
+
+
+class ParticleStore:
+    """
+    Contiguous structure-of-arrays storage for particle state.
+
+    Every particle owned by a construct lives in one row of these arrays, BaseParticle objects are only light handles
+    pointing at a row. Bulk operations (integration, collision detection...) work on the arrays directly.
+    """
+
+    # Number of values stored per particle, positions, velocities, previous positions (2 each), radius, mass, energy
+    VALUES_PER_PARTICLE = 9
+    _ARRAYS = ('_positions', '_velocities', '_previous_positions', '_radii', '_masses', '_energies', '_rest_steps')
+
+    def __init__(self, capacity: int = 16, dtype=np.float64, buffer=None, count: int = 0):
+        """
+        Init for ParticleStore
+        :param capacity: number of particles to allocate room for, storage grows automatically past it
+        :param dtype: floating point type used for every state array
+        :param buffer: existing memory (e.g. shared memory) holding the arrays, see use_buffer
+        :param count: number of particles already in buffer
+        """
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+        self.buffer = None
+
+        self._allocate(max(int(capacity), 1), buffer)
+        self.count = count
+
+    @classmethod
+    def buffer_size(cls, capacity: int, dtype=np.float64) -> int:
+        """
+        Bytes needed by a buffer holding capacity particles
+        """
+        return cls._rest_steps_offset(capacity, dtype) + capacity * np.dtype(np.int64).itemsize
+
+    @classmethod
+    def _rest_steps_offset(cls, capacity: int, dtype) -> int:
+        # rest_steps comes after the floats, rounded up so the int64s stay aligned with float32 too
+        float_bytes = cls.VALUES_PER_PARTICLE * capacity * np.dtype(dtype).itemsize
+        return -(-float_bytes // 8) * 8
+
+    def use_buffer(self, buffer) -> None:
+        """
+        Move the arrays into buffer, keeping their content
+        Growing the store past its capacity moves it back to private memory
+        :param buffer: writable buffer of at least buffer_size(capacity) bytes, None for private memory
+        """
+        self._allocate(self.capacity, buffer)
+
+    def _allocate(self, capacity: int, buffer=None) -> None:
+        # Bookkeeping for sleeping particles is kept out of the block since it's not part of the physical state
+        if buffer is None:
+            values = np.zeros(self.VALUES_PER_PARTICLE * capacity, dtype=self.dtype)
+            rest_steps = np.zeros(capacity, dtype=np.int64)
+        else:
+            values = np.frombuffer(buffer, dtype=self.dtype, count=self.VALUES_PER_PARTICLE * capacity)
+            # In the buffer too, so worker processes can put particles to sleep
+            rest_steps = np.frombuffer(buffer, dtype=np.int64, count=capacity,
+                                       offset=self._rest_steps_offset(capacity, self.dtype))
+
+        # All arrays are consecutive slices of one block
+        positions = values[:2 * capacity].reshape(capacity, 2)
+        velocities = values[2 * capacity:4 * capacity].reshape(capacity, 2)
+        previous_positions = values[4 * capacity:6 * capacity].reshape(capacity, 2)
+        radii = values[6 * capacity:7 * capacity]
+        masses = values[7 * capacity:8 * capacity]
+        energies = values[8 * capacity:]
+
+        # Keep what we already had when growing
+        if self.count > 0:
+            positions[:self.count] = self._positions[:self.count]
+            velocities[:self.count] = self._velocities[:self.count]
+            previous_positions[:self.count] = self._previous_positions[:self.count]
+            radii[:self.count] = self._radii[:self.count]
+            masses[:self.count] = self._masses[:self.count]
+            energies[:self.count] = self._energies[:self.count]
+            rest_steps[:self.count] = self._rest_steps[:self.count]
+
+        self.buffer = buffer
+        self._positions = positions
+        self._velocities = velocities
+        self._previous_positions = previous_positions
+        self._radii = radii
+        self._masses = masses
+        self._energies = energies
+        self._rest_steps = rest_steps
+
+    def set_dtype(self, dtype) -> None:
+        """
+        Convert every state array to another floating point type, keeping their content
+        The arrays are re-allocated (in private memory), so array views obtained before are no longer backed by the store
+        :param dtype: new floating point type, e.g. np.float32 to halve the memory used
+        """
+        dtype = np.dtype(dtype)
+        if dtype != self.dtype:
+            self.dtype = dtype
+            self._allocate(self.capacity)
+
+    @property
+    def capacity(self) -> int:
+        return len(self._radii)
+
+    def reserve(self, capacity: int) -> None:
+        """
+        Make sure there is room for at least capacity particles
+        Note that growing re-allocates, so array views obtained before are no longer backed by the store
+        :param capacity: minimum number of particles the store should hold
+        """
+        if capacity > self.capacity:
+            # Grow geometrically so that appending one by one stays amortised O(1)
+            self._allocate(max(int(capacity), 2 * self.capacity))
+
+    def append(self, position, velocity, radius: float, mass: float, energy: float = 0.) -> int:
+        """
+        Add a single particle to the store
+        :return: index of the new particle
+        """
+        self.reserve(self.count + 1)
+        index = self.count
+
+        self._positions[index] = position
+        self._velocities[index] = velocity
+        self._previous_positions[index] = position
+        self._radii[index] = radius
+        self._masses[index] = mass
+        self._energies[index] = energy
+        self._rest_steps[index] = 0
+
+        self.count += 1
+        return index
+
+    def extend(self, positions: Union[Sequence, np.ndarray], velocities: Union[Sequence, np.ndarray],
+               radii: Union[float, Sequence[float], np.ndarray], masses: Union[float, Sequence[float], np.ndarray]) -> range:
+        """
+        Add many particles at once
+        :param positions: (N, 2) positions
+        :param velocities: (N, 2) velocities
+        :param radii: (N,) radii or a single radius for all
+        :param masses: (N,) masses or a single mass for all
+        :return: range of the new indices
+        """
+        positions = np.asarray(positions, dtype=self.dtype).reshape(-1, 2)
+        amount = len(positions)
+
+        self.reserve(self.count + amount)
+        new = slice(self.count, self.count + amount)
+
+        self._positions[new] = positions
+        self._velocities[new] = velocities
+        self._previous_positions[new] = positions
+        self._radii[new] = radii
+        self._masses[new] = masses
+        self._energies[new] = 0.
+        self._rest_steps[new] = 0
+
+        self.count += amount
+        return range(new.start, new.stop)
+
+    # Views restricted to the particles actually in use
+    @property
+    def positions(self) -> np.ndarray:
+        return self._positions[:self.count]
+
+    @property
+    def velocities(self) -> np.ndarray:
+        return self._velocities[:self.count]
+
+    @property
+    def previous_positions(self) -> np.ndarray:
+        return self._previous_positions[:self.count]
+
+    @property
+    def radii(self) -> np.ndarray:
+        return self._radii[:self.count]
+
+    @property
+    def masses(self) -> np.ndarray:
+        return self._masses[:self.count]
+
+    @property
+    def energies(self) -> np.ndarray:
+        return self._energies[:self.count]
+
+    @property
+    def rest_steps(self) -> np.ndarray:
+        # Number of steps each particle has been (almost) at rest, see PhysicsController.sleep_energy
+        return self._rest_steps[:self.count]
+
+    def subset(self, start: int, stop: int):
+        """
+        Store whose arrays are views on particles start to stop of this one, for working on part of the particles
+        """
+        subset = ParticleStore.__new__(ParticleStore)
+        subset.dtype = self.dtype
+        subset.buffer = None
+        subset.count = stop - start
+        for name in self._ARRAYS:
+            setattr(subset, name, getattr(self, name)[start:stop])
+
+        return subset
+
+    def take(self, indices: np.ndarray):
+        """
+        Standalone store holding a copy of the particles at indices, see put to write them back
+        """
+        taken = ParticleStore(len(indices), self.dtype)
+        taken.count = len(indices)
+        for name in self._ARRAYS:
+            getattr(taken, name)[:taken.count] = getattr(self, name)[indices]
+
+        return taken
+
+    def put(self, indices: np.ndarray, store) -> None:
+        """
+        Write the particles of store (e.g. from take) back at indices
+        """
+        for name in self._ARRAYS:
+            getattr(self, name)[indices] = getattr(store, name)[:store.count]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (self._positions, self._velocities, self._previous_positions,
+                                              self._radii, self._masses, self._energies))
+
+    def __len__(self) -> int:
+        return self.count
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from controllers.SimulationController import SimulationController
+from structures.Box import Box
+
+
+def run(collision_detection: str, steps: int = 40):
+    rng = np.random.default_rng(3)
+    number_particles = 100
+    # Dense enough for particles to touch several others in one step
+    box = Box((0.5, 0.5), (0., 0.), (0.5, 0.5))
+    box.add_particles(rng.uniform(0.05, 0.95, (number_particles, 2)), rng.normal(0., 0.5, (number_particles, 2)),
+                      rng.uniform(0.01, 0.03, number_particles), rng.uniform(0.5, 2., number_particles))
+
+    simulation = SimulationController('VectorizedMechanics', collision_handler='DiscreteDetection',
+                                      collision_detection=collision_detection)
+    simulation.generate_world(box)
+    simulation.particles = box.particles
+    simulation.run(steps, 0.002)
+
+    return simulation.particle_store
+
+
+@pytest.fixture(scope='module')
+def expected():
+    return run('PairWise')
+
+
+@pytest.mark.parametrize('collision_detection', ['UniformGrid', 'SweepAndPrune', 'KDTree'])
+def test_broad_phases_give_the_pairwise_trajectories(expected, collision_detection):
+    if collision_detection == 'KDTree':
+        pytest.importorskip('scipy')
+    store = run(collision_detection)
+
+    # Same pairs in the same order, so bit for bit the same
+    np.testing.assert_array_equal(store.positions, expected.positions)
+    np.testing.assert_array_equal(store.velocities, expected.velocities)
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from controllers.SimulationController import SimulationController
+from controllers.TimestepController import TimestepController
+from structures.Box import Box
+from util.Checkpoint import load_checkpoint, save_checkpoint
+
+
+def make_simulation(dtype=np.float64) -> SimulationController:
+    rng = np.random.default_rng(11)
+    number_particles = 120
+    box = Box((0.5, 0.5), (0., 0.), (0.5, 0.5))
+    box.add_particles(rng.uniform(0.05, 0.95, (number_particles, 2)), rng.normal(0., 0.5, (number_particles, 2)),
+                      rng.uniform(0.005, 0.015, number_particles), rng.uniform(0.5, 2., number_particles))
+
+    simulation = SimulationController('VectorizedMechanics', collision_handler='DiscreteDetection',
+                                      collision_detection='UniformGrid', dtype=dtype)
+    simulation.generate_world(box)
+    simulation.particles = box.particles
+    simulation.physics.g = np.array((0., -1.))
+    return simulation
+
+
+def test_resumed_run_matches_an_uninterrupted_one(tmp_path):
+    path = str(tmp_path / 'checkpoint.npz')
+    uninterrupted = make_simulation()
+    uninterrupted.run(40, 0.002)
+
+    simulation = make_simulation()
+    simulation.run(20, 0.002)
+    save_checkpoint(simulation, path)
+    resumed = load_checkpoint(path)
+    resumed.run(20, 0.002)
+
+    assert resumed.step_count == uninterrupted.step_count
+    assert resumed.time == pytest.approx(uninterrupted.time)
+    np.testing.assert_array_equal(resumed.particle_store.positions, uninterrupted.particle_store.positions)
+    np.testing.assert_array_equal(resumed.particle_store.velocities, uninterrupted.particle_store.velocities)
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_adaptive_steps_round_trip(tmp_path, dtype):
+    path = str(tmp_path / 'checkpoint.npz')
+    uninterrupted = make_simulation(dtype)
+    uninterrupted.timestep = TimestepController(0.5)
+    uninterrupted.run_frames(6, 0.01)
+
+    simulation = make_simulation(dtype)
+    simulation.timestep = TimestepController(0.5)
+    simulation.run_frames(3, 0.01)
+    # Steps chosen from float32 velocities still leave the time a Python float, or it couldn't be saved
+    assert type(simulation.time) is float
+    save_checkpoint(simulation, path)
+    resumed = load_checkpoint(path)
+    resumed.run_frames(3, 0.01)
+
+    assert resumed.particle_store.dtype == dtype
+    assert resumed.step_count == uninterrupted.step_count
+    np.testing.assert_array_equal(resumed.particle_store.positions, uninterrupted.particle_store.positions)
+    np.testing.assert_array_equal(resumed.particle_store.velocities, uninterrupted.particle_store.velocities)
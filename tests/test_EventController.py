@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from controllers.SimulationController import SimulationController
+from structures.Box import Box
+from util.Diagnostics import EnergyDiagnostics
+from util.Profiling import StepProfiler
+
+
+@pytest.mark.parametrize('g', [(0., 0.), (0., -1.)])
+def test_events_conserve_energy(g):
+    rng = np.random.default_rng(5)
+    number_particles = 200
+    # On a lattice so nothing overlaps to begin with
+    side = 15
+    rows = np.arange(number_particles)
+    positions = np.stack([(rows % side + 0.5) / side, (rows // side + 0.5) / side], axis=1)
+    box = Box((0.5, 0.5), (0., 0.), (0.5, 0.5))
+    box.add_particles(positions, rng.normal(0., 0.5, (number_particles, 2)),
+                      rng.uniform(0.008, 0.02, number_particles), rng.uniform(0.5, 2., number_particles))
+
+    simulation = SimulationController('VectorizedMechanics', collision_handler='ContinuousDetection',
+                                      collision_detection='UniformGrid')
+    simulation.generate_world(box)
+    simulation.particles = box.particles
+    simulation.physics.g = np.array(g)
+    simulation.profiler = StepProfiler()
+    diagnostics = EnergyDiagnostics()
+    diagnostics.sample(simulation)
+    simulation.run(100, 0.005, observers=[diagnostics])
+
+    assert simulation.profiler.counts['events'] > 500
+    # Elastic collisions at their exact times, only rounding changes the energy
+    total = diagnostics.total
+    assert np.abs(total - total[0]).max() < 1e-12 * total[0]
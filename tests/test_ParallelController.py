@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from controllers.SimulationController import SimulationController
+from structures.Box import Box
+
+
+def run(processes: int, collision_detection: str = 'UniformGrid', boundary: str = 'Reflective', steps: int = 40):
+    rng = np.random.default_rng(7)
+    number_particles = 400
+    box = Box((0.5, 0.5), (0., 0.), (0.5, 0.5), boundary=boundary)
+    box.add_particles(rng.uniform(0.02, 0.98, (number_particles, 2)), rng.normal(0., 0.5, (number_particles, 2)),
+                      np.full(number_particles, 0.01), np.ones(number_particles))
+
+    simulation = SimulationController('VectorizedMechanics', collision_handler='DiscreteDetection',
+                                      collision_detection=collision_detection, processes=processes)
+    simulation.generate_world(box)
+    simulation.particles = box.particles
+    try:
+        simulation.run(steps, 0.002)
+    finally:
+        simulation.physics.close()
+
+    return simulation.particle_store
+
+
+@pytest.mark.parametrize('boundary', ['Reflective', 'Periodic'])
+@pytest.mark.parametrize('processes, collision_detection', [(2, 'UniformGrid'), (3, 'SweepAndPrune')])
+def test_workers_give_the_single_process_trajectories(boundary, processes, collision_detection):
+    expected = run(1, boundary=boundary)
+    store = run(processes, collision_detection, boundary)
+
+    # Contacts are resolved in the same order whichever process handles them
+    np.testing.assert_array_equal(store.positions, expected.positions)
+    np.testing.assert_array_equal(store.velocities, expected.velocities)
+
+
+def run_sleeping(processes: int, steps: int = 150):
+    # Particles at rest on a lattice, a fast one wakes some of them up
+    number_particles = 300
+    side = 18
+    rows = np.arange(number_particles)
+    positions = np.stack([(rows % side + 0.5) / side, (rows // side + 0.5) / side], axis=1)
+    angles = np.random.default_rng(0).uniform(0., 2. * np.pi, number_particles)
+    velocities = 1e-5 * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    velocities[0] = (3., 1.3)
+    box = Box((0.5, 0.5), (0., 0.), (0.5, 0.5))
+    box.add_particles(positions, velocities, np.full(number_particles, 0.015), np.ones(number_particles))
+
+    simulation = SimulationController('VectorizedMechanics', collision_handler='DiscreteDetection',
+                                      collision_detection='UniformGrid', processes=processes)
+    simulation.generate_world(box)
+    simulation.particles = box.particles
+    simulation.physics.g = np.zeros(2)
+    simulation.physics.sleep_energy = 1e-6
+    try:
+        simulation.run(steps, 0.002)
+    finally:
+        simulation.physics.close()
+
+    return simulation.particle_store, simulation.physics.sleeping(simulation.particle_store)
+
+
+def test_workers_put_particles_to_sleep():
+    expected, expected_asleep = run_sleeping(1)
+    store, asleep = run_sleeping(2)
+
+    assert 0 < asleep.sum() < len(asleep)
+    np.testing.assert_array_equal(asleep, expected_asleep)
+    np.testing.assert_array_equal(store.rest_steps, expected.rest_steps)
+    np.testing.assert_array_equal(store.positions, expected.positions)
+    np.testing.assert_array_equal(store.velocities, expected.velocities)
@@ -0,0 +1,52 @@
+import numpy as np
+
+from structures.BaseParticle import BaseParticle
+from structures.Box import Box
+
+
+def make_box(number_particles: int = 4) -> Box:
+    box = Box((0.5, 0.5), (0., 0.), (0.5, 0.5))
+    positions = np.stack([np.linspace(0.1, 0.9, number_particles), np.full(number_particles, 0.5)], axis=1)
+    box.add_particles(positions, np.zeros((number_particles, 2)), 0.01, 1.)
+    return box
+
+
+def test_handles_on_the_same_row_are_equal():
+    box = make_box()
+
+    assert box.particles[1] == box.particles[1]
+    assert box.particles[1] == BaseParticle.from_store(box.particle_store, 1)
+    assert box.particles[1] != box.particles[2]
+    assert len({box.particles[1], BaseParticle.from_store(box.particle_store, 1), box.particles[2]}) == 2
+
+
+def test_handles_of_different_stores_differ():
+    first = make_box()
+    second = make_box()
+
+    # Same state, different particles
+    assert first.particles[0] != second.particles[0]
+    assert first.particles[0] != 'not a particle'
+
+
+def test_handles_are_kept_between_accesses():
+    box = make_box()
+
+    assert box.particles[2] is box.particles[2]
+    assert list(box.particles)[2] is box.particles[2]
+
+
+def test_append_and_extend_add_to_the_construct():
+    box = make_box()
+    particle = BaseParticle((0.3, 0.3), (1., 0.))
+    others = [BaseParticle((0.7, 0.3), (0., 1.)), BaseParticle((0.7, 0.7), (-1., 0.))]
+
+    box.particles.append(particle)
+    box.particles.extend(others)
+
+    assert len(box.particles) == 7
+    assert box.particles[4] is particle
+    assert particle.parent is box
+    assert particle.store is box.particle_store
+    np.testing.assert_array_equal(box.particle_store.positions[4:], [[0.3, 0.3], [0.7, 0.3], [0.7, 0.7]])
+    np.testing.assert_array_equal(box.particles[6].velocity, [-1., 0.])
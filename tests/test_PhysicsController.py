@@ -0,0 +1,12 @@
+import pytest
+
+from controllers.PhysicsController import PhysicsController
+
+
+@pytest.mark.parametrize('physics_type, collision_handler', [('SimpleMechanics', 'DiscreteDetection'),
+                                                             ('VectorizedMechanics', 'ContinuousDetection')])
+def test_sleep_energy_warns_where_particles_never_sleep(physics_type, collision_handler):
+    physics = PhysicsController(physics_type, collision_detection='UniformGrid', collision_handler=collision_handler)
+
+    with pytest.warns(UserWarning, match='sleep_energy is ignored'):
+        physics.sleep_energy = 1e-6
@@ -0,0 +1,286 @@
+"""
+Statistics accumulated while a simulation runs, instead of from a trajectory written to disk afterwards
+
+Every analysis is an observer of SimulationController.run (and run_frames), sampling every interval calls. Memory use
+doesn't grow with the number of samples, each one only adds to fixed size accumulators.
+"""
+import numpy as np
+
+from .SpatialIndex import SpatialIndex
+from .BroadPhase import periodic_images, image_pairs, minimum_image
+
+
+class VelocityHistogram:
+    """
+    Distribution of particle speeds, to compare with the Maxwell-Boltzmann distribution of a 2D gas
+    """
+
+    def __init__(self, interval: int = 1, bins: int = 50, max_speed: float = None):
+        """
+        Init for VelocityHistogram
+        :param interval: sample every interval calls
+        :param bins: number of speed bins
+        :param max_speed: upper edge of the last bin, 4 times the rms speed of the first sample if None
+                          (faster particles are only counted in overflow)
+        """
+        self.interval = interval
+        self.bins = bins
+        self.max_speed = max_speed
+
+        self.edges = None
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.overflow = 0
+        self.sample_count = 0
+        self._calls = 0
+
+        # Sums over samples for the temperature, and the masses present for the expected distribution
+        self._kinetic_sum = 0.
+        self._particle_sum = 0
+        self._masses = None
+
+    def __call__(self, simulation) -> None:
+        # Observer interface of SimulationController.run
+        self._calls += 1
+        if self._calls % self.interval == 0:
+            self.sample(simulation)
+
+    def sample(self, simulation) -> None:
+        """
+        Add the current speeds of the world's particles to the histogram
+        """
+        store = simulation.particle_store
+        velocities = store.velocities.astype(np.float64, copy=False)
+        masses = store.masses.astype(np.float64, copy=False)
+        speeds = np.sqrt((velocities * velocities).sum(axis=1))
+
+        if self.edges is None:
+            max_speed = self.max_speed
+            if max_speed is None:
+                max_speed = 4. * np.sqrt(np.mean(speeds * speeds))
+            self.edges = np.linspace(0., max_speed if max_speed > 0. else 1., self.bins + 1)
+            self._masses = np.unique(masses, return_counts=True)
+
+        counts, _ = np.histogram(speeds, self.edges)
+        self.counts += counts
+        self.overflow += int((speeds > self.edges[-1]).sum())
+        self.sample_count += 1
+
+        self._kinetic_sum += 0.5 * np.dot(masses, speeds * speeds)
+        self._particle_sum += len(speeds)
+
+    @property
+    def centres(self) -> np.ndarray:
+        return 0.5 * (self.edges[1:] + self.edges[:-1])
+
+    @property
+    def density(self) -> np.ndarray:
+        """
+        Probability density of the speeds at the bin centres, overflow included in the normalisation
+        """
+        total = self.counts.sum() + self.overflow
+        return self.counts / (max(total, 1) * np.diff(self.edges))
+
+    @property
+    def temperature(self) -> float:
+        """
+        kT of the sampled particles, in 2D the mean kinetic energy per particle
+        """
+        return self._kinetic_sum / max(self._particle_sum, 1)
+
+    def maxwell_boltzmann(self, temperature: float = None) -> np.ndarray:
+        """
+        Maxwell-Boltzmann speed density of a 2D gas at the bin centres, p(v) = m v / kT exp(-m v^2 / 2 kT), averaged
+        over the masses of the particles
+        :param temperature: kT, the measured one if None
+        """
+        kt = self.temperature if temperature is None else temperature
+        speeds = self.centres
+        masses, counts = self._masses
+
+        density = masses[:, None] * speeds / kt * np.exp(-masses[:, None] * speeds * speeds / (2. * kt))
+        return counts @ density / counts.sum()
+
+    def results(self) -> dict:
+        return {'edges': self.edges, 'counts': self.counts, 'overflow': self.overflow, 'density': self.density,
+                'maxwell_boltzmann': self.maxwell_boltzmann(), 'temperature': self.temperature,
+                'samples': self.sample_count}
+
+
+def _rectangle_distance_cdf(r: np.ndarray, width: float, height: float) -> np.ndarray:
+    # Probability that two points drawn uniformly in a width x height rectangle are closer than r <= min(width, height)
+    return (np.pi * width * height * r ** 2 - 4. / 3. * (width + height) * r ** 3 + 0.5 * r ** 4) / \
+        (width * height) ** 2
+
+
+class RadialDistribution:
+    """
+    Radial distribution function g(r) of the particle centres
+    Pairs are found with the same K-D tree as the 'KDTree' broad phase. Centres can't get closer than a radius to the
+    walls, so g(r) is normalised against uniformly placed centres in that smaller rectangle, which keeps it at 1 for
+    an ideal gas right up to the walls. In a periodic box distances are taken between nearest images and there are no
+    walls to correct for.
+    """
+
+    def __init__(self, r_max: float, interval: int = 1, bins: int = 50):
+        """
+        Init for RadialDistribution
+        :param r_max: largest distance considered, at most the smaller side of the box (less than half of it if the
+                      box is periodic)
+        :param interval: sample every interval calls
+        :param bins: number of distance bins
+        """
+        self.r_max = r_max
+        self.interval = interval
+        self.edges = np.linspace(0., r_max, bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.sample_count = 0
+        self._calls = 0
+
+        # Expected share of the pairs in each bin for uniform centres, summed over samples
+        self._expected = np.zeros(bins)
+
+    def __call__(self, simulation) -> None:
+        # Observer interface of SimulationController.run
+        self._calls += 1
+        if self._calls % self.interval == 0:
+            self.sample(simulation)
+
+    def sample(self, simulation) -> None:
+        """
+        Add the pair distances of the world's particles to the histogram
+        """
+        store = simulation.particle_store
+        positions = store.positions.astype(np.float64, copy=False)
+        number_particles = len(positions)
+
+        world = simulation.world
+        period = world.period
+        if period is None:
+            pairs = SpatialIndex(positions).pairs_within(self.r_max)
+        else:
+            images, origins, _ = periodic_images(positions, world.lower, period, self.r_max)
+            pairs = image_pairs(SpatialIndex(images).pairs_within(self.r_max), origins, number_particles)
+        separation = minimum_image(positions[pairs[:, 0]] - positions[pairs[:, 1]], period)
+        counts, _ = np.histogram(np.hypot(separation[:, 0], separation[:, 1]), self.edges)
+        self.counts += counts
+
+        if period is None:
+            width, height = 2. * world.half_lengths - 2. * store.radii.mean()
+            if self.r_max > min(width, height):
+                raise ValueError(f"r_max {self.r_max} is larger than the space particles move in ({width}, {height})")
+            shares = np.diff(_rectangle_distance_cdf(self.edges, width, height))
+        else:
+            # Uniform centres on a torus, the share of pairs closer than r is the area of the disc over the box's
+            shares = np.diff(np.pi * self.edges ** 2) / np.prod(period)
+        self._expected += number_particles * (number_particles - 1) / 2. * shares
+        self.sample_count += 1
+
+    @property
+    def centres(self) -> np.ndarray:
+        return 0.5 * (self.edges[1:] + self.edges[:-1])
+
+    @property
+    def g(self) -> np.ndarray:
+        """
+        g(r) at the bin centres
+        """
+        return self.counts / np.where(self._expected > 0., self._expected, 1.)
+
+    def results(self) -> dict:
+        return {'edges': self.edges, 'counts': self.counts, 'g': self.g, 'samples': self.sample_count}
+
+
+class MeanSquaredDisplacement:
+    """
+    Mean squared displacement <|r(t0 + lag) - r(t0)|^2> against lag, averaged over particles and time origins
+    A new time origin starts every origin_interval samples and is followed for max_lag samples, so at most
+    max_lag / origin_interval copies of the positions are kept whatever the length of the run. In a periodic box
+    particles are followed across the sides, as long as they move less than half a side between two samples.
+    """
+
+    def __init__(self, interval: int = 1, max_lag: int = 100, origin_interval: int = 10):
+        """
+        Init for MeanSquaredDisplacement
+        :param interval: sample every interval calls
+        :param max_lag: longest lag, in samples
+        :param origin_interval: samples between two time origins
+        """
+        self.interval = interval
+        self.max_lag = max_lag
+        self.origin_interval = origin_interval
+
+        self.sums = np.zeros(max_lag + 1)
+        self.counts = np.zeros(max_lag + 1, dtype=np.int64)
+        self.sample_count = 0
+        self._calls = 0
+        self._times = []
+
+        # Positions followed through every step, and (first sample, position) of the live time origins
+        self._unwrapped = None
+        self._last = None
+        self._origins = []
+
+    def __call__(self, simulation) -> None:
+        # Observer interface of SimulationController.run
+        self._calls += 1
+        if self._calls % self.interval == 0:
+            self.sample(simulation)
+
+    def sample(self, simulation) -> None:
+        """
+        Add the displacements since each live time origin
+        """
+        positions = simulation.particle_store.positions.astype(np.float64)
+
+        if self._unwrapped is None:
+            self._unwrapped = positions.copy()
+        elif len(positions) != len(self._unwrapped):
+            raise ValueError("The number of particles changed, mean squared displacement can't follow them")
+        else:
+            self._unwrapped += minimum_image(positions - self._last, simulation.world.period)
+        self._last = positions
+
+        if self.sample_count % self.origin_interval == 0:
+            self._origins.append((self.sample_count, self._unwrapped.copy()))
+        if len(self._times) <= self.max_lag:
+            self._times.append(simulation.time)
+
+        for start, origin in self._origins:
+            lag = self.sample_count - start
+            displacement = self._unwrapped - origin
+            self.sums[lag] += (displacement * displacement).sum(axis=1).mean()
+            self.counts[lag] += 1
+
+        # Origins followed up to max_lag are done
+        self._origins = [(start, origin) for start, origin in self._origins
+                         if self.sample_count - start < self.max_lag]
+        self.sample_count += 1
+
+    @property
+    def lag_times(self) -> np.ndarray:
+        """
+        Simulated time of each lag, taken from the first samples (exact for a constant time step)
+        """
+        times = np.array(self._times)
+        return times - times[0] if len(times) > 0 else times
+
+    @property
+    def msd(self) -> np.ndarray:
+        """
+        Mean squared displacement of each lag sampled so far
+        """
+        sampled = self.counts > 0
+        return self.sums[sampled] / self.counts[sampled]
+
+    def results(self) -> dict:
+        return {'lag_times': self.lag_times[:len(self.msd)], 'msd': self.msd, 'samples': self.sample_count}
+
+
+def save_analysis(path: str, **analyses) -> None:
+    """
+    Write the results of several analyses to one .npz file, keys are prefixed with the name given to each
+    e.g. save_analysis('run.npz', speeds=histogram) stores speeds_edges, speeds_counts...
+    """
+    arrays = {f'{name}_{key}': value for name, analysis in analyses.items()
+              for key, value in analysis.results().items()}
+    np.savez(path, **arrays)
@@ -0,0 +1,280 @@
+import numpy as np
+
+
+def _expand_ranges(owners, starts, lengths):
+    """
+    Turn (owner, start, length) triplets into one (owner, index) couple per index in each range
+    :param owners: (M,) owner of each range
+    :param starts: (M,) first index of each range
+    :param lengths: (M,) length of each range
+    :return: (owners, indices) arrays with lengths.sum() elements each
+    """
+    lengths = np.asarray(lengths, dtype=np.intp)
+    total = lengths.sum()
+
+    repeated_owners = np.repeat(owners, lengths)
+    # Position of each element inside its own range
+    offsets = np.arange(total, dtype=np.intp) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    return repeated_owners, np.repeat(starts, lengths) + offsets
+
+
+def _sorted_pairs(firsts, seconds):
+    """
+    Order each pair as (low, high) and sort the pairs lexicographically, like itertools.combinations would
+    """
+    pairs = np.empty((len(firsts), 2), dtype=np.intp)
+    pairs[:, 0] = np.minimum(firsts, seconds)
+    pairs[:, 1] = np.maximum(firsts, seconds)
+
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
+def periodic_images(positions: np.ndarray, lower: np.ndarray, period: np.ndarray, reach: float) -> tuple:
+    """
+    Particles of a periodic box plus copies of the ones within reach of its sides, shifted by a period to lie just
+    past the opposite side, so that any broad phase run on them also finds the pairs across the sides
+    :param positions: (N, 2) positions inside the box
+    :param lower: lower corner of the box
+    :param period: (2,) side lengths of the box, more than twice reach
+    :param reach: largest distance at which two particles can interact
+    :return: (images, origins, shifts), (N + M, 2) positions starting with the particles themselves, (N + M,) particle
+             each one is a copy of and (N + M,) code of the shift, 0 for the particles themselves
+    """
+    if np.any(period <= 2. * reach):
+        raise ValueError(f"Periodic box of sides {tuple(period)} is too small for particles interacting up to {reach}")
+
+    offsets = positions - lower
+    near_lower = offsets < reach
+    near_upper = offsets >= period - reach
+
+    images = [positions]
+    origins = [np.arange(len(positions))]
+    shifts = [np.zeros(len(positions), dtype=np.intp)]
+    # Particles near the lower side are copied a period up, the ones near the upper side a period down, the ones
+    # near a corner diagonally too
+    for code, (shift_x, shift_y) in enumerate(((x, y) for x in (-1, 0, 1) for y in (-1, 0, 1)), start=1):
+        if shift_x == shift_y == 0:
+            continue
+        chosen = np.ones(len(positions), dtype=bool)
+        for axis, shift in ((0, shift_x), (1, shift_y)):
+            if shift != 0:
+                chosen &= near_lower[:, axis] if shift > 0 else near_upper[:, axis]
+        chosen = np.flatnonzero(chosen)
+
+        images.append(positions[chosen] + (np.array((shift_x, shift_y)) * period).astype(positions.dtype))
+        origins.append(chosen)
+        shifts.append(np.full(len(chosen), code, dtype=np.intp))
+
+    return np.concatenate(images), np.concatenate(origins), np.concatenate(shifts)
+
+
+def image_pairs(pairs: np.ndarray, origins: np.ndarray, number_particles: int) -> np.ndarray:
+    """
+    Turn pairs found among periodic_images into pairs of particles
+    :param pairs: (M, 2) pairs of indices in the images
+    :param origins: (N + K,) origins returned by periodic_images
+    :param number_particles: N
+    :return: (L, 2) array of particle pairs (i < j), sorted, each pair once
+    """
+    # Pairs of two copies repeat a pair with one of the particles themselves
+    pairs = pairs[(pairs[:, 0] < number_particles) | (pairs[:, 1] < number_particles)]
+    firsts = origins[pairs[:, 0]]
+    seconds = origins[pairs[:, 1]]
+    distinct = firsts != seconds
+    pairs = _sorted_pairs(firsts[distinct], seconds[distinct])
+
+    # A pair found through two of its images is kept once
+    repeated = np.zeros(len(pairs), dtype=bool)
+    repeated[1:] = np.all(pairs[1:] == pairs[:-1], axis=1)
+    return pairs[~repeated]
+
+
+def minimum_image(separation: np.ndarray, period) -> np.ndarray:
+    """
+    Separations between particles of a periodic box, brought to their shortest image
+    :param separation: (..., 2) differences of positions
+    :param period: (2,) side lengths of the box, None leaves separation as it is
+    """
+    if period is None:
+        return separation
+    period = np.asarray(period, dtype=separation.dtype)
+    return separation - period * np.rint(separation / period)
+
+
+def uniform_grid_pairs(positions: np.ndarray, radii: np.ndarray, cell_size: float = None) -> np.ndarray:
+    """
+    Broad phase binning particles in a uniform grid and only pairing particles of neighbouring cells
+    Cells are hashed, so only occupied cells cost memory whatever the extent of the particles
+    :param positions: (N, 2) particle positions
+    :param radii: (N,) particle radii
+    :param cell_size: side of a grid cell, defaults to the largest particle diameter
+    :return: (M, 2) array of candidate pairs (i < j), sorted
+    """
+    number_particles = len(positions)
+    if number_particles < 2:
+        return np.empty((0, 2), dtype=np.intp)
+
+    diameter = 2. * radii.max()
+    if cell_size is None:
+        cell_size = diameter
+    elif cell_size < diameter:
+        raise ValueError(f"Grid cells of size {cell_size} can miss overlaps of particles of diameter {diameter}")
+
+    if cell_size <= 0.:
+        # Point particles never overlap
+        return np.empty((0, 2), dtype=np.intp)
+
+    # Bin particles, shifting by one cell so that looking at neighbours never wraps to another column
+    cells = np.floor((positions - positions.min(axis=0)) / cell_size).astype(np.int64) + 1
+    rows = cells[:, 1].max() + 2
+    keys = cells[:, 0] * rows + cells[:, 1]
+
+    order = np.argsort(keys, kind='stable')
+    cell_keys, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+    # Cell of each particle, in sorted order
+    cell_of = np.repeat(np.arange(len(cell_keys)), counts)
+    sorted_index = np.arange(number_particles)
+
+    # Particles sharing a cell, each one pairs with those after it
+    ends = (starts + counts)[cell_of]
+    firsts, seconds = _expand_ranges(sorted_index, sorted_index + 1, ends - sorted_index - 1)
+    all_firsts = [firsts]
+    all_seconds = [seconds]
+
+    # Only half of the neighbouring cells are needed, the other half is covered from the other side
+    for dx, dy in ((1, -1), (1, 0), (1, 1), (0, 1)):
+        targets = cell_keys + dx * rows + dy
+        found = np.searchsorted(cell_keys, targets)
+        found[found == len(cell_keys)] = 0
+        found[cell_keys[found] != targets] = -1
+
+        neighbours = found[cell_of]
+        has_neighbour = neighbours >= 0
+        neighbours = neighbours[has_neighbour]
+
+        firsts, seconds = _expand_ranges(sorted_index[has_neighbour], starts[neighbours], counts[neighbours])
+        all_firsts.append(firsts)
+        all_seconds.append(seconds)
+
+    # Back from sorted order to particle indices
+    return _sorted_pairs(order[np.concatenate(all_firsts)], order[np.concatenate(all_seconds)])
+
+
+def uniform_grid_pairs_with(positions: np.ndarray, radii: np.ndarray, points: np.ndarray,
+                            point_radii: np.ndarray) -> np.ndarray:
+    """
+    Broad phase between two sets, pairs of other points (e.g. candidate positions) and the particles they may overlap
+    Only particles are binned, so points are never paired with one another however many share a cell
+    :param positions: (N, 2) particle positions
+    :param radii: (N,) particle radii
+    :param points: (M, 2) points
+    :param point_radii: (M,) radii of the points
+    :return: (K, 2) array of (row in points, particle) pairs
+    """
+    if len(positions) == 0 or len(points) == 0:
+        return np.empty((0, 2), dtype=np.intp)
+
+    # A point only reaches particles in the 3x3 cells around its own
+    cell_size = radii.max() + point_radii.max()
+    if cell_size <= 0.:
+        return np.empty((0, 2), dtype=np.intp)
+
+    origin = np.minimum(positions.min(axis=0), points.min(axis=0))
+    cells = np.floor((positions - origin) / cell_size).astype(np.int64) + 1
+    point_cells = np.floor((points - origin) / cell_size).astype(np.int64) + 1
+    rows = max(cells[:, 1].max(), point_cells[:, 1].max()) + 2
+    keys = cells[:, 0] * rows + cells[:, 1]
+    point_keys = point_cells[:, 0] * rows + point_cells[:, 1]
+
+    order = np.argsort(keys, kind='stable')
+    cell_keys, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+    point_index = np.arange(len(points))
+
+    all_points = []
+    all_particles = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            targets = point_keys + dx * rows + dy
+            found = np.searchsorted(cell_keys, targets)
+            found[found == len(cell_keys)] = 0
+            has_cell = cell_keys[found] == targets
+            found = found[has_cell]
+
+            owners, particles = _expand_ranges(point_index[has_cell], starts[found], counts[found])
+            all_points.append(owners)
+            all_particles.append(order[particles])
+
+    return np.stack([np.concatenate(all_points), np.concatenate(all_particles)], axis=1)
+
+
+class SweepAndPrune:
+    """
+    Sweep and prune broad phase along x, keeping particles sorted between calls
+    Particles move little from one step to the next, so last step's order is almost sorted and cheap to fix
+    """
+
+    def __init__(self):
+        self._order = None
+
+    def reset(self) -> None:
+        """
+        Forget the current order, next call sorts from scratch
+        """
+        self._order = None
+
+    def find_pairs(self, positions: np.ndarray, radii: np.ndarray, tracked: int = None,
+                   active: np.ndarray = None) -> np.ndarray:
+        """
+        Find the pairs of particles whose bounding boxes overlap
+        Only the first tracked rows are kept in order between calls, the rows after them (e.g. periodic images) are
+        sorted apart and merged in, and inactive rows are filtered out after sorting, so the kept order survives
+        images coming and going and particles falling asleep
+        :param positions: (N, 2) particle positions
+        :param radii: (N,) particle radii
+        :param tracked: number of leading rows that are the same particles from call to call, all of them if None
+        :param active: (N,) mask of the rows to pair, all of them if None
+        :return: (M, 2) array of candidate pairs (i < j) of rows, sorted
+        """
+        number_particles = len(positions)
+        tracked = number_particles if tracked is None else tracked
+        if number_particles < 2:
+            return np.empty((0, 2), dtype=np.intp)
+
+        lower_x = positions[:, 0] - radii
+        upper_x = positions[:, 0] + radii
+
+        if self._order is None or len(self._order) != tracked:
+            self._order = np.argsort(lower_x[:tracked], kind='stable')
+        else:
+            # Stable sort is timsort for floats, which finds the sorted runs and insertion sorts the few
+            # particles that swapped, so re-sorting an almost sorted order is close to linear
+            keys = lower_x[self._order]
+            if np.any(keys[1:] < keys[:-1]):
+                self._order = self._order[np.argsort(keys, kind='stable')]
+
+        order = self._order
+        if tracked < number_particles:
+            # Two sorted runs, timsort merges them in linear time
+            extra = tracked + np.argsort(lower_x[tracked:], kind='stable')
+            order = np.concatenate([order, extra])
+            order = order[np.argsort(lower_x[order], kind='stable')]
+        if active is not None:
+            order = order[active[order]]
+            if len(order) < 2:
+                return np.empty((0, 2), dtype=np.intp)
+
+        sorted_lower = lower_x[order]
+        sorted_upper = upper_x[order]
+
+        # Sweep, each interval pairs with the following ones starting before it ends
+        ends = np.searchsorted(sorted_lower, sorted_upper, side='right')
+        sorted_index = np.arange(len(order))
+        firsts, seconds = _expand_ranges(sorted_index, sorted_index + 1, ends - sorted_index - 1)
+        firsts = order[firsts]
+        seconds = order[seconds]
+
+        # Prune, the y intervals have to overlap too
+        keep = np.abs(positions[firsts, 1] - positions[seconds, 1]) <= radii[firsts] + radii[seconds]
+
+        return _sorted_pairs(firsts[keep], seconds[keep])
@@ -0,0 +1,201 @@
+import json
+import os
+import time
+import numpy as np
+
+from controllers.SimulationController import SimulationController
+from controllers.TimestepController import TimestepController
+from structures.BaseConstruct import BaseConstruct
+from structures.Box import Box
+
+CHECKPOINT_VERSION = 1
+# Constructs a checkpoint can hold, by class name
+CONSTRUCT_TYPES = {'Box': Box, 'BaseConstruct': BaseConstruct}
+# Per particle arrays of a store, all saved
+STORE_ARRAYS = ('positions', 'velocities', 'previous_positions', 'radii', 'masses', 'energies', 'rest_steps')
+PHYSICS_SETTINGS = ('physics_type', 'collision_detection', 'collision_handler', 'grid_cell_size', 'processes',
+                    'sleep_energy', 'sleep_steps')
+
+
+def _constructs(construct, parent_index=None, found=None) -> list:
+    # World and its children in depth first order, with the index of each one's parent
+    found = [] if found is None else found
+    found.append((construct, parent_index))
+    index = len(found) - 1
+    for child in construct.children:
+        _constructs(child, index, found)
+
+    return found
+
+
+def _construct_settings(construct, parent_index) -> dict:
+    kind = type(construct).__name__
+    if CONSTRUCT_TYPES.get(kind) is not type(construct):
+        raise ValueError(f"Can't checkpoint constructs of type {kind}, known types are {sorted(CONSTRUCT_TYPES)}")
+
+    settings = {'type': kind, 'parent': parent_index, 'position': construct.position.tolist(),
+                'velocity': construct.velocity.tolist(), 'static': bool(construct.static)}
+    if isinstance(construct, Box):
+        settings.update(half_lengths=construct.half_lengths.tolist(), border_material=construct.border_material,
+                        fill=construct.fill, boundary=construct.boundary)
+
+    return settings
+
+
+def save_checkpoint(simulation: SimulationController, path: str) -> None:
+    """
+    Write the whole state of a simulation to a binary snapshot, see load_checkpoint
+    The world hierarchy, particle arrays, physics and time step settings, step counter and the state of numpy's
+    global random generator are saved. The file is written next to path then moved over it, so an interruption never
+    leaves a half written checkpoint behind.
+    :param simulation: SimulationController to save, its particles must be the world's
+    :param path: file to write
+    """
+    world = simulation.world
+    if world is None:
+        raise ValueError("Simulation has no world to checkpoint")
+    if simulation.particles is not world.particles and len(simulation.particles) > 0:
+        raise ValueError("Only simulations stepping the world's particles can be checkpointed")
+
+    physics = simulation.physics
+    timestep = simulation.timestep
+    random_state = np.random.get_state()
+
+    arrays = {'random_keys': random_state[1]}
+    constructs = []
+    for index, (construct, parent_index) in enumerate(_constructs(world)):
+        settings = _construct_settings(construct, parent_index)
+        store = construct.particle_store
+        settings['particles'] = 0 if store is None else store.count
+        if store is not None:
+            for name in STORE_ARRAYS:
+                arrays[f'construct{index}_{name}'] = getattr(store, name)
+        constructs.append(settings)
+
+    metadata = {
+        'version': CHECKPOINT_VERSION,
+        # Python scalars, numpy ones (e.g. float32 time) aren't JSON serializable
+        'time': float(simulation.time),
+        'step_count': int(simulation.step_count),
+        'frame_dt': float(simulation.frame_dt),
+        'physics': {'backend': physics.backend, 'dtype': physics.dtype.str,
+                    **{name: getattr(physics, name) for name in PHYSICS_SETTINGS}},
+        'g': np.asarray(physics.g, dtype=float).tolist(),
+        'timestep': None if timestep is None else
+        {'courant': float(timestep.courant), 'dt_min': float(timestep.dt_min),
+         'dt_max': None if np.isinf(timestep.dt_max) else float(timestep.dt_max)},
+        'random_state': [random_state[0], int(random_state[2]), int(random_state[3]), float(random_state[4])],
+        'constructs': constructs,
+    }
+    arrays['metadata'] = np.array(json.dumps(metadata))
+
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as file:
+        np.savez(file, **arrays)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+def load_checkpoint(path: str, restore_random_state: bool = True) -> SimulationController:
+    """
+    Rebuild a simulation from a checkpoint written by save_checkpoint
+    Particles are read back as they were, nothing is generated again. Event driven engines start with fresh event
+    queues, predicted again from the saved state.
+    :param path: checkpoint file
+    :param restore_random_state: put numpy's global random generator back in its saved state
+    :return: SimulationController ready to carry on
+    """
+    with np.load(path, allow_pickle=False) as data:
+        metadata = json.loads(str(data['metadata']))
+        if metadata['version'] != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version {metadata['version']}")
+
+        physics_settings = metadata['physics']
+        simulation = SimulationController(physics_settings['physics_type'],
+                                          collision_handler=physics_settings['collision_handler'],
+                                          collision_detection=physics_settings['collision_detection'],
+                                          processes=physics_settings['processes'],
+                                          backend=physics_settings.get('backend', 'numpy'),
+                                          dtype=physics_settings.get('dtype', 'float64'))
+        for name in PHYSICS_SETTINGS:
+            setattr(simulation.physics, name, physics_settings[name])
+        simulation.physics.g = np.array(metadata['g'])
+
+        if metadata['timestep'] is not None:
+            simulation.timestep = TimestepController(**metadata['timestep'])
+        simulation.time = metadata['time']
+        simulation.step_count = metadata['step_count']
+        simulation.frame_dt = metadata['frame_dt']
+
+        constructs = []
+        for index, settings in enumerate(metadata['constructs']):
+            parent = None if settings['parent'] is None else constructs[settings['parent']]
+            if settings['type'] == 'Box':
+                construct = Box(settings['position'], settings['velocity'], settings['half_lengths'],
+                                border_material=settings['border_material'], fill=settings['fill'],
+                                static=settings['static'], parent=parent, dtype=simulation.dtype,
+                                boundary=settings.get('boundary', 'Reflective'))
+            else:
+                construct = CONSTRUCT_TYPES[settings['type']](settings['position'], settings['velocity'], parent,
+                                                              dtype=simulation.dtype)
+                construct.static = settings['static']
+
+            if parent is not None:
+                parent.children.append(construct)
+
+            if settings['particles'] > 0:
+                stored = {name: data[f'construct{index}_{name}'] for name in STORE_ARRAYS}
+                construct.add_particles(stored['positions'], stored['velocities'], stored['radii'], stored['masses'])
+                for name in ('previous_positions', 'energies', 'rest_steps'):
+                    getattr(construct.particle_store, name)[:] = stored[name]
+
+            constructs.append(construct)
+
+        if restore_random_state:
+            name, position, has_gauss, cached_gaussian = metadata['random_state']
+            np.random.set_state((name, data['random_keys'], position, has_gauss, cached_gaussian))
+
+    simulation.generate_world(constructs[0])
+    simulation.particles = constructs[0].particles
+
+    return simulation
+
+
+class AutoCheckpoint:
+    """
+    Observer writing checkpoints as a simulation runs, every so many calls and/or every so many seconds
+    Each checkpoint replaces the previous one atomically, so the file always holds a complete state
+    """
+
+    def __init__(self, path: str, interval: int = None, seconds: float = None):
+        """
+        Init for AutoCheckpoint
+        :param path: checkpoint file, overwritten each time
+        :param interval: checkpoint every interval calls (steps, or frames with run_frames)
+        :param seconds: checkpoint when at least this much wall clock time went by since the last one
+        """
+        if interval is None and seconds is None:
+            raise ValueError("Give an interval and/or a number of seconds between checkpoints")
+
+        self.path = path
+        self.interval = interval
+        self.seconds = seconds
+        self.checkpoint_count = 0
+
+        self._calls = 0
+        self._last = time.monotonic()
+
+    def __call__(self, simulation) -> None:
+        # Observer interface of SimulationController.run
+        self._calls += 1
+        due = self.interval is not None and self._calls % self.interval == 0
+        due = due or (self.seconds is not None and time.monotonic() - self._last >= self.seconds)
+
+        if due:
+            self.save(simulation)
+
+    def save(self, simulation) -> None:
+        save_checkpoint(simulation, self.path)
+        self.checkpoint_count += 1
+        self._last = time.monotonic()
@@ -0,0 +1,99 @@
+import numpy as np
+
+
+def measure(store, g) -> dict:
+    """
+    Totals over every particle of a store, a handful of array reductions
+    :param store: ParticleStore to measure
+    :param g: gravitational acceleration vector the potential energy is taken against
+    :return: dictionary with the 'kinetic' and 'potential' energies and the (2,) 'momentum'
+    """
+    # Sums are taken in float64 whatever the type of the store, float32 totals over many particles drift on their own
+    masses = store.masses.astype(np.float64, copy=False)
+    velocities = store.velocities.astype(np.float64, copy=False)
+    positions = store.positions.astype(np.float64, copy=False)
+
+    # Same definitions as PhysicsController.compute_energies, potential against g itself (-m * g . r)
+    kinetic = 0.5 * np.dot(masses, (velocities * velocities).sum(axis=1))
+    potential = -np.dot(masses, (np.asarray(g, dtype=np.float64) * positions).sum(axis=1))
+
+    return {'kinetic': kinetic, 'potential': potential, 'momentum': masses @ velocities}
+
+
+class EnergyDiagnostics:
+    """
+    Energy and momentum of a simulation over time, to check how well they are conserved
+    Use it as an observer of SimulationController.run, or call sample whenever a measurement is wanted
+    """
+
+    def __init__(self, interval: int = 1):
+        """
+        Init for EnergyDiagnostics
+        :param interval: when used as an observer, sample every interval calls (steps, or frames with run_frames)
+        """
+        self.interval = interval
+        self._calls = 0
+
+        self._steps = []
+        self._times = []
+        self._kinetic = []
+        self._potential = []
+        self._momentum = []
+
+    def __call__(self, simulation) -> None:
+        # Observer interface of SimulationController.run
+        self._calls += 1
+        if self._calls % self.interval == 0:
+            self.sample(simulation)
+
+    def sample(self, simulation) -> dict:
+        """
+        Measure the simulation now and add it to the series
+        :param simulation: SimulationController whose world particles are measured
+        :return: the measurement, see measure
+        """
+        totals = measure(simulation.particle_store, simulation.physics.g)
+
+        self._steps.append(simulation.step_count)
+        self._times.append(simulation.time)
+        self._kinetic.append(totals['kinetic'])
+        self._potential.append(totals['potential'])
+        self._momentum.append(totals['momentum'])
+
+        return totals
+
+    def __len__(self) -> int:
+        return len(self._steps)
+
+    @property
+    def steps(self) -> np.ndarray:
+        return np.array(self._steps, dtype=np.int64)
+
+    @property
+    def times(self) -> np.ndarray:
+        return np.array(self._times)
+
+    @property
+    def kinetic(self) -> np.ndarray:
+        return np.array(self._kinetic)
+
+    @property
+    def potential(self) -> np.ndarray:
+        return np.array(self._potential)
+
+    @property
+    def total(self) -> np.ndarray:
+        return self.kinetic + self.potential
+
+    @property
+    def momentum(self) -> np.ndarray:
+        return np.array(self._momentum).reshape(-1, 2)
+
+    def energy_drift(self) -> np.ndarray:
+        """
+        Change of the total energy since the first sample, relative to it
+        """
+        total = self.total
+        if len(total) == 0:
+            return total
+        return (total - total[0]) / np.abs(total[0])
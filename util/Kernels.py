@@ -0,0 +1,185 @@
+"""
+Compiled kernels for PhysicsController's 'numba' backend
+
+Each kernel is a plain loop doing the same floating point operations, in the same order, as the NumPy code it replaces
+in PhysicsController, so both backends give bit for bit the same results for float64 particles (float32 ones agree to
+rounding). numba is optional, without it the kernels still run as (slow) Python, which is only meant for checking them
+against the NumPy code.
+"""
+import math
+import numpy as np
+from fractions import Fraction
+
+from .Maths import dot_rows
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+NUMBA_AVAILABLE = numba is not None
+
+
+def _jit(function):
+    return numba.njit(cache=True)(function) if NUMBA_AVAILABLE else function
+
+
+if NUMBA_AVAILABLE:
+    from numba.core import types
+    from numba.extending import intrinsic
+
+    @intrinsic
+    def fused_multiply_add(typingctx, x, y, z):
+        # x * y + z rounded once, llvm.fma, in the type of the particle state
+        def codegen(context, builder, signature, arguments):
+            return builder.fma(*arguments)
+
+        if isinstance(x, types.Float) and x == y == z:
+            return x(x, y, z), codegen
+else:
+    def fused_multiply_add(x, y, z):
+        # x * y + z rounded once (twice for float32, through float64, close enough for checking the kernels)
+        return type(x)(Fraction(float(x)) * Fraction(float(y)) + Fraction(float(z)))
+
+
+def _dot_is_fused() -> bool:
+    # Whether the BLAS behind dot_rows (and np.dot) sums the last product with a fused multiply add, the kernels
+    # follow suit. For these vectors the last product is inexact and the first one exactly cancels the rounded result
+    a = np.array([[1., 1. + 2. ** -30]])
+    b = np.array([[-1., 1. + 2. ** -30]])
+
+    return dot_rows(a, b)[0] != 2. ** -29
+
+
+DOT_IS_FUSED = _dot_is_fused()
+
+
+@_jit
+def _bounce(positions, velocities, radii, index, lower, upper, continuous):
+    # Walls one axis after the other, as PhysicsController.bounce_off_walls
+    for axis in range(2):
+        if positions[index, axis] - radii[index] <= lower[axis]:
+            if continuous:
+                positions[index, axis] = 2. * (lower[axis] + radii[index]) - positions[index, axis]
+            else:
+                positions[index, axis] = lower[axis] + radii[index]
+            velocities[index, axis] = -1. * velocities[index, axis]
+
+        if positions[index, axis] + radii[index] >= upper[axis]:
+            if continuous:
+                positions[index, axis] = 2. * (upper[axis] - radii[index]) - positions[index, axis]
+            else:
+                positions[index, axis] = upper[axis] - radii[index]
+            velocities[index, axis] = -1. * velocities[index, axis]
+
+
+@_jit
+def bounce_off_walls(positions, velocities, radii, lower, upper, continuous):
+    """
+    Kernel of PhysicsController.bounce_off_walls
+    """
+    for index in range(len(radii)):
+        _bounce(positions, velocities, radii, index, lower, upper, continuous)
+
+
+@_jit
+def _wrap(positions, index, lower, upper):
+    # Periodic sides, as PhysicsController.wrap_positions
+    for axis in range(2):
+        if positions[index, axis] < lower[axis] or positions[index, axis] >= upper[axis]:
+            positions[index, axis] = lower[axis] + np.mod(positions[index, axis] - lower[axis],
+                                                          upper[axis] - lower[axis])
+
+
+@_jit
+def integrate(positions, velocities, previous_positions, radii, masses, energies, lower, upper, g, dt, continuous,
+              periodic, exponent):
+    """
+    Kernel of PhysicsController.integrate (and of iterate_position for 'SimpleMechanics'), one pass over the particles
+    :param exponent: 2. to square the speed through pow like compute_energy does, 0. for the sum of squares of
+                     compute_energies. Passed at run time for the same reason as in resolve_collisions
+    """
+    for index in range(len(radii)):
+        for axis in range(2):
+            previous_positions[index, axis] = positions[index, axis]
+            positions[index, axis] = positions[index, axis] + velocities[index, axis] * dt
+
+        if periodic:
+            _wrap(positions, index, lower, upper)
+        else:
+            _bounce(positions, velocities, radii, index, lower, upper, continuous)
+
+        for axis in range(2):
+            velocities[index, axis] = velocities[index, axis] + g[axis] * dt
+
+        # Same grouping as compute_energies, or compute_energy
+        vx = velocities[index, 0]
+        vy = velocities[index, 1]
+        if exponent > 0.:
+            kinetic = 0.5 * masses[index] * math.pow(math.sqrt(vx * vx + vy * vy), exponent)
+        else:
+            kinetic = 0.5 * masses[index] * (vx * vx + vy * vy)
+        potential = -masses[index] * (g[0] * positions[index, 0] + g[1] * positions[index, 1])
+        energies[index] = kinetic + potential
+
+
+@_jit
+def resolve_collisions(positions, velocities, radii, masses, pairs, exponent, fused_dot, period):
+    """
+    Kernel of PhysicsController.resolve_collisions, overlapping candidate pairs are deflected one after the other in
+    pair order (the NumPy version does it in batches, which gives the same result)
+    :param exponent: 2., passed at run time so the compiler can't turn pow(d, 2) into d * d, which rounds differently
+    :param fused_dot: whether dot products end with a fused multiply add, see DOT_IS_FUSED
+    :param period: (2,) sides of a periodic box, pairs are then taken through their nearest image, zeros otherwise
+    :return: (M,) mask of the pairs that collided
+    """
+    colliding = np.zeros(len(pairs), dtype=np.bool_)
+
+    for k in range(len(pairs)):
+        i = pairs[k, 0]
+        j = pairs[k, 1]
+
+        x1x = positions[i, 0]
+        x1y = positions[i, 1]
+        x2x = positions[j, 0]
+        x2y = positions[j, 1]
+        separation_x = x1x - x2x
+        separation_y = x1y - x2y
+        if period[0] > 0.:
+            # Same as util.BroadPhase.minimum_image, then the second particle is moved to that image
+            separation_x = separation_x - period[0] * np.rint(separation_x / period[0])
+            separation_y = separation_y - period[1] * np.rint(separation_y / period[1])
+            x2x = x1x - separation_x
+            x2y = x1y - separation_y
+        if not math.hypot(separation_x, separation_y) < radii[i] + radii[j]:
+            continue
+        colliding[k] = True
+
+        v1x = velocities[i, 0]
+        v1y = velocities[i, 1]
+        v2x = velocities[j, 0]
+        v2y = velocities[j, 1]
+        m1 = masses[i]
+        m2 = masses[j]
+
+        # Same expressions as perform_deflections
+        dx = x1x - x2x
+        dy = x1y - x2y
+        distance_squared = math.pow(math.sqrt(dx * dx + dy * dy), exponent)
+
+        if fused_dot:
+            dot1 = fused_multiply_add(v1y - v2y, dy, (v1x - v2x) * dx)
+            dot2 = fused_multiply_add(v2y - v1y, x2y - x1y, (v2x - v1x) * (x2x - x1x))
+        else:
+            dot1 = (v1x - v2x) * dx + (v1y - v2y) * dy
+            dot2 = (v2x - v1x) * (x2x - x1x) + (v2y - v1y) * (x2y - x1y)
+
+        factor1 = ((2 * m2) / (m1 + m2)) * (dot1 / distance_squared)
+        factor2 = ((2 * m1) / (m2 + m1)) * (dot2 / distance_squared)
+
+        velocities[i, 0] = v1x - factor1 * dx
+        velocities[i, 1] = v1y - factor1 * dy
+        velocities[j, 0] = v2x - factor2 * (x2x - x1x)
+        velocities[j, 1] = v2y - factor2 * (x2y - x1y)
+
+    return colliding
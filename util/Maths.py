@@ -17,3 +17,9 @@ def pol2cart(coordinates):
 
 def magnitude(vector):
     return np.sqrt((vector * vector).sum(axis=0))
+
+
+def dot_rows(a, b):
+    # Row by row dot product of two (N, k) arrays
+    # Goes through matmul so each row is summed exactly like np.dot(a[i], b[i]) would
+    return (a[:, None, :] @ b[:, :, None])[:, 0, 0]
@@ -1,7 +1,10 @@
 import numpy as np
 
 from structures.BaseParticle import BaseParticle
+from .BroadPhase import minimum_image
 
 
-def is_radial_overlap(particle1: BaseParticle, particle2: BaseParticle) -> bool:
-    return np.hypot(*(particle1.position - particle2.position)) < particle1.radius + particle2.radius
+def is_radial_overlap(particle1: BaseParticle, particle2: BaseParticle, period=None) -> bool:
+    # period: (2,) sides of a periodic box, particles are then compared through their nearest images
+    return np.hypot(*minimum_image(particle1.position - particle2.position, period)) < \
+        particle1.radius + particle2.radius
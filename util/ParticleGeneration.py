@@ -4,6 +4,7 @@ from collections.abc import Iterable
 
 from structures.BaseParticle import BaseParticle
 from .Overlaps import is_radial_overlap
+from .BroadPhase import uniform_grid_pairs, uniform_grid_pairs_with
 
 
 def _guarantee_radii_sequence(radius, amount):
@@ -17,32 +18,204 @@ def _guarantee_radii_sequence(radius, amount):
     return radius
 
 
-def generate_particles_in_box(number_particles: int, parent, radius: Union[float, Sequence[float], np.ndarray] = 0.01):
-    # TODO: Add a positions option
-    # TODO: Add a velocity option
+def _random_velocities(amount, random):
+    # Generate speed between 0. and 0.2 m/s
+    # Generate direction between [0, 2pi)
+    vr = 0.2 * random(amount)
+    vphi = 2 * np.pi * random(amount)
+
+    # Convert to cartesian
+    return vr[:, None] * np.stack([np.cos(vphi), np.sin(vphi)], axis=1)
+
+
+def _overlapping_pairs(positions, radii):
+    # Broad phase on a grid, then the same test as is_radial_overlap
+    pairs = uniform_grid_pairs(positions, radii)
+    separation = positions[pairs[:, 0]] - positions[pairs[:, 1]]
+
+    return pairs[np.hypot(separation[:, 0], separation[:, 1]) < radii[pairs[:, 0]] + radii[pairs[:, 1]]]
+
+
+def place_particles_batched(radii: np.ndarray, lower: np.ndarray, upper: np.ndarray, rng,
+                            existing_positions: np.ndarray = None, existing_radii: np.ndarray = None,
+                            batch_size: int = 4096, max_rounds: int = 1000) -> np.ndarray:
+    """
+    Random non overlapping placement, many candidates at a time
+    Every round each particle still waiting gets one or more candidate positions, the first candidate clear of
+    already placed particles is kept unless it overlaps the pick of a particle before it. Candidates are only tested
+    against the placed particles, then the picks against each other, so the many candidates of the last few
+    particles never get compared with one another
+    :param radii: (N,) radii of the particles to place
+    :param lower: lower corner of the area
+    :param upper: upper corner of the area
+    :param rng: numpy Generator
+    :param existing_positions: (M, 2) positions of particles to keep clear of
+    :param existing_radii: (M,) radii of particles to keep clear of
+    :param batch_size: rough number of candidates tried per round
+    :param max_rounds: give up after this many rounds
+    :return: (N, 2) positions
+    """
+    radii = np.asarray(radii, dtype=float)
+    room = (upper - lower)[None, :] - 2. * radii[:, None]
+    if np.any(room < 0.):
+        raise ValueError("Some particles are larger than the area they should be placed in")
+
+    positions = np.empty((len(radii), 2))
+    placed_positions = np.empty((0, 2)) if existing_positions is None else np.asarray(existing_positions)
+    placed_radii = np.empty(0) if existing_radii is None else np.asarray(existing_radii)
+    pending = np.arange(len(radii))
+
+    for _ in range(max_rounds):
+        if len(pending) == 0:
+            return positions
+
+        # Fewer particles left means more candidates each, the last ones are the hardest to fit
+        copies = max(1, batch_size // len(pending))
+        owners = np.repeat(pending, copies)
+        candidates = lower + radii[owners, None] + rng.random((len(owners), 2)) * room[owners]
+
+        clear = np.ones(len(owners), dtype=bool)
+        if len(placed_positions) > 0:
+            near = uniform_grid_pairs_with(placed_positions, placed_radii, candidates, radii[owners])
+            separation = candidates[near[:, 0]] - placed_positions[near[:, 1]]
+            overlapping = np.hypot(separation[:, 0], separation[:, 1]) < radii[owners[near[:, 0]]] + \
+                placed_radii[near[:, 1]]
+            clear[near[overlapping, 0]] = False
+
+        # First clear candidate of each particle
+        clear = clear.reshape(len(pending), copies)
+        has_clear = clear.any(axis=1)
+        chosen = np.zeros(len(owners), dtype=bool)
+        chosen[(np.arange(len(pending)) * copies + clear.argmax(axis=1))[has_clear]] = True
+
+        # Picks overlapping the pick of an earlier particle wait for the next round
+        picks = np.flatnonzero(chosen)
+        between = _overlapping_pairs(candidates[picks], radii[owners[picks]])
+        chosen[picks[between[:, 1]]] = False
+
+        accepted = np.nonzero(chosen)[0]
+        positions[owners[accepted]] = candidates[accepted]
+        placed_positions = np.concatenate([placed_positions, candidates[accepted]])
+        placed_radii = np.concatenate([placed_radii, radii[owners[accepted]]])
+        pending = np.setdiff1d(pending, owners[accepted], assume_unique=True)
+
+    if len(pending) == 0:
+        return positions
+    raise RuntimeError(f"Could not place {len(pending)} particles after {max_rounds} rounds, the area is too crowded")
+
+
+def place_particles_on_lattice(radii: np.ndarray, lower: np.ndarray, upper: np.ndarray, rng) -> np.ndarray:
+    """
+    Non overlapping placement on a square lattice with random jitter, one particle per lattice cell
+    Cells are at least as large as the largest particle so jittered particles never overlap
+    :param radii: (N,) radii of the particles to place
+    :param lower: lower corner of the area
+    :param upper: upper corner of the area
+    :param rng: numpy Generator
+    :return: (N, 2) positions
+    """
+    radii = np.asarray(radii, dtype=float)
+    size = upper - lower
+    diameter = 2. * radii.max() if len(radii) > 0 else 0.
+
+    cells = np.floor(size / diameter).astype(int) if diameter > 0. else np.array([len(radii), len(radii)])
+    cells = np.maximum(cells, 1)
+    if cells[0] * cells[1] < len(radii):
+        raise ValueError(f"A {cells[0]}x{cells[1]} lattice can't hold {len(radii)} particles")
+
+    cell_size = size / cells
+    # Random subset of the sites, in random order
+    sites = rng.permutation(cells[0] * cells[1])[:len(radii)]
+    centres = lower + (np.stack([sites // cells[1], sites % cells[1]], axis=1) + 0.5) * cell_size
+
+    slack = cell_size[None, :] / 2. - radii[:, None]
+    return centres + (2. * rng.random((len(radii), 2)) - 1.) * slack
+
+
+def generate_particles_in_box(number_particles: int, parent, radius: Union[float, Sequence[float], np.ndarray] = 0.01,
+                              method: str = 'Rejection', positions: np.ndarray = None, velocities: np.ndarray = None,
+                              seed: int = None):
+    """
+    Fill a box with particles
+    :param number_particles: number of particles to add
+    :param parent: Box to add the particles to
+    :param radius: one radius for all particles or one per particle
+    :param method: 'Rejection' places particles one at a time, 'Batched' many at a time with a grid for overlaps,
+                   'Lattice' on a jittered lattice
+    :param positions: (N, 2) positions to use instead of placing particles
+    :param velocities: (N, 2) velocities, or a single (2,) velocity for all, random if None
+    :param seed: seed of the random generator, for reproducible setups
+    :return: list of the new particles
+    """
+    if method == 'Rejection':
+        random = np.random.random if seed is None else np.random.default_rng(seed).random
+        return _generate_particles_by_rejection(number_particles, parent, radius, random, positions, velocities)
+
+    rng = np.random.default_rng(seed)
+
+    radii = np.empty(number_particles)
+    radii[:] = radius if not isinstance(radius, Iterable) else list(radius)
+
+    lower = parent.position - parent.half_lengths
+    upper = parent.position + parent.half_lengths
+
+    if positions is None:
+        if method == 'Batched':
+            store = parent.particle_store
+            positions = place_particles_batched(radii, lower, upper, rng,
+                                                None if store is None else store.positions,
+                                                None if store is None else store.radii)
+        elif method == 'Lattice':
+            if len(parent.particles) > 0:
+                raise ValueError("'Lattice' placement only works in an empty box")
+            positions = place_particles_on_lattice(radii, lower, upper, rng)
+        else:
+            raise ValueError(f"Unknown particle generation method '{method}'")
+
+    if velocities is None:
+        velocities = _random_velocities(number_particles, rng.random)
+
+    return parent.add_particles(positions, velocities, radii, radii)
+
+
+def _generate_particles_by_rejection(number_particles, parent, radius, random, positions=None, velocities=None):
     # If we do not have an iterable list/whatever of radii make a generator to make N particles of same size
     radius = _guarantee_radii_sequence(radius, number_particles)
 
     parent_size = parent.half_lengths * 2.
+    lower = parent.position - parent.half_lengths
+    if velocities is not None:
+        velocities = np.broadcast_to(velocities, (number_particles, 2))
+
+    added = []
 
     # Generate all of our particles
     for i, rad in enumerate(radius):
+        if positions is not None:
+            # Positions were given, nothing to place
+            vx, vy = _random_velocities(1, random)[0] if velocities is None else velocities[i]
+            added.append(parent.add_particle(BaseParticle(positions[i], (vx, vy), rad, mass=rad, parent=parent)))
+            continue
+
         # Currently, all positions are generated at random
         while True:
             overlaps = False
             # Dumb way to get min and max
             # Really just avoiding hardcoding it atm
 
-            # Place the particle somewhere pseudo-random
-            x, y = rad + (1 - 2 * rad) * (np.random.random(2) * parent_size)
+            # Place the particle somewhere pseudo-random, inside the box wherever it is
+            x, y = lower + rad + random(2) * (parent_size - 2 * rad)
 
-            # Generate speed between 0. and 1.0 m/s
-            # Generate direction between [0, 2pi)
-            vr = 0.2 * np.random.random()
-            vphi = 2 * np.pi * np.random.random()
+            if velocities is None:
+                # Generate speed between 0. and 1.0 m/s
+                # Generate direction between [0, 2pi)
+                vr = 0.2 * random()
+                vphi = 2 * np.pi * random()
 
-            # Convert to cartesian
-            vx, vy = vr * np.array([np.cos(vphi), np.sin(vphi)])
+                # Convert to cartesian
+                vx, vy = vr * np.array([np.cos(vphi), np.sin(vphi)])
+            else:
+                vx, vy = velocities[i]
 
             particle = BaseParticle((x, y), (vx, vy), rad, mass=rad, parent=parent)
             # print(particle.position)
@@ -53,5 +226,7 @@ def generate_particles_in_box(number_particles: int, parent, radius: Union[float
                     break
 
             if not overlaps:
-                parent.particles.append(particle)
+                added.append(parent.add_particle(particle))
                 break
+
+    return added
@@ -0,0 +1,157 @@
+import time
+from collections import defaultdict
+from typing import Callable
+
+# Phases timed by the controllers, in step order
+PHASES = ('integration', 'walls', 'events', 'broad_phase', 'narrow_phase', 'output')
+
+
+class _Phase:
+    # Context manager adding the time spent inside it to a phase of a profiler
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+
+class NullProfiler:
+    """
+    Profiler doing nothing, used when no profiling is wanted so instrumented code costs next to nothing
+    """
+    enabled = False
+    _no_phase = _NoPhase()
+
+    def phase(self, name: str):
+        return self._no_phase
+
+    def add_time(self, name: str, seconds: float) -> None:
+        pass
+
+    def count(self, name: str, amount: int = 1) -> None:
+        pass
+
+    def begin_step(self) -> None:
+        pass
+
+    def end_step(self, simulation=None) -> None:
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class StepProfiler(NullProfiler):
+    """
+    Times the phases of every step and counts what happened in them (candidate pairs, collisions...)
+    Give it to SimulationController.profiler, then read summary() or register hooks called after every step
+    """
+    enabled = True
+
+    def __init__(self, keep_records: bool = False):
+        """
+        Init for StepProfiler
+        :param keep_records: keep the record of every step in records, otherwise only totals are kept
+        """
+        self.keep_records = keep_records
+        self.records = []
+        self.hooks = []
+
+        self.step_count = 0
+        self.times = defaultdict(float)
+        self.counts = defaultdict(int)
+
+        self._step = None
+
+    def add_hook(self, hook: Callable) -> None:
+        """
+        Call hook after every step, with a dictionary holding the 'step', simulated 'time', seconds spent per phase
+        ('phases') and counts ('counts') of the step
+        """
+        self.hooks.append(hook)
+
+    def phase(self, name: str) -> _Phase:
+        """
+        Context manager timing a phase, time adds up if the phase is entered several times in a step
+        """
+        return _Phase(self, name)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        self.times[name] += seconds
+        if self._step is not None:
+            self._step['phases'][name] = self._step['phases'].get(name, 0.) + seconds
+
+    def count(self, name: str, amount: int = 1) -> None:
+        self.counts[name] += int(amount)
+        if self._step is not None:
+            self._step['counts'][name] = self._step['counts'].get(name, 0) + int(amount)
+
+    def begin_step(self) -> None:
+        # A step nobody closed (stepped outside of run) ends when the next one begins
+        if self._step is not None:
+            self.end_step()
+        self._step = {'step': None, 'time': None, 'phases': {}, 'counts': {}}
+
+    def end_step(self, simulation=None) -> None:
+        if self._step is None:
+            return
+
+        record = self._step
+        self._step = None
+        if simulation is not None:
+            record['step'] = simulation.step_count
+            record['time'] = simulation.time
+
+        self.step_count += 1
+        if self.keep_records:
+            self.records.append(record)
+        for hook in self.hooks:
+            hook(record)
+
+    def reset(self) -> None:
+        self.records = []
+        self.step_count = 0
+        self.times = defaultdict(float)
+        self.counts = defaultdict(int)
+        self._step = None
+
+    def summary(self) -> str:
+        """
+        Report of the time spent per phase and of the counts, in total and per step
+        """
+        steps = max(self.step_count, 1)
+        total = sum(self.times.values())
+
+        phases = [phase for phase in PHASES if phase in self.times] + \
+                 sorted(phase for phase in self.times if phase not in PHASES)
+        lines = [f"{self.step_count} steps, {total:.4f}s profiled",
+                 f"{'phase':<14}{'total (s)':>12}{'per step (ms)':>16}{'share':>9}"]
+        for phase in phases:
+            seconds = self.times[phase]
+            lines.append(f"{phase:<14}{seconds:>12.4f}{1e3 * seconds / steps:>16.4f}"
+                         f"{100. * seconds / max(total, 1e-300):>8.1f}%")
+
+        if self.counts:
+            lines.append(f"{'count':<14}{'total':>12}{'per step':>16}")
+            for name in sorted(self.counts):
+                lines.append(f"{name:<14}{self.counts[name]:>12}{self.counts[name] / steps:>16.1f}")
+
+        return '\n'.join(lines)
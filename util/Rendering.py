@@ -0,0 +1,213 @@
+import os
+import shutil
+import subprocess
+import multiprocessing
+import numpy as np
+from typing import Sequence
+
+from .Trajectory import TrajectoryReader
+
+# Colours given to particles by index when none are set (matplotlib's tab10)
+PALETTE = np.array([[31, 119, 180], [255, 127, 14], [44, 160, 44], [214, 39, 40], [148, 103, 189],
+                    [140, 86, 75], [227, 119, 194], [127, 127, 127], [188, 189, 34], [23, 190, 207]], dtype=np.uint8)
+BACKGROUND = (255, 255, 255)
+# Largest number of (particle, pixel) pairs tested at once
+PIXEL_CHUNK = 2 ** 22
+
+
+def particle_colors(number_particles: int) -> np.ndarray:
+    """
+    Default (N, 3) colours of particles, cycling through PALETTE
+    """
+    return PALETTE[np.arange(number_particles) % len(PALETTE)]
+
+
+def rasterize(positions: np.ndarray, radii: np.ndarray, lower, upper, size: Sequence[int] = (800, 800),
+              colors: np.ndarray = None, background=BACKGROUND, image: np.ndarray = None) -> np.ndarray:
+    """
+    Draw filled discs straight into an RGB image, all particles of the same size in pixels in one array operation
+    A pixel is painted when its centre is inside the disc, particles smaller than a pixel still paint the pixel holding
+    their centre. Particles later in the arrays are drawn on top.
+    :param positions: (N, 2) particle positions
+    :param radii: (N,) particle radii
+    :param lower: lower corner of the area to draw
+    :param upper: upper corner of the area to draw
+    :param size: (width, height) of the image in pixels, the area keeps its aspect ratio
+    :param colors: (N, 3) uint8 colours or a single colour, particle_colors if None
+    :param background: colour of the empty image
+    :param image: (height, width, 3) uint8 image to draw into instead of a new one
+    :return: (height, width, 3) uint8 image, y axis pointing up
+    """
+    width, height = size
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+
+    if image is None:
+        image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = background
+
+    number_particles = len(radii)
+    if number_particles == 0:
+        return image
+    if colors is None:
+        colors = particle_colors(number_particles)
+    colors = np.broadcast_to(np.asarray(colors, dtype=np.uint8), (number_particles, 3))
+
+    # Same scale on both axes so discs stay round
+    scale = min(width / (upper[0] - lower[0]), height / (upper[1] - lower[1]))
+    centres = (np.asarray(positions) - lower) * scale
+    pixel_radii = np.asarray(radii) * scale
+    extents = np.ceil(pixel_radii).astype(np.int64)
+
+    # Particles are drawn by groups covering the same square of pixels around their centre
+    for extent in np.unique(extents):
+        offsets = np.arange(-extent, extent + 1)
+        offset_x, offset_y = (o.ravel() for o in np.meshgrid(offsets, offsets))
+        members = np.flatnonzero(extents == extent)
+
+        step = max(1, PIXEL_CHUNK // len(offset_x))
+        for start in range(0, len(members), step):
+            chunk = members[start:start + step]
+            centre = centres[chunk]
+            base = np.floor(centre).astype(np.int64)
+
+            pixel_x = base[:, 0, None] + offset_x
+            pixel_y = base[:, 1, None] + offset_y
+            dx = pixel_x + 0.5 - centre[:, 0, None]
+            dy = pixel_y + 0.5 - centre[:, 1, None]
+
+            inside = (dx * dx + dy * dy <= (pixel_radii[chunk] * pixel_radii[chunk])[:, None]) | \
+                     ((offset_x == 0) & (offset_y == 0))
+            inside &= (pixel_x >= 0) & (pixel_x < width) & (pixel_y >= 0) & (pixel_y < height)
+
+            owner = np.broadcast_to(chunk[:, None], inside.shape)[inside]
+            image[height - 1 - pixel_y[inside], pixel_x[inside]] = colors[owner]
+
+    return image
+
+
+class FrameStreamer:
+    """
+    Encodes frames one at a time as they come, so only the frame being drawn is held in memory
+    Any format ffmpeg knows is written through a pipe to it. Without ffmpeg, '.gif' files are written with Pillow
+    (which needs every frame, so they are kept until close) and paths without an extension become a folder of
+    numbered PNG frames.
+    """
+
+    def __init__(self, path: str, size: Sequence[int] = (800, 800), fps: int = 30):
+        """
+        Init for FrameStreamer
+        :param path: output file, or folder for PNG frames
+        :param size: (width, height) of the frames
+        :param fps: frames per second of the video
+        """
+        self.path = path
+        self.width, self.height = size
+        self.fps = fps
+        self.frame_count = 0
+
+        self._process = None
+        self._gif_frames = None
+
+        extension = os.path.splitext(path)[1].lower()
+        ffmpeg = shutil.which('ffmpeg')
+        if extension and ffmpeg is not None:
+            self._process = subprocess.Popen(
+                [ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                 '-s', f'{self.width}x{self.height}', '-r', str(fps), '-i', '-', path],
+                stdin=subprocess.PIPE)
+        elif extension == '.gif':
+            self._gif_frames = []
+        elif not extension:
+            os.makedirs(path, exist_ok=True)
+        else:
+            raise RuntimeError(f"Writing '{extension}' files needs ffmpeg, use '.gif' or a folder for PNG frames")
+
+    def write(self, image: np.ndarray) -> None:
+        """
+        Add a (height, width, 3) uint8 frame
+        """
+        if image.shape != (self.height, self.width, 3):
+            raise ValueError(f"Frame is {image.shape}, expected {(self.height, self.width, 3)}")
+
+        if self._process is not None:
+            self._process.stdin.write(np.ascontiguousarray(image, dtype=np.uint8).tobytes())
+        else:
+            # Only needed without ffmpeg
+            from PIL import Image
+
+            frame = Image.fromarray(image)
+            if self._gif_frames is not None:
+                self._gif_frames.append(frame.quantize(colors=256))
+            else:
+                frame.save(os.path.join(self.path, f'frame_{self.frame_count:06d}.png'))
+
+        self.frame_count += 1
+
+    def close(self) -> None:
+        if self._process is not None:
+            self._process.stdin.close()
+            if self._process.wait() != 0:
+                raise RuntimeError(f"ffmpeg failed writing {self.path}")
+            self._process = None
+        elif self._gif_frames:
+            self._gif_frames[0].save(self.path, save_all=True, append_images=self._gif_frames[1:],
+                                     duration=round(1000 / self.fps), loop=0)
+            self._gif_frames = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def _render_trajectory_frames(task: tuple) -> list:
+    # Worker task of render_trajectory, every worker maps the trajectory itself
+    path, start, stop, radii, lower, upper, size, colors = task
+    with TrajectoryReader(path) as trajectory:
+        return [rasterize(trajectory.positions[frame], radii, lower, upper, size, colors)
+                for frame in range(start, stop)]
+
+
+def render_trajectory(path: str, output: str, size: Sequence[int] = (800, 800), fps: int = 30, radii=None,
+                      bounds=None, colors: np.ndarray = None, processes: int = None, chunk_frames: int = 16) -> int:
+    """
+    Render every frame of a trajectory file to a video, frames are drawn in a pool of processes and encoded in order
+    :param path: trajectory written by TrajectoryWriter
+    :param output: video file or folder, see FrameStreamer
+    :param size: (width, height) in pixels
+    :param fps: frames per second
+    :param radii: (N,) particle radii, taken from the trajectory if None
+    :param bounds: ((x, y), (x, y)) corners of the area to draw, taken from the trajectory if None
+    :param colors: (N, 3) uint8 colours, particle_colors if None
+    :param processes: number of drawing processes, all cores if None, 1 draws in this process
+    :param chunk_frames: frames drawn by a worker per task
+    :return: number of frames rendered
+    """
+    with TrajectoryReader(path) as trajectory:
+        frame_count = len(trajectory)
+        radii = trajectory.radii if radii is None else radii
+        bounds = trajectory.bounds if bounds is None else bounds
+
+    if radii is None or bounds is None:
+        raise ValueError("The trajectory holds no radii or bounds, give them to render it")
+    lower, upper = np.asarray(bounds, dtype=float)
+
+    tasks = [(path, start, min(start + chunk_frames, frame_count), np.asarray(radii), lower, upper, tuple(size),
+              colors) for start in range(0, frame_count, chunk_frames)]
+
+    pool = None if processes == 1 else multiprocessing.get_context().Pool(processes)
+    try:
+        # imap keeps the frame order while workers run ahead
+        chunks = map(_render_trajectory_frames, tasks) if pool is None else pool.imap(_render_trajectory_frames, tasks)
+        with FrameStreamer(output, size, fps) as streamer:
+            for images in chunks:
+                for image in images:
+                    streamer.write(image)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return frame_count
@@ -0,0 +1,97 @@
+import numpy as np
+from typing import Sequence, Union
+
+from .BroadPhase import _sorted_pairs
+
+
+class SpatialIndex:
+    """
+    K-D tree over particle positions, answering pair, radius and nearest neighbour queries
+    Build cost is O(N log N) and queries don't depend on how clustered the particles are
+    """
+
+    def __init__(self, positions: np.ndarray, leafsize: int = 16):
+        """
+        Init for SpatialIndex
+        :param positions: (N, 2) positions to index
+        :param leafsize: number of points at which the tree switches to brute force
+        """
+        # scipy is only loaded once a tree is built
+        from scipy.spatial import cKDTree
+
+        self.positions = np.asarray(positions)
+        self._tree = cKDTree(self.positions, leafsize=leafsize)
+
+    @classmethod
+    def from_construct(cls, construct, leafsize: int = 16):
+        """
+        Index the particles of a construct, indices are rows of its particle store
+        """
+        return cls(construct.particle_store.positions, leafsize=leafsize)
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def pairs_within(self, distance: float) -> np.ndarray:
+        """
+        All pairs of indexed points closer than distance
+        :param distance: maximum distance between the two points of a pair
+        :return: (M, 2) array of pairs (i < j), sorted
+        """
+        pairs = self._tree.query_pairs(distance, output_type='ndarray')
+        return _sorted_pairs(pairs[:, 0], pairs[:, 1])
+
+    def candidate_pairs(self, radii: np.ndarray) -> np.ndarray:
+        """
+        Broad phase, pairs of particles that may overlap given their radii
+        :param radii: (N,) radii of the indexed particles
+        :return: (M, 2) array of candidate pairs (i < j), sorted
+        """
+        if len(self) < 2:
+            return np.empty((0, 2), dtype=np.intp)
+
+        return self.pairs_within(2. * radii.max())
+
+    def query_radius(self, points: Union[Sequence[float], np.ndarray], radius: Union[float, np.ndarray]):
+        """
+        Indexed points within radius of each point
+        :param points: a single (2,) point or (M, 2) points
+        :param radius: search radius, one for all points or one per point
+        :return: array of indices for a single point, list of index arrays otherwise
+        """
+        neighbours = self._tree.query_ball_point(points, radius, return_sorted=True)
+
+        if np.ndim(points) == 1:
+            return np.asarray(neighbours, dtype=np.intp)
+        return [np.asarray(n, dtype=np.intp) for n in neighbours]
+
+    def pairs_with(self, points: np.ndarray, radius: Union[float, np.ndarray]) -> np.ndarray:
+        """
+        Pairs between other points and the indexed points within radius of them
+        :param points: (M, 2) points
+        :param radius: search radius, one for all points or one per point
+        :return: (K, 2) array of (row in points, indexed point) pairs
+        """
+        neighbours = self._tree.query_ball_point(points, radius, return_sorted=True)
+        counts = np.fromiter((len(n) for n in neighbours), dtype=np.intp, count=len(neighbours))
+        if counts.sum() == 0:
+            return np.empty((0, 2), dtype=np.intp)
+
+        return np.stack([np.repeat(np.arange(len(points)), counts),
+                         np.concatenate([n for n in neighbours if len(n) > 0]).astype(np.intp)], axis=1)
+
+    def count_within(self, points: Union[Sequence[float], np.ndarray], radius: Union[float, np.ndarray]):
+        """
+        Number of indexed points within radius of each point, cheaper than query_radius when indices aren't needed
+        """
+        return self._tree.query_ball_point(points, radius, return_length=True)
+
+    def nearest(self, points: Union[Sequence[float], np.ndarray], k: int = 1, max_distance: float = np.inf):
+        """
+        k nearest indexed points of each point
+        :param points: a single (2,) point or (M, 2) points
+        :param k: number of neighbours
+        :param max_distance: ignore neighbours further than this, missing neighbours have index len(self)
+        :return: (distances, indices)
+        """
+        return self._tree.query(points, k=k, distance_upper_bound=max_distance)
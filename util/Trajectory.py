@@ -0,0 +1,199 @@
+import json
+import os
+import numpy as np
+from typing import Sequence
+
+# File layout: MAGIC, then a JSON header padded with spaces to HEADER_SIZE bytes, then the radii if they were given
+# (version 2), then fixed size frame records
+MAGIC = b'SPSTRAJ1'
+HEADER_SIZE = 1024
+FIELDS = ('positions', 'velocities', 'energies')
+
+
+def _frame_dtype(number_particles: int, dtype, fields: Sequence[str]) -> np.dtype:
+    shapes = {'positions': (number_particles, 2), 'velocities': (number_particles, 2), 'energies': (number_particles,)}
+    return np.dtype([('step', '<i8'), ('time', '<f8')] +
+                    [(field, np.dtype(dtype).newbyteorder('<'), shapes[field]) for field in fields])
+
+
+class TrajectoryWriter:
+    """
+    Streams particle states to a binary trajectory file, buffering a chunk of frames and writing it in one go
+    Frames are fixed size records after a small header, so TrajectoryReader can memory map the file
+    """
+
+    def __init__(self, path: str, number_particles: int, dtype=np.float64, fields: Sequence[str] = FIELDS,
+                 chunk_frames: int = 64, interval: int = 1, radii: np.ndarray = None, bounds=None):
+        """
+        Init for TrajectoryWriter
+        :param path: file to write, overwritten if it exists
+        :param number_particles: number of particles in every frame
+        :param dtype: floating point type the state is written as
+        :param fields: which of 'positions', 'velocities' and 'energies' to write
+        :param chunk_frames: number of frames buffered in memory between writes
+        :param interval: when used as an observer, write every interval calls (steps, or frames with run_frames)
+        :param radii: (N,) particle radii, written once, needed to render the trajectory
+        :param bounds: ((x, y), (x, y)) lower and upper corners of the box, needed to render the trajectory
+        """
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown trajectory fields {sorted(unknown)}, expected some of {FIELDS}")
+
+        self.path = path
+        self.number_particles = number_particles
+        self.dtype = np.dtype(dtype)
+        self.fields = tuple(fields)
+        self.interval = interval
+        self.frame_count = 0
+        self._calls = 0
+        self.radii = None if radii is None else np.asarray(radii, dtype=self.dtype.newbyteorder('<'))
+        self.bounds = None if bounds is None else np.asarray(bounds, dtype=float).tolist()
+
+        self._buffer = np.zeros(chunk_frames, dtype=_frame_dtype(number_particles, self.dtype, self.fields))
+        self._buffered = 0
+
+        self._file = open(path, 'wb')
+        self._write_header()
+        if self.radii is not None:
+            self.radii.tofile(self._file)
+
+    def _write_header(self) -> None:
+        header = json.dumps({
+            'version': 2,
+            'number_particles': self.number_particles,
+            'dtype': self.dtype.str,
+            'fields': list(self.fields),
+            'frame_count': self.frame_count,
+            'radii': self.radii is not None,
+            'bounds': self.bounds,
+        }).encode()
+        if len(MAGIC) + len(header) > HEADER_SIZE:
+            raise ValueError("Trajectory header does not fit")
+
+        self._file.seek(0)
+        self._file.write(MAGIC + header.ljust(HEADER_SIZE - len(MAGIC)))
+        self._file.seek(0, os.SEEK_END)
+
+    def write_frame(self, store, time: float, step: int = 0) -> None:
+        """
+        Add the current state of a particle store to the trajectory
+        :param store: ParticleStore to record
+        :param time: simulated time of the frame
+        :param step: step count of the frame
+        """
+        if store.count != self.number_particles:
+            raise ValueError(f"Trajectory holds {self.number_particles} particles, store has {store.count}")
+
+        self._buffer['step'][self._buffered] = step
+        self._buffer['time'][self._buffered] = time
+        for field in self.fields:
+            self._buffer[field][self._buffered] = getattr(store, field)
+
+        self._buffered += 1
+        self.frame_count += 1
+        if self._buffered == len(self._buffer):
+            self.flush()
+
+    def __call__(self, simulation) -> None:
+        # Observer interface of SimulationController.run
+        self._calls += 1
+        if self._calls % self.interval == 0:
+            self.write_frame(simulation.particle_store, simulation.time, simulation.step_count)
+
+    def flush(self) -> None:
+        """
+        Write buffered frames to disk and bring the header up to date
+        """
+        if self._buffered > 0:
+            self._buffer[:self._buffered].tofile(self._file)
+            self._buffered = 0
+
+        self._write_header()
+        self._file.flush()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class TrajectoryReader:
+    """
+    Random access to the frames of a trajectory file through a memory map, nothing is read until used
+    """
+
+    def __init__(self, path: str):
+        """
+        Init for TrajectoryReader
+        :param path: trajectory file written by TrajectoryWriter
+        """
+        self.path = path
+
+        with open(path, 'rb') as file:
+            start = file.read(HEADER_SIZE)
+        if not start.startswith(MAGIC):
+            raise ValueError(f"{path} is not a trajectory file")
+
+        self.header = json.loads(start[len(MAGIC):].decode())
+        self.number_particles = self.header['number_particles']
+        self.dtype = np.dtype(self.header['dtype'])
+        self.fields = tuple(self.header['fields'])
+        self.bounds = self.header.get('bounds')
+
+        offset = HEADER_SIZE
+        self.radii = None
+        if self.header.get('radii', False):
+            radii_dtype = self.dtype.newbyteorder('<')
+            self.radii = np.fromfile(path, dtype=radii_dtype, count=self.number_particles, offset=offset)
+            offset += self.number_particles * radii_dtype.itemsize
+
+        frame_dtype = _frame_dtype(self.number_particles, self.dtype, self.fields)
+        # Trust the file size over the header, frames written before an interruption are still readable
+        frame_count = (os.path.getsize(path) - offset) // frame_dtype.itemsize
+
+        if frame_count > 0:
+            self.frames = np.memmap(path, dtype=frame_dtype, mode='r', offset=offset, shape=(frame_count,))
+        else:
+            self.frames = np.zeros(0, dtype=frame_dtype)
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    @property
+    def steps(self) -> np.ndarray:
+        return self.frames['step']
+
+    @property
+    def times(self) -> np.ndarray:
+        return self.frames['time']
+
+    @property
+    def positions(self) -> np.ndarray:
+        return self.frames['positions']
+
+    @property
+    def velocities(self) -> np.ndarray:
+        return self.frames['velocities']
+
+    @property
+    def energies(self) -> np.ndarray:
+        return self.frames['energies']
+
+    def close(self) -> None:
+        # Dropping the memory map closes the file
+        self.frames = np.zeros(0, dtype=self.frames.dtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()